@@ -43,9 +43,9 @@ if 'pop_up_opened' not in st.session_state:
     st.session_state['pop_up_opened'] = True
 
 
-junctions, collisions, notes = read_in_data()
-min_year = np.min(collisions['year'])
-max_year = np.max(collisions['year'])
+manifest = read_app_manifest()
+min_year = manifest['min_year']
+max_year = manifest['max_year']
 
 
 with st.expander("App settings", expanded=True):
@@ -67,11 +67,7 @@ with st.expander("App settings", expanded=True):
                 step=10
             )
         with col3:
-            available_boroughs = sorted(
-                list(
-                    collisions['borough'].dropna().unique()
-                )
-            )
+            available_boroughs = manifest['boroughs']
             boroughs = st.multiselect(
                 label='Filter by borough',
                 options=['ALL'] + available_boroughs,
@@ -85,18 +81,15 @@ with st.expander("App settings", expanded=True):
 if len(boroughs) == 0:
     st.warning('Please select at least one borough and recalculate', icon='⚠️')
 else:
-    junction_collisions = combine_junctions_and_collisions(
-        junctions,
-        collisions,
-        notes,
-        casualty_type
-    )
     dangerous_junctions = calculate_dangerous_junctions(
-        junction_collisions,
         n_junctions,
         casualty_type,
         boroughs
     )
+    junction_collisions = read_in_data(
+        casualty_type,
+        dangerous_junctions['junction_cluster_id'].tolist()
+    )
 
     # set default to worst junction...
     if (
@@ -124,7 +117,7 @@ else:
 
         high_map = create_base_map(initial_location=[51.5080, -.1281], initial_zoom=10)  # set to trafalgar sq.
 
-        high_feature_group = get_high_level_fg(dangerous_junctions, junction_collisions, n_junctions)
+        high_feature_group = get_high_level_fg(dangerous_junctions, junction_collisions, n_junctions, casualty_type)
         map_click = st_folium(
             high_map,
             feature_group_to_add=high_feature_group,
@@ -0,0 +1,70 @@
+"""
+Benchmark ranking the most dangerous junctions from the prebuilt danger cube (bincount + argpartition)
+against the previous groupby + full sort of every collision, at London scale.
+
+Run from the repo root: python benchmarks/bench_danger_ranking.py [number of collisions] [number of clusters]
+"""
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from danger_ranking import DangerCube
+from reference import rank_dangerous_junctions_groupby
+from synthetic_data import BOROUGHS, make_junction_collisions
+
+
+def time_function(func, *args, repeats: int = 5) -> tuple:
+    """
+    Best time over repeats + the result
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    n_collisions = int(sys.argv[1]) if len(sys.argv) > 1 else 250_000
+    n_clusters = int(sys.argv[2]) if len(sys.argv) > 2 else 120_000
+    junction_collisions = make_junction_collisions(n_collisions, n_clusters)
+    print(
+        f'Ranking {len(junction_collisions)} collisions at '
+        f'{junction_collisions["junction_cluster_id"].nunique()} junction clusters'
+    )
+
+    start = time.perf_counter()
+    cube = DangerCube.from_junction_collisions(junction_collisions, 'cyclist')
+    print(f'Built danger cube of {len(cube)} cells in {time.perf_counter() - start:.1f}s')
+
+    for boroughs in [['ALL'], BOROUGHS[:3], BOROUGHS[:1]]:
+        if 'ALL' in boroughs:
+            data = junction_collisions
+        else:
+            data = junction_collisions[junction_collisions['borough'].isin(boroughs)]
+
+        for n_junctions in [20, 100]:
+            groupby_time, expected = time_function(rank_dangerous_junctions_groupby, data, n_junctions, 'cyclist')
+            cube_time, result = time_function(cube.rank, boroughs, n_junctions, 'cyclist')
+
+            pd.testing.assert_frame_equal(
+                result.drop(columns='yearly_danger_metrics'),
+                expected.drop(columns=['index', 'notes']),
+                check_dtype=False
+            )
+
+            print(
+                f'{len(boroughs) if "ALL" not in boroughs else "all":>3} boroughs, top {n_junctions:>3}: '
+                f'groupby {groupby_time * 1000:7.1f}ms, '
+                f'cube {cube_time * 1000:5.1f}ms ({groupby_time / cube_time:.0f}x faster)'
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark the column-wise collision normalisation against the row-wise version.
+
+Run from the repo root: python benchmarks/bench_normalise.py
+"""
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from normalise import (
+    upper_case, clean_collision_ids, format_times
+)
+from reference import clean_collision_id, format_time
+
+
+def make_collisions(n: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Synthetic collisions with the same formats as the TfL extracts
+    """
+    rng = np.random.default_rng(seed)
+    hours = rng.integers(0, 24, n)
+    minutes = rng.integers(0, 60, n)
+    time_formats = rng.integers(0, 3, n)
+    times = [
+        f"'{h:02d}{m:02d}" if f == 0 else f'{h:02d}:{m:02d}' if f == 1 else f'{h:02d}:{m:02d}:00'
+        for h, m, f in zip(hours, minutes, time_formats)
+    ]
+
+    return pd.DataFrame({
+        'raw_collision_id': rng.integers(10 ** 8, 5 * 10 ** 9, n),
+        'year': rng.integers(2015, 2025, n),
+        'borough': rng.choice(['Camden', 'City of London', 'Westminster', 'Brent'], n),
+        'location': rng.choice(['Old St j/w City Rd', 'A40 Westway', 'Euston Rd'], n),
+        'time': times,
+    })
+
+
+def row_wise(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy()
+    for col in ['borough', 'location']:
+        df[col] = df[col].apply(lambda x: x.upper())
+    df['collision_id'] = df.apply(
+        lambda row: clean_collision_id(row['raw_collision_id'], row['year'], row['borough']), axis=1
+    )
+    df['time'] = df['time'].apply(format_time)
+    return df
+
+
+def column_wise(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy()
+    for col in ['borough', 'location']:
+        df[col] = upper_case(df[col])
+    df['collision_id'] = clean_collision_ids(df['raw_collision_id'], df['year'])
+    df['time'] = format_times(df['time'])
+    return df
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    df = make_collisions(n)
+    print(f'Normalising {n} collisions')
+
+    start = time.perf_counter()
+    expected = row_wise(df)
+    row_wise_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = column_wise(df)
+    column_wise_time = time.perf_counter() - start
+
+    pd.testing.assert_frame_equal(result, expected)
+
+    print(f'row-wise:    {row_wise_time:.2f}s')
+    print(f'column-wise: {column_wise_time:.2f}s ({row_wise_time / column_wise_time:.0f}x faster)')
+
+
+if __name__ == "__main__":
+    main()
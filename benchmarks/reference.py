@@ -0,0 +1,249 @@
+"""
+The previous versions of functions in src/ that have since been optimised, kept out of src/ as nothing
+runs them, only the tests + benchmarks that check the new versions give the same results.
+
+Import with src/ on the path, as the benchmarks + tests do.
+"""
+import numpy as np
+import pandas as pd
+import osmnx as ox
+
+from danger_ranking import CLUSTER_ATTRIBUTES, get_sum_columns
+from junction_names import ABBREVIATIONS
+
+
+# ====================== DANGER RANKING ===================================== #
+
+
+def rank_dangerous_junctions_groupby(
+    junction_collisions: pd.DataFrame,
+    n_junctions: int,
+    casualty_type: str
+) -> pd.DataFrame:
+    """
+    Calculate most dangerous junctions in data and return n worst.
+    """
+    dangerous_junctions = (
+        junction_collisions
+        .groupby(CLUSTER_ATTRIBUTES)[get_sum_columns(casualty_type)]
+        .sum()
+        .reset_index()
+        .sort_values(by=['recency_danger_metric', f'fatal_{casualty_type}_casualties'], ascending=[False, False])
+        .head(n_junctions)
+        .reset_index()
+    )
+
+    dangerous_junctions['junction_rank'] = dangerous_junctions.index + 1
+
+    return dangerous_junctions
+
+
+# ====================== JUNCTION NAMES ===================================== #
+
+
+def combine_names(names) -> list:
+    '''
+    Takes a list of names, flattens them and returns unique list
+    '''
+    if type(names) == str:
+        return [names]
+
+    flat_names = []
+    for n in names:
+        if type(n) == list:
+            for m in n:
+                flat_names.append(m)
+        else:
+            flat_names.append(n)
+
+    unique_names = list(set(flat_names))
+
+    return unique_names
+
+
+def shorten_road_name(name: str) -> str:
+    '''
+    Shortern elements of road names to save space
+    '''
+    for k, v in ABBREVIATIONS.items():
+        name = name.replace(k, v)
+    return name
+
+
+def list_to_string_name(names: list) -> str:
+    '''
+    Convert list of names for junction to a string
+    '''
+    names = [name for name in names if (name != '') & (name == name)]
+
+    name = '-'.join(names)
+    if name == '':
+        name = 'Unknown'
+    return name
+
+
+def name_junctions_row_wise(lower_level_graph, nodes_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Create names for junctions using the edge names from graph
+    """
+    junction_names = (
+        ox
+        .graph_to_gdfs(lower_level_graph, nodes=False)
+        .reset_index()
+        [['u', 'name']]
+        .fillna('')
+    )
+
+    junction_names['name'] = junction_names['name'].apply(combine_names)
+
+    nodes_df = nodes_df.merge(
+        junction_names,
+        how='left',
+        left_on='junction_id',
+        right_on='u'
+    )
+
+    cluster_names = (
+        nodes_df
+        .groupby('junction_cluster_id')['name']
+        .apply(combine_names)
+        .reset_index()
+    )
+
+    nodes_df = nodes_df.merge(
+        cluster_names,
+        how='left',
+        on='junction_cluster_id',
+        suffixes=['', '_cluster']
+    )
+
+    nodes_df['junction_cluster_name'] = nodes_df['name_cluster'].apply(list_to_string_name)
+
+    nodes_df['junction_cluster_name'] = nodes_df['junction_cluster_name'].apply(shorten_road_name)
+
+    nodes_df['name_rank'] = (
+        nodes_df
+        .groupby(['junction_cluster_name'])['junction_cluster_id']
+        .transform('rank', method='dense')
+    )
+
+    nodes_df['name_max_rank'] = (
+        nodes_df
+        .groupby(['junction_cluster_name'])['name_rank']
+        .transform('max')
+    )
+
+    nodes_df['junction_cluster_name'] = np.where(
+        nodes_df['name_max_rank'] == 1,
+        nodes_df['junction_cluster_name'],
+        nodes_df['junction_cluster_name'] + '-' + nodes_df['name_rank'].astype(int).astype(str)
+    )
+
+    nodes_df.drop(columns=['name', 'u', 'name_rank', 'name_cluster'], inplace=True)
+
+    # finally, drop dups
+    nodes_df = nodes_df.drop_duplicates()
+
+    return nodes_df
+
+
+# ====================== NORMALISE ===================================== #
+
+
+def clean_collision_id(raw_collision_id: str, year: int, borough: str) -> int:
+    """
+    Make TfL collision ids match the stats19 ones
+    """
+    if year < 2017:
+        collision_id = str(year) + str(raw_collision_id)[0:2] + str(raw_collision_id)[-7:]
+    elif str(raw_collision_id)[0:2] == '48':
+        # edge case for city of london
+        collision_id = str(year) + '48' + str(raw_collision_id)[-7:]
+    else:
+        collision_id = str(year) + '01' + str(raw_collision_id)[-7:]
+    collision_id = int(collision_id)
+    return collision_id
+
+
+def format_time(time: str) -> str:
+    """
+    Format time if in format '0731 (rather than 07:31)
+    """
+    if time[0] == "'":
+        time = f'{time[1:3]}:{time[3:]}'
+
+    # for when time in format '00:00' rather than '00:00:00'
+    split_time = time.split(':')
+    if len(split_time) == 2:
+        time = time + ':00'
+    
+    return time
+
+
+# ====================== SEVERITY ===================================== #
+
+
+def accident_severity_counts(row):
+    '''
+    Count severities of each type
+    '''
+    severities = row['casualty_severity']
+    severities = severities.tolist()
+
+    fatal = severities.count('fatal')
+    serious = severities.count('serious')
+    slight = severities.count('slight')
+
+    return fatal, serious, slight
+
+
+def get_max_severity(row, casualty_type):
+    '''
+    Finds the max severity of a cyclist in collision
+    '''
+    if row[f'fatal_{casualty_type}_casualties'] > 0:
+        return 'fatal'
+    if row[f'serious_{casualty_type}_casualties'] > 0:
+        return 'serious'
+    if row[f'slight_{casualty_type}_casualties'] > 0:
+        return 'slight'
+    else:
+        return None
+
+
+def recalculate_severity(casualties, mode_of_travel):
+    '''
+    recalculate severities based on cyclists or pedestrian only + apply weightings
+    '''
+    recalculated_severities = (
+        casualties
+        [casualties['mode_of_travel'] == mode_of_travel]
+        .groupby('collision_id')
+        .apply(accident_severity_counts, include_groups=False)
+        .reset_index()
+    )
+
+    if mode_of_travel == 'pedal_cycle':
+        casualty_type = 'cyclist'
+    else:
+        casualty_type = mode_of_travel
+
+    # split out cols
+    new_cols = [
+        f'fatal_{casualty_type}_casualties',
+        f'serious_{casualty_type}_casualties',
+        f'slight_{casualty_type}_casualties'
+    ]
+    recalculated_severities[new_cols] = pd.DataFrame(
+        recalculated_severities[0].tolist(),
+        index=recalculated_severities.index
+    )
+
+    recalculated_severities[f'max_{casualty_type}_severity'] = recalculated_severities.apply(
+        lambda row: get_max_severity(row, casualty_type), axis=1
+    )
+
+    # remove unrequired cols
+    recalculated_severities.drop(columns=[0], inplace=True)
+
+    return recalculated_severities
@@ -0,0 +1,29 @@
+import os
+import sys
+
+# pipeline modules are imported as top level modules, as when running the scripts in src/
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
+
+# the previous versions of optimised functions, to check against
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'benchmarks'))
+
+import pytest
+import pandas as pd
+
+from mapping_store import hash_mapping_inputs
+
+
+@pytest.fixture
+def collisions_to_map() -> pd.DataFrame:
+    """
+    Collisions as stage 04 maps them, with the hash of the columns they're mapped from
+    """
+    collisions = pd.DataFrame({
+        'collision_index': [1, 2, 3, 4],
+        'year': [2022, 2022, 2023, 2023],
+        'easting': [530000., 530100., 530200., 530300.],
+        'northing': [180000., 180100., 180200., 180300.],
+        'location': ['OLD STREET J/W CITY ROAD', None, 'HIGH ROAD', 'HIGH ROAD'],
+    })
+    collisions['input_hash'] = hash_mapping_inputs(collisions)
+    return collisions
@@ -1,6 +1,3 @@
-# script to process collision data.
+# script to process collision data, stages that are up to date are skipped (see src/pipeline.py)
 source venv/bin/activate
-python src/01-download-tfl-data.py
-python src/02-filter-data.py
-python src/03-build-junctions-graph.py
-python src/04-map-collisions-to-graph.py
\ No newline at end of file
+python src/pipeline.py "$@"
\ No newline at end of file
@@ -1,11 +1,21 @@
 import re
 import yaml
-import requests
+import argparse
 import pandas as pd
 
-from io import StringIO
 from yaml import Loader
 from convertbng.util import convert_lonlat
+from tfl_extracts import fetch_links, parse_extracts
+from normalise import upper_case, clean_collision_ids, format_times, apply_value_aliases
+from corrections import apply_corrections
+from schema import SCHEMA_VERSION, write_table
+from ingest_store import (
+    group_links_by_year, settings_hash, source_entry, needs_ingest,
+    read_manifest, write_manifest, write_partition, remove_stale_partitions, read_partitions
+)
+
+# bump when the formatting of ingested data changes, so all years are re-ingested
+INGEST_VERSION = 3
 
 
 def extract_columns(df: pd.DataFrame, schema: dict) -> pd.DataFrame:
@@ -36,21 +46,6 @@ def format_name(name: str) -> str:
     return name
 
 
-def clean_collision_id(raw_collision_id: str, year: int, borough: str) -> int:
-    """
-    Make TfL collision ids match the stats19 ones
-    """
-    if year < 2017:
-        collision_id = str(year) + str(raw_collision_id)[0:2] + str(raw_collision_id)[-7:]
-    elif str(raw_collision_id)[0:2] == '48':
-        # edge case for city of london
-        collision_id = str(year) + '48' + str(raw_collision_id)[-7:]
-    else:
-        collision_id = str(year) + '01' + str(raw_collision_id)[-7:]
-    collision_id = int(collision_id)
-    return collision_id
-
-
 def format_category(val: str, categories: list) -> str:
     """
     Format category names to be consistent
@@ -64,21 +59,6 @@ def format_category(val: str, categories: list) -> str:
     return val
     
     
-def format_time(time: str) -> str:
-    """
-    Format time if in format '0731 (rather than 07:31)
-    """
-    if time[0] == "'":
-        time = f'{time[1:3]}:{time[3:]}'
-
-    # for when time in format '00:00' rather than '00:00:00'
-    split_time = time.split(':')
-    if len(split_time) == 2:
-        time = time + ':00'
-    
-    return time
-
-
 def create_alias_dict(alias_df, alias_type):
     alias_dict = {}
     alias_df = alias_df[alias_df['type'] == alias_type]
@@ -88,94 +68,22 @@ def create_alias_dict(alias_df, alias_type):
     return alias_dict
 
 
-def process_yearly_data(links: list, required_cols, aliases) -> pd.DataFrame:
-    """
-    Loop through TfL  download links, download, format and combine.
-    """
-    dfs = []
-
-    with requests.Session() as session:
-        for link in links:
-            print(f'Processing: {link}')
-            download = session.get(link)
-
-            n = 0
-            cols = ['Unnamed:']
-            while len([c for c in cols if 'Unnamed:' in c]) > 0:
-                df = pd.read_csv(
-                    StringIO(download.content.decode(encoding='utf-8', errors='replace')),
-                    encoding='unicode_escape',
-                    low_memory=False,
-                    skiprows=n
-                )
-                cols = df.columns
-                n += 1
-            
-            df.columns = [col.strip() for col in df.columns]
-            df.rename(columns=aliases, inplace=True)
-
-            df = df[required_cols]
-
-            if len(df[df.isnull().any(axis=1)]) > 0:
-                print('Rows to be deleted...')
-                print(df[df.isnull().any(axis=1)])
-                df = df[~df.isnull().any(axis=1)]
-
-            df.loc[:, 'raw_collision_id'] = df.loc[:, 'raw_collision_id'].astype(int)
-
-            print(f'Added {len(df)} rows')
-            
-            dfs.append(df)
-
-    combined_df = pd.concat(dfs)
-    return combined_df
-
-
-def correct_data(df: pd.DataFrame, corrections: dict) -> pd.DataFrame:
+def create_column_alias_dict(alias_df, alias_type):
     """
-    Data is sometimes incorrect in stats19, this function updates values
+    Alias dicts scoped to the column they apply to, i.e. {column: {alias: consistent_name}}
     """
-    for collision_id, corrections in corrections.items():
-        print(f'Correcting collision id: {collision_id}')
-        
-        print(f'Data pre-correction:')
-        print(df.loc[df['collision_id'] == collision_id, ].T)
-
-        for col, val in corrections.items():
-            df.loc[df['collision_id'] == collision_id, [col]] = val
-
-        print(f'Data post-correction:')
-        print(df.loc[df['collision_id'] == collision_id, ].T)
-
-    return df
-
-
-def main():
-    # supress .replace() warnings
-    pd.set_option('future.no_silent_downcasting', True)
-
-    params = yaml.load(open("params.yaml", 'r'), Loader=Loader)
-    data_corrections = yaml.load(open("data_corrections.yaml", 'r'), Loader=Loader)
-
-    aliases = pd.read_csv('data/tfl-aliases.csv')
-
-    column_aliases = create_alias_dict(aliases, 'column')
-    value_aliases = create_alias_dict(aliases, 'value')
-
-    collision_cols = params['collision_columns']
-    casualty_cols = params['casualty_columns']
-
-    collision_links = [link for link in params['data_links'] if 'attendant' in link]
-    casualty_links = [link for link in params['data_links'] if ('casualty' in link) or ('casualties' in link)]
+    column_alias_dict = {}
+    alias_df = alias_df[alias_df['type'] == alias_type]
+    for column, column_df in alias_df.groupby('column'):
+        column_alias_dict[column] = create_alias_dict(column_df, alias_type)
 
-    # ====================== COLLISIONS ===================================== #
+    return column_alias_dict
 
-    collisions = process_yearly_data(
-        collision_links,
-        collision_cols,
-        column_aliases
-    )
 
+def format_collisions(collisions: pd.DataFrame, value_aliases: dict, categorical_columns: list) -> pd.DataFrame:
+    """
+    Format a year of raw collision data
+    """
     collisions['date'] = pd.to_datetime(
         collisions['date'],
         format='mixed',
@@ -184,19 +92,20 @@ def main():
     collisions['year'] = collisions['date'].dt.year
 
     for col in ['borough', 'location']:
-        collisions[col] = collisions[col].apply(lambda x: x.upper())
+        collisions[col] = upper_case(collisions[col])
 
-    collisions['collision_id'] = collisions.apply(
-        lambda row: clean_collision_id(row['raw_collision_id'], row['year'], row['borough']), axis=1
+    collisions['collision_id'] = clean_collision_ids(
+        collisions['raw_collision_id'],
+        collisions['year']
     )
 
-    collisions['time'] = collisions['time'].apply(format_time)
+    collisions['time'] = format_times(collisions['time'])
     collisions['time'] = pd.to_datetime(
         collisions['time'],
         format='%H:%M:%S',
     ).dt.time
 
-    collisions = collisions.replace(to_replace=value_aliases)
+    collisions = apply_value_aliases(collisions, value_aliases, categorical_columns)
 
     # convert easting, northings
     collisions['longitude'], collisions['latitude'] = convert_lonlat(
@@ -204,34 +113,162 @@ def main():
         collisions['northing']
     )
 
-    print('Collision example rows:')
-    print(collisions.head())
+    return collisions
 
-    # ====================== CASUALTIES ===================================== #
-
-    casualties = process_yearly_data(
-        casualty_links,
-        casualty_cols,
-        column_aliases
-    )
 
-    # join to get the valid collision id from collision data
+def format_casualties(
+    casualties: pd.DataFrame,
+    collisions: pd.DataFrame,
+    value_aliases: dict,
+    categorical_columns: list
+    ) -> pd.DataFrame:
+    """
+    Format a year of raw casualty data
+    """
+    # join to get the valid collision id from the same year of collision data
     casualties = casualties.merge(
         collisions[['raw_collision_id', 'collision_id']],
         how='left',
         on='raw_collision_id'
     )
 
-    casualties.replace(value_aliases, inplace=True)
+    casualties = apply_value_aliases(casualties, value_aliases, categorical_columns)
+
+    return casualties
+
+
+def ingest_years(
+    years: dict,
+    paths: dict,
+    params: dict,
+    column_aliases: dict,
+    value_aliases: dict,
+    manifest: dict,
+    ingest_settings: str
+    ) -> dict:
+    """
+    Parse + format any years whose sources have changed into the year-partitioned store.
+    Returns the updated manifest.
+    """
+    store_dir = params['ingest_store']
+
+    entries = {
+        year: source_entry(year_links, {table: paths[link] for table, link in year_links.items()}, ingest_settings)
+        for year, year_links in years.items()
+    }
+    changed_years = [year for year, entry in entries.items() if needs_ingest(year, entry, manifest, store_dir)]
+
+    unchanged_years = sorted(set(years) - set(changed_years))
+    print(f'Unchanged years, using stored data: {unchanged_years}')
+    print(f'Years to ingest: {changed_years}')
+
+    if len(changed_years) == 0:
+        return manifest
+
+    # parse extracts for changed years in parallel
+    yearly_collisions = parse_extracts(
+        [paths[years[year]['collisions']] for year in changed_years],
+        params['collision_columns'],
+        column_aliases,
+        max_workers=params['parse_workers']
+    )
+    yearly_casualties = parse_extracts(
+        [paths[years[year]['casualties']] for year in changed_years],
+        params['casualty_columns'],
+        column_aliases,
+        max_workers=params['parse_workers']
+    )
+
+    for year, collisions, casualties in zip(changed_years, yearly_collisions, yearly_casualties):
+        collisions = format_collisions(collisions, value_aliases, params['categorical_columns'])
+        casualties = format_casualties(casualties, collisions, value_aliases, params['categorical_columns'])
 
-    collisions = correct_data(collisions, data_corrections)
+        entry = entries[year]
+        entry['collisions']['rows'] = write_partition(collisions, store_dir, 'collisions', year)
+        entry['casualties']['rows'] = write_partition(casualties, store_dir, 'casualties', year)
+        manifest[str(year)] = entry
+
+        print(f'Ingested {year}: {entry["collisions"]["rows"]} collisions, {entry["casualties"]["rows"]} casualties')
+
+        # write as we go so an interrupted run keeps the years already done
+        write_manifest(manifest, store_dir)
+
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Download and format the TfL collision extracts')
+    parser.add_argument(
+        '--offline',
+        action='store_true',
+        help='only read extracts from the local raw data cache, never download'
+    )
+    args = parser.parse_args()
+
+    params = yaml.load(open("params.yaml", 'r'), Loader=Loader)
+    data_corrections = yaml.load(open("data_corrections.yaml", 'r'), Loader=Loader)
+
+    aliases = pd.read_csv('data/tfl-aliases.csv')
+
+    column_aliases = create_alias_dict(aliases, 'column')
+    value_aliases = create_column_alias_dict(aliases, 'value')
+
+    # ingest settings are part of each year's hash so changing them re-ingests everything
+    ingest_settings = settings_hash(
+        INGEST_VERSION,
+        SCHEMA_VERSION,
+        params['collision_columns'],
+        params['casualty_columns'],
+        params['categorical_columns'],
+        aliases.to_dict(orient='records')
+    )
+
+    years = group_links_by_year(params['data_links'])
+
+    # download all extracts up front so they are fetched concurrently
+    print('Downloading TfL extracts')
+    paths = fetch_links(
+        params['data_links'],
+        cache_dir=params['raw_data_cache'],
+        offline=args.offline,
+        max_workers=params['download_workers']
+    )
+
+    manifest = read_manifest(params['ingest_store'])
+    manifest = ingest_years(
+        years,
+        paths,
+        params,
+        column_aliases,
+        value_aliases,
+        manifest,
+        ingest_settings
+    )
+
+    removed_years = remove_stale_partitions(params['ingest_store'], list(years))
+    for year in removed_years:
+        manifest.pop(str(year), None)
+    print(f'Removed years no longer in params.yaml: {removed_years}')
+    write_manifest(manifest, params['ingest_store'])
+
+    collisions = read_partitions(params['ingest_store'], 'collisions', list(years))
+    casualties = read_partitions(params['ingest_store'], 'casualties', list(years))
+
+    collisions, _ = apply_corrections(
+        collisions,
+        data_corrections,
+        audit_path='data/corrections-audit.csv'
+    )
+
+    print('Collision example rows:')
+    print(collisions.head())
 
     print('Casualty example rows:')
     print(casualties.head())
 
     # output data
-    collisions.to_csv('data/collisions.csv', index=False)
-    casualties.to_csv('data/casualties.csv', index=False)
+    write_table(collisions, 'collisions', 'data/collisions.parquet', csv_export=params['export_csv'])
+    write_table(casualties, 'casualties', 'data/casualties.parquet', csv_export=params['export_csv'])
 
 
 if __name__ == "__main__":
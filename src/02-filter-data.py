@@ -2,89 +2,15 @@
 This takes a set of collision data cleaned with the stats19 data and cleans it further for use by LCC, including:
 - Filtering to London
 - Filtering to collisions at junctions only
+- Recalculates casualty severities for each casualty type in valid_casualty_types
 - Weights the severity of collisions
 """
 import yaml
-import pandas as pd
-import numpy as np
 
 from yaml import Loader
-
-
-def accident_severity_counts(row):
-    '''
-    Count severities of each type
-    '''
-    severities = row['casualty_severity']
-    severities = severities.tolist()
-    
-    fatal = severities.count('fatal')
-    serious = severities.count('serious')
-    slight = severities.count('slight')
-    
-    return fatal, serious, slight
-
-
-def get_recency_weight(row, min_year):
-    '''
-    Upweights more severe collisions for junction comparison.
-    '''
-    year = row['year']
-    recency_weight = np.log10(year - min_year + 6)
-        
-    return recency_weight
-
-
-def get_max_severity(row, casualty_type):
-    '''
-    Finds the max severity of a cyclist in collision
-    '''
-    if row[f'fatal_{casualty_type}_casualties'] > 0:
-        return 'fatal'
-    if row[f'serious_{casualty_type}_casualties'] > 0:
-        return 'serious'
-    if row[f'slight_{casualty_type}_casualties'] > 0:
-        return 'slight'
-    else:
-        return None
-
-
-def recalculate_severity(casualties, mode_of_travel):
-    '''
-    recalculate severities based on cyclists or pedestrian only + apply weightings
-    '''
-    recalculated_severities = (
-        casualties
-        [casualties['mode_of_travel'] == mode_of_travel]
-        .groupby('collision_id')
-        .apply(accident_severity_counts, include_groups=False)
-        .reset_index()
-    )
-
-    if mode_of_travel == 'pedal_cycle':
-        casualty_type = 'cyclist'
-    else:
-        casualty_type = mode_of_travel
-
-    # split out cols
-    new_cols = [
-        f'fatal_{casualty_type}_casualties',
-        f'serious_{casualty_type}_casualties',
-        f'slight_{casualty_type}_casualties'
-    ]
-    recalculated_severities[new_cols] = pd.DataFrame(
-        recalculated_severities[0].tolist(),
-        index=recalculated_severities.index
-    )
-
-    recalculated_severities[f'max_{casualty_type}_severity'] = recalculated_severities.apply(
-        lambda row: get_max_severity(row, casualty_type), axis=1
-    )
-
-    # remove unrequired cols
-    recalculated_severities.drop(columns=[0], inplace=True)
-
-    return recalculated_severities
+from schema import read_table, write_table
+from severity import SEVERITIES, get_casualty_type, recalculate_severities
+from recency import get_recency_weights
 
 
 def main():
@@ -93,8 +19,12 @@ def main():
     params = yaml.load(open("params.yaml", 'r'), Loader=Loader)
 
     print('Reading in data')
-    collisions = pd.read_csv('data/collisions.csv', low_memory=False)
-    casualties = pd.read_csv('data/casualties.csv', low_memory=False)
+    collisions = read_table('collisions', 'data/collisions.parquet')
+    casualties = read_table(
+        'casualties',
+        'data/casualties.parquet',
+        columns=['collision_id', 'mode_of_travel', 'casualty_severity']
+    )
 
     # filter to junctions
     print('Filter to Junctions')
@@ -110,7 +40,7 @@ def main():
     )
     collisions = collisions.loc[mask, :]
 
-    # pull out all cyclist and pedestrian crash ids
+    # pull out all crash ids for the valid casualty types, e.g. cyclists and pedestrians
     valid_crash_ids = casualties[
         casualties['mode_of_travel'].isin(params['valid_casualty_types'])
     ]['collision_id'].unique()
@@ -121,25 +51,26 @@ def main():
     casualties = casualties[casualties.collision_id.isin(valid_crash_ids)]
 
     print('Recalculate severities and danger metrics')
-    min_year = min(collisions['year'])
-    recalculated_cyclist_severities = recalculate_severity(casualties, 'pedal_cycle')
-    recalculated_pedestrian_severities = recalculate_severity(casualties, 'pedestrian')
-
-    # # join back to the datasets with severity in it
-    collisions = (
-        collisions
-        .merge(recalculated_cyclist_severities, how='left', on='collision_id')
-        .merge(recalculated_pedestrian_severities, how='left', on='collision_id')
-    )
-    
-    collisions['recency_weight'] = collisions.apply(
-        lambda row: get_recency_weight(row, min_year), axis=1
+    modes_of_travel = params['valid_casualty_types']
+    recalculated_severities = recalculate_severities(
+        casualties,
+        modes_of_travel,
+        params['casualty_type_names']
     )
 
-    collisions.loc[:, 'is_cyclist_collision'] = False
-    collisions.loc[:, 'is_pedestrian_collision'] = False
-    collisions.loc[~collisions['max_cyclist_severity'].isnull(), 'is_cyclist_collision'] = True
-    collisions.loc[~collisions['max_pedestrian_severity'].isnull(), 'is_pedestrian_collision'] = True
+    # join back to the datasets with severity in it
+    collisions = collisions.merge(recalculated_severities, how='left', on='collision_id')
+
+    collisions['recency_weight'] = get_recency_weights(collisions, params['recency_weighting'])
+
+    for mode in modes_of_travel:
+        casualty_type = get_casualty_type(mode, params['casualty_type_names'])
+
+        # collisions without any casualties of this type
+        casualty_count_cols = [f'{severity}_{casualty_type}_casualties' for severity in SEVERITIES]
+        collisions[casualty_count_cols] = collisions[casualty_count_cols].fillna(0).astype('int8')
+
+        collisions[f'is_{casualty_type}_collision'] = ~collisions[f'max_{casualty_type}_severity'].isnull()
 
     print('Example data')
     print(collisions)
@@ -155,14 +86,18 @@ def main():
     print('Cyclist & pedestrian collisions per year & severity check')
     print(
         collisions
-        .groupby(['year', 'collision_severity'])
+        .groupby(['year', 'collision_severity'], observed=True)
         ['collision_id']
         .nunique()
     )
 
-    # output csvs
-    print('Output to csv')
-    collisions.to_csv('data/pedestrian-and-cyclist-collisions.csv', index=False)
+    print('Output to parquet')
+    write_table(
+        collisions,
+        'filtered_collisions',
+        'data/pedestrian-and-cyclist-collisions.parquet',
+        csv_export=params['export_csv']
+    )
 
 
 if __name__ == "__main__":
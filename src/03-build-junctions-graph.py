@@ -2,176 +2,55 @@
 This script is based on notebooks/junctions-graph.ipynb
 It builds a graph of London junctions, simplifies this and then creates a dataset for this.
 """
+import time
 import yaml
+import argparse
 import pandas as pd
 import numpy as np
 import osmnx as ox
 
 from yaml import Loader
+from concurrent.futures import ProcessPoolExecutor
+from schema import write_table
+from graph_cache import load_graphs
+from junction_names import name_junctions
+from junction_hierarchy import ClusterIndex
+from consolidation import (
+    osmnx_consolidate_intersections, tiled_consolidate_intersections, kdtree_consolidate_intersections,
+    compare_clusters
+)
 
 # this prevents a lot of future warnings that are coming out of oxmnx
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
 
-def convert_strings_list(x: str) -> list:
-    '''
-    Function to convert a list stored in a string to a list.
-    '''
-    if type(x) == int:
-        return [x]
-    else:
-        return x.strip('][').split(', ')
-
-
-def combine_names(names) -> list:
-    '''
-    Takes a list of names, flattens them and returns unique list
-    '''
-    if type(names) == str:
-        return [names]
-    
-    flat_names = []
-    for n in names:
-        if type(n) == list:
-            for m in n:
-                flat_names.append(m)
-        else:
-            flat_names.append(n)
-    
-    unique_names = list(set(flat_names))
-
-    return unique_names
-
-
-def shorten_road_names(name: str) -> str:
-    '''
-    Shortern elements of road names to save space
-    '''
-    replacements = {
-        'Avenue': 'Ave',
-        'Bridge': 'Brg',
-        'Gardens': 'Gdns',
-        'Place': 'Pl',
-        'Road': 'Rd',
-        'Street': 'St',
-        'Square': 'Sq',
-    }
-    for k, v in replacements.items():
-        name = name.replace(k, v)
-    return name
-
-
-def list_to_string_name(names: list) -> str:
-    '''
-    Convert list of names for junction to a string
-    '''
-    names = [name for name in names if (name != '') & (name == name)]
-        
-    name = '-'.join(names)
-    if name == '':
-        name = 'Unknown'
-    return name
-
-
-def name_junctions(lower_level_graph, nodes_df: pd.DataFrame) -> pd.DataFrame:
+def consolidate_junctions(G_projected, tolerance: float, config: dict) -> ClusterIndex:
     """
-    Create names for junctions using the edge names from graph
+    Consolidate intersections within tolerance metres, returns the cluster each junction is in
     """
-    junction_names = (
-        ox
-        .graph_to_gdfs(lower_level_graph, nodes=False)
-        .reset_index()
-        [['u', 'name']]
-        .fillna('')
-    )
-
-    junction_names['name'] = junction_names['name'].apply(combine_names)
-
-    nodes_df = nodes_df.merge(
-        junction_names,
-        how='left',
-        left_on='junction_id',
-        right_on='u'
-    )
-
-    cluster_names = (
-        nodes_df
-        .groupby('junction_cluster_id')['name']
-        .apply(combine_names)
-        .reset_index()
-    )
-
-    nodes_df = nodes_df.merge(
-        cluster_names,
-        how='left',
-        on='junction_cluster_id',
-        suffixes=['', '_cluster']
-    )
-
-    nodes_df['junction_cluster_name'] = nodes_df['name_cluster'].apply(list_to_string_name)
-
-    nodes_df['junction_cluster_name'] = nodes_df['junction_cluster_name'].apply(shorten_road_names)
-
-    nodes_df['name_rank'] = (
-        nodes_df
-        .groupby(['junction_cluster_name'])['junction_cluster_id']
-        .transform('rank', method='dense')
-    )
-
-    nodes_df['name_max_rank'] = (
-        nodes_df
-        .groupby(['junction_cluster_name'])['name_rank']
-        .transform('max')
-    )
-
-    nodes_df['junction_cluster_name'] = np.where(
-        nodes_df['name_max_rank'] == 1,
-        nodes_df['junction_cluster_name'],
-        nodes_df['junction_cluster_name'] + '-' + nodes_df['name_rank'].astype(int).astype(str)
-    )
-
-    nodes_df.drop(columns=['name', 'u', 'name_rank', 'name_cluster'], inplace=True)
-
-    # finally, drop dups
-    nodes_df = nodes_df.drop_duplicates()
-
-    return nodes_df
-
-
-def main():
-
-    # read in data params
-    params = yaml.load(open("params.yaml", 'r'), Loader=Loader)
-
-    tolerance = params['tolerance']
+    if config['method'] == 'tiled':
+        return tiled_consolidate_intersections(
+            G_projected,
+            tolerance,
+            tile_size=config['tile_size'],
+            max_workers=config.get('workers')
+        )
+    if config['method'] == 'kdtree':
+        return kdtree_consolidate_intersections(
+            G_projected,
+            tolerance,
+            connected_pairs_only=config['connected_pairs_only']
+        )
 
-    # build initial junctions graph
-    print('Building initial junction graph')
-    G1 = ox.graph_from_place(
-        'Greater London, UK',  # critical to use greater london, the city of London is not included otherwsie!!
-        network_type='drive',
-        simplify=True,
-        clean_periphery=True
-    )
-    # for testing use:
-    # G1 = ox.graph_from_address(
-    #     'Greater London, UK',
-    #     network_type='drive',
-    #     dist=1000
-    # )
+    return osmnx_consolidate_intersections(G_projected, tolerance)
 
-    # simplify graph using the consolidate_intersections()
-    print('Consolidating intersections')
-    G2 = ox.consolidate_intersections(
-        ox.project_graph(G1),
-        tolerance=tolerance,
-        rebuild_graph=True,
-        dead_ends=True,  # true means we don't filter out dead ends.
-        reconnect_edges=True
-    )
 
-    # create datafraems from G1 & G2
+def build_junctions(G1, cluster_index: ClusterIndex) -> pd.DataFrame:
+    """
+    Join the original junctions to the clusters they were consolidated into + name them
+    """
+    # create dataframe from G1
     df_lower = (
         ox.graph_to_gdfs(
             G1,
@@ -180,38 +59,19 @@ def main():
             node_geometry=True,
             fill_edge_geometry=False
         )
-        .drop(columns=['highway', 'street_count'])
+        .drop(columns=['highway', 'street_count', 'geometry'])
         .reset_index()
         .rename(columns={'y': 'lat', 'x': 'lon', 'osmid': 'osmid_original'})
     )
 
-    df_higher = ox.graph_to_gdfs(
-        G2,
-        nodes=True,
-        edges=False,
-        node_geometry=True,
-        fill_edge_geometry=False
-    )
-
-
     # Create hierarchical junction dataframe
     # 
     # This needs to store both the lower level junctions (before simplifying) and the higher level.
     # This is because we want to map collisions to the lower level and then aggregate at the higher level.
-    # 
-    # For this we need to flatten the df_higher dataframe so we can join the datasets.
     print('Creating junction heirarchy')
 
-    df_higher['osmid_original'] = df_higher['osmid_original'].apply(convert_strings_list)
-    df_higher = df_higher.explode('osmid_original')
-    df_higher['osmid_original'] = df_higher['osmid_original'].astype(int)
-
-    df_higher = (
-        df_higher
-        .reset_index()
-        .drop(columns=['x', 'y', 'street_count', 'highway', 'lon', 'lat'])
-        .rename(columns={'osmid': 'osmid_cluster'})
-    )
+    osmid_original, osmid_cluster = cluster_index.get_junction_clusters()
+    df_higher = pd.DataFrame({'osmid_original': osmid_original, 'osmid_cluster': osmid_cluster})
 
     # Combine datasets
     df = df_lower.merge(
@@ -241,12 +101,9 @@ def main():
     df['latitude_cluster'] = df['latitude_cluster'].fillna(df['lat'])
     df['longitude_cluster'] = df['longitude_cluster'].fillna(df['lon'])
 
-    # drop some cols and rename some
+    # rename some cols
     df = (
         df
-        .drop(
-            columns=['geometry_original', 'geometry_cluster']
-        )
         .reset_index()
         .rename(
             columns={
@@ -263,11 +120,160 @@ def main():
     print('Naming junctions')
     df = name_junctions(G1, df)
 
-    print(f'Outputing data: data/junctions-tolerance={tolerance}.csv & data/junctions-tolerance={tolerance}.parquet')
-    df.to_csv(f'data/junctions-tolerance={tolerance}.csv', index=False)
-    df.to_parquet(f'data/junctions-tolerance={tolerance}.parquet', engine='pyarrow')
+    return df
+
+
+def summarise_clusters(df: pd.DataFrame, tolerance: float) -> dict:
+    """
+    Cluster counts + sizes for a junctions table, used to compare tolerances
+    """
+    cluster_sizes = df.groupby('junction_cluster_id')['junction_id'].nunique()
+    return {
+        'tolerance': tolerance,
+        'junctions': df['junction_id'].nunique(),
+        'clusters': len(cluster_sizes),
+        'single_junction_clusters': int((cluster_sizes == 1).sum()),
+        'mean_cluster_size': cluster_sizes.mean(),
+        'median_cluster_size': cluster_sizes.median(),
+        'p95_cluster_size': cluster_sizes.quantile(.95),
+        'max_cluster_size': cluster_sizes.max(),
+    }
+
+
+def write_junctions(df: pd.DataFrame, cluster_index: ClusterIndex, tolerance: float, params: dict):
+    print(f'Outputing data: data/junctions-tolerance={tolerance}.parquet')
+    write_table(
+        df,
+        'junctions',
+        f'data/junctions-tolerance={tolerance}.parquet',
+        csv_export=params['export_csv'],
+        drop_extra=True
+    )
+
+    # keep the cluster index consistent with the junctions table
+    junction_ids, cluster_ids = cluster_index.get_junction_clusters()
+    in_table = np.isin(junction_ids, df['junction_id'].to_numpy())
+    print(f'Outputing cluster index: data/junction-hierarchy-tolerance={tolerance}.npz')
+    ClusterIndex.from_mapping(junction_ids[in_table], cluster_ids[in_table]).save(
+        f'data/junction-hierarchy-tolerance={tolerance}.npz'
+    )
+
+
+# projected graph + consolidation settings for sweep worker processes,
+# set once per process rather than sent with every tolerance
+_worker_graph = None
+_worker_config = None
+
+
+def set_worker_graph(G_projected, config: dict):
+    global _worker_graph, _worker_config
+    _worker_graph = G_projected
+    _worker_config = config
+
+
+def consolidate_worker(tolerance: float) -> ClusterIndex:
+    start_time = time.perf_counter()
+    cluster_index = consolidate_junctions(_worker_graph, tolerance, _worker_config)
+    print(f'Consolidated tolerance={tolerance} in {time.perf_counter() - start_time:.1f}s')
+    return cluster_index
+
+
+def sweep_tolerances(G1, G1_projected, tolerances: list, params: dict, max_workers: int = None) -> pd.DataFrame:
+    """
+    Build the junctions table for several tolerances, consolidating them in parallel.
+    Returns a summary of the clusters for each tolerance.
+    """
+    print(f'Consolidating intersections for tolerances: {tolerances}')
+    config = params['consolidation']
+    if config['method'] != 'osmnx':
+        # tiled is already parallel + kdtree takes seconds, so run the tolerances one at a time
+        consolidated = {tolerance: consolidate_junctions(G1_projected, tolerance, config) for tolerance in tolerances}
+    else:
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=set_worker_graph,
+            initargs=(G1_projected, config)
+        ) as executor:
+            consolidated = dict(zip(tolerances, executor.map(consolidate_worker, tolerances)))
+
+    summary = []
+    for tolerance, cluster_index in consolidated.items():
+        df = build_junctions(G1, cluster_index)
+        write_junctions(df, cluster_index, tolerance, params)
+        summary.append(summarise_clusters(df, tolerance))
+
+    return pd.DataFrame(summary)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the London junctions graph')
+    parser.add_argument(
+        '--refresh-graph',
+        action='store_true',
+        help='rebuild the road graph rather than loading it from the graph cache'
+    )
+    parser.add_argument(
+        '--sweep',
+        nargs='*',
+        type=float,
+        default=None,
+        help='build junctions for several tolerances, defaults to tolerance_sweep in params.yaml'
+    )
+    parser.add_argument(
+        '--compare-consolidation',
+        action='store_true',
+        help='compare the clusters, runtime + memory of the consolidation method in params.yaml against osmnx'
+    )
+    args = parser.parse_args()
+
+    # read in data params
+    params = yaml.load(open("params.yaml", 'r'), Loader=Loader)
+
+    # build initial junctions graph, or load it from the graph cache
+    print('Building initial junction graph')
+    G1, G1_projected = load_graphs(params['road_graph'], refresh=args.refresh_graph)
+    # for testing, set osm_file in params.yaml to a small local extract
+
+    if args.sweep is not None:
+        # e.g. 15.0 -> 15 so file names match the single tolerance run
+        tolerances = [int(t) if t == int(t) else t for t in (args.sweep or params['tolerance_sweep'])]
+        summary = sweep_tolerances(G1, G1_projected, tolerances, params, params.get('sweep_workers'))
+        print(summary.to_string(index=False))
+        print('Outputing summary: data/junctions-tolerance-sweep.csv')
+        summary.to_csv('data/junctions-tolerance-sweep.csv', index=False)
+        return
+
+    tolerance = params['tolerance']
+
+    if args.compare_consolidation:
+        config = params['consolidation']
+        if config['method'] not in ['tiled', 'kdtree']:
+            parser.error('--compare-consolidation compares tiled or kdtree against osmnx, set consolidation: method')
+
+        print(f'Comparing {config["method"]} consolidation against osmnx')
+        if config['method'] == 'tiled':
+            report = compare_clusters(
+                G1_projected, tolerance, tiled_consolidate_intersections,
+                tile_size=config['tile_size'], max_workers=config.get('workers')
+            )
+        elif config['method'] == 'kdtree':
+            report = compare_clusters(
+                G1_projected, tolerance, kdtree_consolidate_intersections,
+                connected_pairs_only=config['connected_pairs_only']
+            )
+        report = pd.Series({'method': config['method'], **report})
+        print(report.to_string())
+        print('Outputing report: data/consolidation-comparison.csv')
+        report.to_frame().T.to_csv('data/consolidation-comparison.csv', index=False)
+        return
+
+    # simplify graph using the consolidate_intersections()
+    print('Consolidating intersections')
+    cluster_index = consolidate_junctions(G1_projected, tolerance, params['consolidation'])
+
+    df = build_junctions(G1, cluster_index)
+    write_junctions(df, cluster_index, tolerance, params)
 
 
 if __name__ == "__main__":
     main()
-
@@ -1,20 +1,287 @@
+import os
+import time
 import yaml
+import numpy as np
 import pandas as pd
 
-from sklearn.neighbors import BallTree
+from sklearn.neighbors import KDTree
 from yaml import Loader
+from convertbng.util import convert_bng
+from concurrent.futures import ProcessPoolExecutor
+from schema import read_table, write_table
+from graph_cache import load_cached_graph
+from hashing import hash_file
+from mapping_store import (
+    hash_mapping_inputs, read_mappings, get_collisions_to_map, update_mappings, empty_mappings,
+    load_spatial_index, save_spatial_index
+)
 
+import road_snapping
 
-def get_nearest_junction(row, tree):
+
+# bins (in metres) for the histogram of snapping distances printed on each run
+DISTANCE_BINS = [0, 5, 10, 15, 20, 30, 40, 50, 75, 100, 150, 200, 500, np.inf]
+
+# second nearest junctions within this ratio of the nearest distance are reported as near ties
+NEAR_TIE_RATIO = 1.1
+
+# tree for query worker processes, set once per process rather than sent with every chunk
+_worker_tree = None
+
+
+def set_worker_tree(tree: KDTree):
+    global _worker_tree
+    _worker_tree = tree
+
+
+def query_chunk(chunk: tuple) -> tuple:
+    coordinates, k = chunk
+    return _worker_tree.query(coordinates, k=k)
+
+
+def get_nearest_junctions(
+    tree: KDTree,
+    coordinates: np.ndarray,
+    k: int = 1,
+    chunk_size: int = 50_000,
+    max_workers: int = None
+) -> tuple:
+    '''
+    Find the k nearest junctions to every crash / collision in one batched query, split into chunks across
+    processes for large inputs. Returns (n, k) arrays of the distances + positions of the junctions in the tree.
+    '''
+    if len(coordinates) <= chunk_size:
+        return tree.query(coordinates, k=k)
+
+    chunks = [(coordinates[i:i + chunk_size], k) for i in range(0, len(coordinates), chunk_size)]
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=set_worker_tree, initargs=(tree,)) as executor:
+        results = list(executor.map(query_chunk, chunks))
+
+    distances = np.concatenate([distances for distances, _ in results])
+    positions = np.concatenate([positions for _, positions in results])
+    return distances, positions
+
+
+def get_junction_bng(junctions: pd.DataFrame) -> np.ndarray:
+    '''
+    Project junction coordinates to British National Grid easting / northing, the same as the collisions
+    '''
+    eastings, northings = convert_bng(
+        junctions['longitude_junction'].to_numpy(),
+        junctions['latitude_junction'].to_numpy()
+    )
+    return np.column_stack([eastings, northings])
+
+
+def print_distance_histogram(distances: np.ndarray, threshold: float, bins: list = DISTANCE_BINS):
+    '''
+    Histogram of the distance from each collision to its nearest junction, to check the threshold
+    '''
+    if distances.size == 0:
+        print('No collisions snapped, so no snapping distances to show')
+        return
+
+    counts, _ = np.histogram(distances, bins=bins)
+    scale = 50 / max(counts.max(), 1)
+
+    print(
+        f'Snapping distances (median {np.median(distances):.1f}m, '
+        f'95th percentile {np.percentile(distances, 95):.1f}m):'
+    )
+    for lower, upper, count in zip(bins[:-1], bins[1:], counts):
+        label = f'{lower:g}-{upper:g}m' if np.isfinite(upper) else f'{lower:g}m+'
+        if upper <= threshold:
+            excluded = ''
+        elif lower >= threshold:
+            excluded = ' (excluded)'
+        else:
+            excluded = ' (partly excluded)'  # bin straddles the threshold
+        print(f'  {label:>10} {count:>8} {"#" * int(np.ceil(count * scale))}{excluded}')
+    print(f'{(distances > threshold).sum()} of {len(distances)} collisions over the {threshold}m threshold')
+
+
+def get_candidates(
+    collisions: pd.DataFrame,
+    junctions: pd.DataFrame,
+    distances: np.ndarray,
+    positions: np.ndarray
+) -> pd.DataFrame:
+    '''
+    One row per collision + candidate junction, nearest first
+    '''
+    k = distances.shape[1]
+    return pd.DataFrame({
+        'collision_index': np.repeat(collisions['collision_index'].to_numpy(), k),
+        'candidate_rank': np.tile(np.arange(1, k + 1, dtype=np.int8), len(collisions)),
+        'junction_index': junctions['junction_index'].to_numpy()[positions.ravel()],
+        'junction_id': junctions['junction_id'].to_numpy()[positions.ravel()],
+        'distance_to_junction': distances.ravel(),
+    })
+
+
+def report_ties(distances: np.ndarray, near_tie_ratio: float = NEAR_TIE_RATIO):
+    '''
+    Print how many collisions are as close, or nearly as close, to another junction as the one they're mapped to
+    '''
+    ties = distances[:, 1] == distances[:, 0]
+    near_ties = ~ties & (distances[:, 1] <= distances[:, 0] * near_tie_ratio)
+    print(
+        f'{ties.sum()} collisions tied between junctions, '
+        f'{near_ties.sum()} with another junction within {near_tie_ratio - 1:.0%} of the nearest distance'
+    )
+
+
+def get_junction_tree(junctions: pd.DataFrame, junctions_hash: str, tolerance: float) -> KDTree:
+    '''
+    KDTree of junctions on British National Grid coordinates, so distances are in metres
+    '''
+    path = f'data/junction-index-tolerance={tolerance}.pkl'
+    tree = load_spatial_index(path, junctions_hash)
+    if tree is None:
+        tree = KDTree(get_junction_bng(junctions))
+        save_spatial_index(tree, path, junctions_hash)
+    return tree
+
+
+def get_road_edges(junctions_hash: str, params: dict) -> pd.DataFrame:
+    '''
+    Road segments in British National Grid coordinates, from the road graph the junctions were built from
+    '''
+    path = f'data/road-index-tolerance={params["tolerance"]}.pkl'
+    edges = load_spatial_index(path, junctions_hash)
+    if edges is None:
+        edges = road_snapping.get_edges(load_cached_graph(params['road_graph']))
+        save_spatial_index(edges, path, junctions_hash)
+    return edges
+
+
+def snap_to_junctions(
+    collisions: pd.DataFrame,
+    junctions: pd.DataFrame,
+    junctions_hash: str,
+    params: dict
+) -> pd.DataFrame:
+    '''
+    Map each collision to its nearest junction
+    '''
+    tolerance = params['tolerance']
+    k = params['nearest_junction_candidates']
+
+    print('Finding nearest junction to each collision')
+    start_time = time.perf_counter()
+    tree = get_junction_tree(junctions, junctions_hash, tolerance)
+
+    distances, positions = get_nearest_junctions(
+        tree,
+        collisions[['easting', 'northing']].to_numpy(),
+        k=k,
+        chunk_size=params['mapping_chunk_size'],
+        max_workers=params['mapping_workers']
+    )
+    print(f'Queried {len(collisions)} collisions in {time.perf_counter() - start_time:.2f}s')
+
+    if k > 1:
+        report_ties(distances)
+        candidates = get_candidates(collisions, junctions, distances, positions)
+        print(f'Outputing candidates: data/junction-candidates-tolerance={tolerance}.parquet')
+        write_table(
+            candidates,
+            'junction_candidates',
+            f'data/junction-candidates-tolerance={tolerance}.parquet',
+            csv_export=params['export_csv']
+        )
+
+    return pd.DataFrame({
+        'junction_index': junctions['junction_index'].to_numpy()[positions[:, 0]],
+        'junction_id': junctions['junction_id'].to_numpy()[positions[:, 0]],
+        'distance_to_junction': distances[:, 0],
+        'snapping_distance': distances[:, 0],
+    })
+
+
+def snap_to_roads(
+    collisions: pd.DataFrame,
+    junctions: pd.DataFrame,
+    junctions_hash: str,
+    params: dict
+) -> pd.DataFrame:
+    '''
+    Map each collision to a junction at the end of the road segment it's on.
+    Collisions with no road within the threshold aren't mapped, they have a snapping distance of inf.
+    '''
+    print('Finding nearest road to each collision')
+    start_time = time.perf_counter()
+    edges = get_road_edges(junctions_hash, params)
+
+    coordinates = collisions[['easting', 'northing']].to_numpy()
+    snapped = road_snapping.snap_to_roads(
+        coordinates, collisions['location'], edges, params['distance_to_junction_threshold']
+    )
+    print(
+        f'Snapped {len(snapped)} collisions to {len(edges)} road segments '
+        f'in {time.perf_counter() - start_time:.2f}s'
+    )
+
+    # positions of the snapped junctions in the junctions table
+    junction_positions = pd.Series(np.arange(len(junctions)), index=junctions['junction_id'])
+    junction_positions = junction_positions.loc[snapped['junction_id']].to_numpy()
+    snapped_positions = snapped['position'].to_numpy()
+
+    mappings = pd.DataFrame({
+        'junction_index': np.full(len(collisions), -1, dtype=np.int64),
+        'junction_id': np.full(len(collisions), -1, dtype=np.int64),
+        'distance_to_junction': np.full(len(collisions), np.nan),
+        'snapping_distance': np.full(len(collisions), np.inf),
+    })
+    mappings.loc[snapped_positions, 'junction_index'] = junctions['junction_index'].to_numpy()[junction_positions]
+    mappings.loc[snapped_positions, 'junction_id'] = snapped['junction_id'].to_numpy()
+    mappings.loc[snapped_positions, 'distance_to_junction'] = np.hypot(
+        *(coordinates[snapped_positions] - get_junction_bng(junctions)[junction_positions]).T
+    )
+    mappings.loc[snapped_positions, 'snapping_distance'] = snapped['distance_to_road'].to_numpy()
+
+    return mappings
+
+
+def get_mappings(
+    collisions: pd.DataFrame,
+    junctions: pd.DataFrame,
+    junctions_hash: str,
+    store_dir: str,
+    params: dict
+) -> pd.DataFrame:
     '''
-    Find nearest junction to crash / collision. Return distance and the index for junction
+    Mapping of every collision to a junction. Only collisions that are new or changed since the last run with the
+    same junctions + settings are mapped, the rest come from the mapping store.
     '''
-    crash_coordinate = row[['latitude', 'longitude']].values
-    result = tree.query([crash_coordinate])
+    snapping = params['snapping']
+    manifest = {
+        'junctions_hash': junctions_hash,
+        'snapping': snapping,
+        # junctions are always snapped to, the threshold is applied after, but roads are only searched up to it
+        'max_distance': params['distance_to_junction_threshold'] if snapping == 'road' else None,
+    }
+    mappings = read_mappings(store_dir, manifest)
+
+    to_map = get_collisions_to_map(collisions, mappings)
+    if params['nearest_junction_candidates'] > 1:
+        # candidates are output for every collision
+        to_map[:] = True
+    print(f'Mapping {to_map.sum()} new or changed collisions, {(~to_map).sum()} already mapped')
 
-    distance = result[0][0][0]  # result is weirdly nested
-    index = result[1][0][0]
-    return distance, index
+    if to_map.any():
+        snap = snap_to_roads if snapping == 'road' else snap_to_junctions
+        new_mappings = snap(collisions[to_map], junctions, junctions_hash, params)
+        new_mappings.insert(0, 'collision_index', collisions.loc[to_map, 'collision_index'].to_numpy())
+        new_mappings.insert(1, 'year', collisions.loc[to_map, 'year'].to_numpy())
+        new_mappings.insert(2, 'input_hash', collisions.loc[to_map, 'input_hash'].to_numpy())
+        mappings = update_mappings(store_dir, manifest, mappings, new_mappings, collisions['collision_index'])
+
+    if mappings is None:
+        # nothing stored and nothing to map, e.g. no collisions
+        mappings = empty_mappings()
+
+    return mappings
 
 
 def main():
@@ -27,38 +294,45 @@ def main():
 
     # read in data
     collisions = (
-        pd
-        .read_csv('data/pedestrian-and-cyclist-collisions.csv')
+        read_table('filtered_collisions', 'data/pedestrian-and-cyclist-collisions.parquet')
         .rename(columns={'collision_id': 'collision_index'})
     )
 
-    junctions = pd.read_csv(f'data/junctions-tolerance={tolerance}.csv', low_memory=False)
+    junctions_path = f'data/junctions-tolerance={tolerance}.parquet'
+    junctions = read_table(
+        'junctions',
+        junctions_path,
+        columns=['junction_index', 'junction_id', 'latitude_junction', 'longitude_junction']
+    )
 
-    # Find nearest junction to each collision
-    # Use BallTree algorithm.
-    # Havesine distance since these are coordinates.
+    junctions_hash = hash_file(junctions_path)
+    store_dir = os.path.join(params['mapping_store'], f'tolerance={tolerance}')
+    collisions['input_hash'] = hash_mapping_inputs(collisions)
+    mappings = get_mappings(collisions, junctions, junctions_hash, store_dir, params)
 
-    print('Finding nearest junction to each collision')
-    tree = BallTree(junctions[['latitude_junction', 'longitude_junction']], metric='haversine')
+    snapped = np.isfinite(mappings['snapping_distance'].to_numpy())
+    print_distance_histogram(mappings['snapping_distance'].to_numpy()[snapped], distance_threshold)
+    if not snapped.all():
+        print(f'{(~snapped).sum()} collisions with no road within {distance_threshold}m')
 
-    collisions[['distance_to_junction', 'junction_index']] = collisions.apply(
-        lambda row: get_nearest_junction(row, tree), axis=1, result_type='expand'
-    )
-
-    # join to get junction ids
-    collisions = collisions.merge(
-        junctions[['junction_index', 'junction_id']],
-        how='left',
-        on='junction_index'
+    collisions = collisions.drop(columns='input_hash').merge(
+        mappings[['collision_index', 'distance_to_junction', 'junction_index', 'junction_id', 'snapping_distance']],
+        how='inner',
+        on='collision_index'
     )
 
     # filter to those within certain distance
-    collisions = collisions[
-        collisions['distance_to_junction'] <= distance_threshold
-    ]
+    collisions = (
+        collisions[collisions['snapping_distance'] <= distance_threshold]
+        .drop(columns='snapping_distance')
+    )
 
-    collisions.to_csv(f'data/collisions-tolerance={tolerance}.csv', index=False)
-    collisions.to_parquet(f'data/collisions-tolerance={tolerance}.parquet', engine='pyarrow')
+    write_table(
+        collisions,
+        'mapped_collisions',
+        f'data/collisions-tolerance={tolerance}.parquet',
+        csv_export=params['export_csv']
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,149 @@
+"""
+Writes the finished tables the app serves from, one per casualty type, partitioned by borough, e.g.
+data/app-data-tolerance=15/junction_collisions/casualty_type=cyclist/borough=CAMDEN/part-0.parquet
+
+Each row is a collision joined to its junction + cluster, with everything the app used to derive at
+request time (danger metrics + stats19 link) already calculated, so the app only reads them.
+Map labels are built by the app for the few rows it draws.
+The app reads with filters on the partition keys, so a session only loads the casualty type + boroughs
+it's showing. Collisions involving both cyclists and pedestrians are in both casualty types.
+A danger cube per casualty type, the sums for each (cluster, borough, year), is written as .npz, e.g.
+data/app-data-tolerance=15/danger_cube/cyclist.npz, so the app ranks junctions without reading collisions.
+A manifest of the boroughs + years in the data is written alongside, so the app can show its options
+without reading any data.
+"""
+import os
+import json
+import yaml
+import shutil
+import numpy as np
+import pandas as pd
+
+from yaml import Loader
+from schema import read_table, write_dataset
+from danger_ranking import DangerCube
+from severity import get_casualty_type
+
+
+PARTITIONING = ['casualty_type', 'borough']
+MANIFEST_FILE = '_manifest.json'  # starts with _ so isn't read as part of the datasets
+
+
+def get_danger_metric(junction_collisions: pd.DataFrame, casualty_type: str, params: dict) -> np.ndarray:
+    '''
+    Upweights more severe collisions for junction comparison.
+    Only take worst severity, so if multiple casualties involved we have to ignore less severe.
+    '''
+    conditions = [
+        junction_collisions[f'fatal_{casualty_type}_casualties'] > 0,
+        junction_collisions[f'serious_{casualty_type}_casualties'] > 0,
+        junction_collisions[f'slight_{casualty_type}_casualties'] > 0
+    ]
+    choices = [params['weight_fatal'], params['weight_serious'], params['weight_slight']]
+
+    return np.select(conditions, choices, default=np.nan)
+
+
+def build_serving_table(
+    junctions: pd.DataFrame,
+    collisions: pd.DataFrame,
+    casualty_type: str,
+    params: dict
+) -> pd.DataFrame:
+    """
+    Collisions of a casualty type joined to their junctions, with the danger metrics + stats19 link
+    """
+    collisions = collisions[collisions[f'is_{casualty_type}_collision']]
+
+    junction_collisions = junctions.merge(
+        collisions,
+        how='inner',  # inner as we don't care about junctions with no collisions
+        on=['junction_id', 'junction_index']
+    )
+
+    junction_collisions['danger_metric'] = get_danger_metric(junction_collisions, casualty_type, params)
+    junction_collisions['recency_danger_metric'] = (
+        junction_collisions['danger_metric'] * junction_collisions['recency_weight']
+    )
+
+    junction_collisions['stats19_link'] = (
+        'https://www.cyclestreets.net/collisions/reports/' + junction_collisions['collision_index'].astype(str) + '/'
+    )
+
+    junction_collisions['casualty_type'] = casualty_type
+    junction_collisions['borough'] = junction_collisions['borough'].astype(object)
+
+    return junction_collisions
+
+
+def get_manifest(junction_collisions: pd.DataFrame, tolerance: float) -> dict:
+    return {
+        'tolerance': tolerance,
+        'min_year': int(junction_collisions['year'].min()),
+        'max_year': int(junction_collisions['year'].max()),
+        'boroughs': sorted(junction_collisions['borough'].dropna().unique().tolist()),
+        'collisions': junction_collisions.groupby('casualty_type').size().to_dict(),
+    }
+
+
+def main():
+
+    # read in data params
+    params = yaml.load(open("params.yaml", 'r'), Loader=Loader)
+
+    tolerance = params['tolerance']
+
+    collisions = read_table(
+        'mapped_collisions',
+        f'data/collisions-tolerance={tolerance}.parquet',
+        columns=params['collision_app_columns']
+    )
+    junctions = read_table(
+        'junctions',
+        f'data/junctions-tolerance={tolerance}.parquet',
+        columns=params['junction_app_columns']
+    )
+
+    casualty_types = [
+        get_casualty_type(mode, params['casualty_type_names']) for mode in params['valid_casualty_types']
+    ]
+    junction_collisions = pd.concat(
+        [build_serving_table(junctions, collisions, casualty_type, params) for casualty_type in casualty_types],
+        ignore_index=True
+    )
+
+    # write to a new directory + swap it in, so the app data is never partly written
+    output_dir = f'data/app-data-tolerance={tolerance}'
+    tmp_dir = f'{output_dir}.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print(f'Writing {len(junction_collisions)} junction collisions to: {output_dir}')
+    write_dataset(
+        junction_collisions, 'junction_collisions', os.path.join(tmp_dir, 'junction_collisions'), PARTITIONING
+    )
+
+    os.makedirs(os.path.join(tmp_dir, 'danger_cube'))
+    for casualty_type in casualty_types:
+        cube = DangerCube.from_junction_collisions(
+            junction_collisions[junction_collisions['casualty_type'] == casualty_type], casualty_type
+        )
+        print(f'{casualty_type} danger cube: {len(cube)} cells for {len(cube.cluster_ids)} junction clusters')
+        cube.save(os.path.join(tmp_dir, 'danger_cube', f'{casualty_type}.npz'))
+
+    manifest = get_manifest(junction_collisions, tolerance)
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.replace(tmp_dir, output_dir)
+
+    print(
+        junction_collisions
+        .groupby(PARTITIONING)
+        .size()
+        .rename('collisions')
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
 import os
+import json
 import yaml
 import folium
 import streamlit as st
 import numpy as np
 import pandas as pd
+import pyarrow.dataset as ds
 import seaborn as sns
 import logging
 
@@ -12,6 +14,12 @@ from pympler import asizeof
 from folium.features import DivIcon
 from st_files_connection import FilesConnection
 
+# imported as src.app_functions by the app, and with src/ on the path by scripts
+try:
+    from src.danger_ranking import CLUSTER_ATTRIBUTES, DangerCube
+except ModuleNotFoundError:
+    from danger_ranking import CLUSTER_ATTRIBUTES, DangerCube
+
 logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
 
 # read in data params
@@ -20,277 +28,186 @@ DATA_PARAMETERS = yaml.load(open("params.yaml", 'r'), Loader=Loader)
 # set as "prod" in the hosted environment
 ENVIRONMENT = os.environ.get("ENVIRONMENT", "prod")
 
-
-@st.cache_data(show_spinner=False, ttl=24*60*60, max_entries=1)
-def read_in_data(params: dict = DATA_PARAMETERS) -> tuple:
-    """
-    Function to read in different data depending on tolerance requests.
-    Reads from local if not on streamlit server, otherwise from GCS.
+# map popup labels, only filled in for the junctions + collisions being drawn
+COLLISION_LABEL_TEMPLATE = """
+        <h3>{collision_index}</h3>
+        Date: <b>{date}</b> <br>
+        Collision danger metric: <b>{danger_metric}</b> <br>
+        Max {casualty_type} severity: <b>{severity}</b> <br>
+        <a href="{link}" target="_blank">Stats19 report</a>
+        <hr>
+        Fatal {casualty_type} casualties: <b>{n_fatal}</b> <br>
+        Serious {casualty_type} casualties: <b>{n_serious}</b> <br>
+        Slight {casualty_type} casualties: <b>{n_slight}</b>
     """
-    if ENVIRONMENT == 'dev':
-        junctions = pd.read_parquet(
-            f'data/junctions-tolerance=15.parquet',
-            engine='pyarrow',
-            columns=params['junction_app_columns']
-        )
-        collisions = pd.read_parquet(
-            f'data/collisions-tolerance=15.parquet',
-            engine='pyarrow',
-            columns=params['collision_app_columns']
-        )
-    else:
-        conn = st.connection('gcs', type=FilesConnection)
-        junctions = conn.read(
-            "lcc-app-data/2020-2024/junctions-tolerance=15.parquet",
-            input_format="parquet",
-            engine='pyarrow',
-            columns=params['junction_app_columns']
-        )
-        collisions = conn.read(
-            "lcc-app-data/2020-2024/collisions-tolerance=15.parquet",
-            input_format="parquet",
-            engine='pyarrow',
-            columns=params['collision_app_columns']
-        )
 
-    try:
-        junction_notes = pd.read_csv(st.secrets["junction_notes"])
-    except FileNotFoundError:
-        junction_notes = pd.DataFrame(columns=["junction_cluster_id", "notes"])
-
-    return junctions, collisions, junction_notes
+JUNCTION_LABEL_TEMPLATE = """
+        <h3>{junction_name}</h3>
+        Dangerous Junction Rank: <b>{rank}</b> <br>
+        Danger Metric: <b>{recency_metric}</b> <br>
+        <hr>
+        Fatal {casualty_type} casualties: <b>{n_fatal}</b> <br>
+        Serious {casualty_type} casualties: <b>{n_serious}</b> <br>
+        Slight {casualty_type} casualties: <b>{n_slight}</b>
+        <hr>
+        {notes}
+    """
 
 
-@st.cache_data(show_spinner=False, ttl=3*60, max_entries=2)
-def combine_junctions_and_collisions(
-    junctions: pd.DataFrame,
-    collisions: pd.DataFrame,
-    notes: pd.DataFrame,
-    casualty_type: str,
-    ) -> pd.DataFrame:
+def get_app_data_location() -> tuple:
     """
-    Combines the junction and collision datasets, as well as filters by years chosen in app.
+    Filesystem + path of the app data (written by 05-build-serving-tables.py).
+    Local if not on streamlit server, otherwise GCS.
     """
-    logging.info(f"CACHE MISS: combine_junctions_and_collisions - casualty_type={casualty_type}")
-
-    if casualty_type == 'cyclist':
-        collisions = collisions[collisions['is_cyclist_collision']]
-    elif casualty_type == 'pedestrian':
-        collisions = collisions[collisions['is_pedestrian_collision']]
-
-    junction_collisions = (
-        junctions
-        .merge(
-            collisions,
-            how='inner',  # inner as we don't care about junctions with no collisions
-            on=['junction_id', 'junction_index']
-        )
-        .merge(
-            notes,
-            how='left',
-            on='junction_cluster_id'
-        )
-    )
-    junction_collisions.loc[junction_collisions['notes'].isna(), 'notes'] = ''
-
-    junction_collisions = get_danger_metric(
-        junction_collisions, casualty_type
-    )
+    if ENVIRONMENT == 'dev':
+        return None, 'data/app-data-tolerance=15'
 
-    junction_collisions['recency_danger_metric'] = (
-        junction_collisions['danger_metric'] * junction_collisions['recency_weight']
-    )
+    conn = st.connection('gcs', type=FilesConnection)
+    return conn.fs, 'lcc-app-data/2020-2024/app-data-tolerance=15'
 
-    # add stats19 link column
-    junction_collisions['stats19_link'] = junction_collisions['collision_index'].apply(
-        lambda x: f'https://www.cyclestreets.net/collisions/reports/{x}/'
-    )
-    junction_collisions['collision_label'] = junction_collisions.apply(
-        lambda row: create_collision_labels(row, casualty_type), axis=1
-    )
 
-    return junction_collisions
+@st.cache_data(show_spinner=False, ttl=24*60*60, max_entries=1)
+def read_app_manifest() -> dict:
+    """
+    Boroughs + years in the app data, for the app options, without reading the data itself
+    """
+    filesystem, path = get_app_data_location()
+    with (filesystem.open if filesystem else open)(f'{path}/_manifest.json', 'r') as f:
+        return json.load(f)
 
 
-def get_danger_metric(
-    junction_collisions: pd.DataFrame,
+def read_partitions(
+    name: str,
     casualty_type: str,
-    weight_fatal: float = DATA_PARAMETERS['weight_fatal'],
-    weight_serious: float = DATA_PARAMETERS['weight_serious'],
-    weight_slight: float = DATA_PARAMETERS['weight_slight'],
-):
-    '''
-    Upweights more severe collisions for junction comparison.
-    Only take worst severity, so if multiple casualties involved we have to ignore less severe.
-    '''
-    conditions = [
-        junction_collisions[f'fatal_{casualty_type}_casualties'] > 0,
-        junction_collisions[f'serious_{casualty_type}_casualties'] > 0,
-        junction_collisions[f'slight_{casualty_type}_casualties'] > 0
-    ]
+    boroughs: list,
+    columns: list = None,
+    row_filter: ds.Expression = None
+) -> pd.DataFrame:
+    """
+    Read only the casualty type + borough partitions of an app dataset that are needed
+    """
+    filesystem, path = get_app_data_location()
+    dataset = ds.dataset(f'{path}/{name}', format='parquet', partitioning='hive', filesystem=filesystem)
 
-    choices = [weight_fatal, weight_serious, weight_slight
-]
-    junction_collisions['danger_metric'] = np.select(conditions, choices, default=None)
-    
-    return junction_collisions
+    partition_filter = ds.field('casualty_type') == casualty_type
+    if 'ALL' not in boroughs:
+        partition_filter = partition_filter & ds.field('borough').isin(boroughs)
+    if row_filter is not None:
+        partition_filter = partition_filter & row_filter
 
+    return dataset.to_table(columns=columns, filter=partition_filter).to_pandas()
 
-def get_all_year_df(junction_collisions: pd.DataFrame) -> pd.DataFrame:
+
+@st.cache_data(show_spinner=False, ttl=24*60*60, max_entries=4)
+def read_in_data(casualty_type: str, junction_cluster_ids: list) -> pd.DataFrame:
     """
-    Function to get a dataframe containing all years and cluster combinations possible
+    Function to read in the collisions + their junctions for a casualty type at the junction clusters being
+    drawn. Every collision at a cluster is read, including any in boroughs not selected, so clusters on a
+    borough boundary are shown whole. Danger metrics + links are precalculated.
     """
-    all_years = junction_collisions[['year']].dropna().drop_duplicates()
-    all_clusters = junction_collisions[['junction_cluster_id']].dropna().drop_duplicates()
-    all_years['key'] = 0
-    all_clusters['key'] = 0
+    logging.info(f"CACHE MISS: read_in_data - casualty_type={casualty_type}, clusters={len(junction_cluster_ids)}")
 
-    all_years = all_years.merge(all_clusters, how='outer', on='key').drop(columns='key')
-    return all_years
+    return read_partitions(
+        'junction_collisions',
+        casualty_type,
+        ['ALL'],
+        row_filter=ds.field('junction_cluster_id').isin(junction_cluster_ids)
+    )
 
 
-def calculate_metric_trajectories(junction_collisions: pd.DataFrame, dangerous_junctions: pd.DataFrame) -> pd.DataFrame:
+# a resource rather than data, so sessions share the arrays rather than each getting a copy, it's only read
+@st.cache_resource(show_spinner=False, ttl=24*60*60, max_entries=2)
+def read_danger_cube(casualty_type: str) -> DangerCube:
     """
-    Function to aggregate by junction and calculate danger metric, plus work out the trajectory of the metric.
-    TODO - split this function out.
+    Sums by junction cluster, borough + year for a casualty type, to rank junctions from
     """
-    dangerous_junction_cluster_ids = dangerous_junctions['junction_cluster_id'].unique()
+    logging.info(f"CACHE MISS: read_danger_cube - casualty_type={casualty_type}")
 
-    filtered_junction_collisions = junction_collisions[
-        junction_collisions['junction_cluster_id'].isin(dangerous_junction_cluster_ids)
-    ]
+    filesystem, path = get_app_data_location()
+    with (filesystem.open if filesystem else open)(f'{path}/danger_cube/{casualty_type}.npz', 'rb') as f:
+        return DangerCube.load(f)
 
-    all_years_mapping = get_all_year_df(filtered_junction_collisions)
 
-    yearly_stats = (
-        filtered_junction_collisions
-        .groupby(['junction_cluster_id', 'year'])['danger_metric']
-        .sum()
-        .reset_index()
-    )
-
-    with pd.option_context('future.no_silent_downcasting', True):
-        yearly_stats = (
-            all_years_mapping
-            .merge(
-                yearly_stats,
-                how='left',
-                on=['year', 'junction_cluster_id']
-            )
-            .fillna(0)
-            .sort_values(by=['junction_cluster_id', 'year'])
-            .groupby('junction_cluster_id')['danger_metric']
-            .apply(list)
-            .reset_index(name='yearly_danger_metrics')
-        )
-
-    dangerous_junctions = dangerous_junctions.merge(
-        yearly_stats,
-        how='left',
-        on='junction_cluster_id'
-    )
-    return dangerous_junctions
+@st.cache_data(show_spinner=False, ttl=24*60*60, max_entries=1)
+def read_junction_notes() -> pd.DataFrame:
+    try:
+        return pd.read_csv(st.secrets["junction_notes"])
+    except FileNotFoundError:
+        return pd.DataFrame(columns=["junction_cluster_id", "notes"])
 
 
-def create_collision_labels(row: pd.DataFrame, casualty_type: str) -> str:
+def format_labels(template: str, columns: dict, **constants) -> list:
     """
-    Takes a row of data from a dataframe and extracts info for collision map labels
-    """
-    collision_index = row['collision_index']
-    date = row['date']
-    danger_metric = np.round(row['recency_danger_metric'], 2)
-    n_fatal = int(row[f'fatal_{casualty_type}_casualties'])
-    n_serious = int(row[f'serious_{casualty_type}_casualties'])
-    n_slight = int(row[f'slight_{casualty_type}_casualties'])
-    severity = row[f'max_{casualty_type}_severity']
-    link = row['stats19_link']
-
-    label = f"""
-        <h3>{collision_index}</h3>
-        Date: <b>{date}</b> <br>
-        Collision danger metric: <b>{danger_metric}</b> <br>
-        Max {casualty_type} severity: <b>{severity}</b> <br>
-        <a href="{link}" target="_blank">Stats19 report</a>
-        <hr>
-        Fatal {casualty_type} casualties: <b>{n_fatal}</b> <br>
-        Serious {casualty_type} casualties: <b>{n_serious}</b> <br>
-        Slight {casualty_type} casualties: <b>{n_slight}</b>
+    Fill a label template for every row of columns, each formatted as a whole column first
     """
-    return label
+    names = list(columns)
+    return [
+        template.format(**constants, **dict(zip(names, values)))
+        for values in zip(*[column.tolist() for column in columns.values()])
+    ]
 
 
-def create_junction_labels(row: pd.DataFrame, casualty_type: str) -> str:
+def create_collision_labels(collisions: pd.DataFrame, casualty_type: str) -> list:
     """
-    Takes a row of data from a dataframe and extracts info for junction map labels
+    Map labels for the collisions being drawn
     """
-    junction_name = row['junction_cluster_name']
-    rank = int(row['junction_rank'])
-    recency_metric = np.round(row['recency_danger_metric'], 2)
-    n_fatal = int(row[f'fatal_{casualty_type}_casualties'])
-    n_serious = int(row[f'serious_{casualty_type}_casualties'])
-    n_slight = int(row[f'slight_{casualty_type}_casualties'])
-    notes = row['notes']
+    return format_labels(
+        COLLISION_LABEL_TEMPLATE,
+        {
+            'collision_index': collisions['collision_index'],
+            'date': collisions['date'],
+            'danger_metric': collisions['recency_danger_metric'].round(2),
+            'n_fatal': collisions[f'fatal_{casualty_type}_casualties'].astype(int),
+            'n_serious': collisions[f'serious_{casualty_type}_casualties'].astype(int),
+            'n_slight': collisions[f'slight_{casualty_type}_casualties'].astype(int),
+            'severity': collisions[f'max_{casualty_type}_severity'],
+            'link': collisions['stats19_link'],
+        },
+        casualty_type=casualty_type
+    )
 
-    label = f"""
-        <h3>{junction_name}</h3>
-        Dangerous Junction Rank: <b>{rank}</b> <br>
-        Danger Metric: <b>{recency_metric}</b> <br>
-        <hr>
-        Fatal {casualty_type} casualties: <b>{n_fatal}</b> <br>
-        Serious {casualty_type} casualties: <b>{n_serious}</b> <br>
-        Slight {casualty_type} casualties: <b>{n_slight}</b>
-        <hr>
-        {notes}
+
+def create_junction_labels(junctions: pd.DataFrame, casualty_type: str) -> list:
+    """
+    Map labels for the junctions being drawn
     """
-    return label
+    return format_labels(
+        JUNCTION_LABEL_TEMPLATE,
+        {
+            'junction_name': junctions['junction_cluster_name'],
+            'rank': junctions['junction_rank'].astype(int),
+            'recency_metric': junctions['recency_danger_metric'].round(2),
+            'n_fatal': junctions[f'fatal_{casualty_type}_casualties'].astype(int),
+            'n_serious': junctions[f'serious_{casualty_type}_casualties'].astype(int),
+            'n_slight': junctions[f'slight_{casualty_type}_casualties'].astype(int),
+            'notes': junctions['notes'],
+        },
+        casualty_type=casualty_type
+    )
 
 
 @st.cache_data(show_spinner=False, ttl=3*60, max_entries=5)
 def calculate_dangerous_junctions(
-    junction_collisions: pd.DataFrame,
     n_junctions: int,
     casualty_type: str,
     boroughs: str
 ) -> pd.DataFrame:
     """
-    Calculate most dangerous junctions in data and return n worst.
+    Calculate most dangerous junctions in boroughs and return n worst, from the danger cube.
     """
     logging.info(f"""CACHE MISS: calculate_dangerous_junctions - n_junctions={n_junctions}, casualty_type={casualty_type}, boroughs={boroughs}""")
 
-    grp_cols = [
-        'junction_cluster_id', 'junction_cluster_name',
-        'latitude_cluster', 'longitude_cluster', 'notes'
-    ]
-    agg_cols = [
-        'recency_danger_metric',
-        f'fatal_{casualty_type}_casualties',
-        f'serious_{casualty_type}_casualties',
-        f'slight_{casualty_type}_casualties',
-    ]
-
-    if 'ALL' not in boroughs:
-        junction_collisions = junction_collisions[junction_collisions['borough'].isin(boroughs)]
-
-    dangerous_junctions = (
-        junction_collisions
-        .groupby(grp_cols)[agg_cols]
-        .sum()
-        .reset_index()
-        .sort_values(by=['recency_danger_metric', f'fatal_{casualty_type}_casualties'], ascending=[False, False])
-        .head(n_junctions)
-        .reset_index()
-    )
-
-    dangerous_junctions['junction_rank'] = dangerous_junctions.index + 1
+    dangerous_junctions = read_danger_cube(casualty_type).rank(boroughs, n_junctions, casualty_type)
 
-    dangerous_junctions = calculate_metric_trajectories(junction_collisions, dangerous_junctions)
-
-    dangerous_junctions['label'] = dangerous_junctions.apply(
-        lambda row: create_junction_labels(row, casualty_type),
-        axis=1
+    dangerous_junctions = dangerous_junctions.merge(
+        read_junction_notes(),
+        how='left',
+        on='junction_cluster_id'
     )
+    dangerous_junctions.loc[dangerous_junctions['notes'].isna(), 'notes'] = ''
 
-    return dangerous_junctions
+    columns = CLUSTER_ATTRIBUTES + [c for c in dangerous_junctions.columns if c not in CLUSTER_ATTRIBUTES]
+    return dangerous_junctions[columns]
 
 
 def get_html_colors(n: int) -> list:
@@ -360,7 +277,9 @@ def create_base_map(initial_location: list, initial_zoom: int) -> folium.Map:
     return m
 
 
-def get_high_level_fg(dangerous_junctions: pd.DataFrame, map_data: pd.DataFrame, n_junctions: int) -> folium.FeatureGroup:
+def get_high_level_fg(
+    dangerous_junctions: pd.DataFrame, map_data: pd.DataFrame,
+    n_junctions: int, casualty_type: str) -> folium.FeatureGroup:
     """
     Function to generate feature groups to add to high level map
     """
@@ -373,9 +292,10 @@ def get_high_level_fg(dangerous_junctions: pd.DataFrame, map_data: pd.DataFrame,
     pal = get_html_colors(n_junctions)
 
     # add junction markers
-    cols = ['latitude_cluster', 'longitude_cluster', 'label', 'junction_rank']
+    cols = ['latitude_cluster', 'longitude_cluster', 'junction_rank']
+    labels = create_junction_labels(dangerous_junctions, casualty_type)
 
-    for lat, lon, label, rank in dangerous_junctions[cols].values[::-1]:
+    for (lat, lon, rank), label in list(zip(dangerous_junctions[cols].itertuples(index=False), labels))[::-1]:
         iframe = folium.IFrame(
             html='''
                 <style>
@@ -433,8 +353,11 @@ def get_low_level_fg(
         # filter lower level data to cluster
         id_collisions = junction_collisions[junction_collisions['junction_cluster_id'] == id]
 
-        cols = ['latitude', 'longitude', f'max_{casualty_type}_severity', 'collision_label']
-        for collision_lat, collision_lon, severity, label in id_collisions[cols].dropna().values:
+        cols = ['latitude', 'longitude', f'max_{casualty_type}_severity']
+        id_collisions = id_collisions.dropna(subset=cols)
+        labels = create_collision_labels(id_collisions, casualty_type)
+
+        for (collision_lat, collision_lon, severity), label in zip(id_collisions[cols].values, labels):
             # draw lines between central point and collisions
             fg.add_child(
                 folium.PolyLine(
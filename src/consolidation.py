@@ -0,0 +1,238 @@
+"""
+Faster alternatives to ox.consolidate_intersections for large graphs.
+
+We only use the node -> cluster mapping from consolidate_intersections, so all methods here return
+just that, as a ClusterIndex.
+
+Tiled: a parallel version of ox.consolidate_intersections.
+
+The projected graph is split into a grid of square tiles. Each tile is sent to a worker process with a
+halo of the nodes around it, and nodes are geometrically merged there the same way as OSMnx does, i.e.
+buffered by tolerance and overlapping buffers dissolved. Two nodes whose buffers overlap are at most
+2 x tolerance apart, so with a halo wider than that every overlapping pair is seen together in at least
+one tile. Tile clusters sharing a node are then merged, which gives the same clusters as merging the
+whole graph at once, regardless of how it was tiled. As in OSMnx, clusters that aren't connected in
+the graph are split into their weakly connected components, and clusters are numbered in node order.
+
+KD-tree: nodes are merged as the connected components of all pairs of nodes close enough for their
+buffers to overlap, i.e. within 2 x tolerance, found with a KD-tree. This skips building polygons + the graph,
+so is much quicker and uses less memory. Clusters only differ from OSMnx for pairs right on the
+2 x tolerance boundary, as OSMnx's buffers are polygons rather than true circles.
+"""
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+import osmnx as ox
+
+from scipy.spatial import cKDTree
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from concurrent.futures import ProcessPoolExecutor
+from junction_hierarchy import ClusterIndex
+
+
+def get_tiles(x: np.ndarray, y: np.ndarray, tile_size: float, halo: float) -> list:
+    """
+    Split nodes into a grid of tiles, returns a list of the node positions in each tile + its halo
+    """
+    min_x, min_y = x.min(), y.min()
+    tile_x = ((x - min_x) // tile_size).astype(int)
+    tile_y = ((y - min_y) // tile_size).astype(int)
+
+    tiles = []
+    for i, j in sorted(set(zip(tile_x, tile_y))):
+        x0, y0 = min_x + i * tile_size, min_y + j * tile_size
+        in_tile = (
+            (x >= x0 - halo) & (x < x0 + tile_size + halo) &
+            (y >= y0 - halo) & (y < y0 + tile_size + halo)
+        )
+        tiles.append(np.flatnonzero(in_tile))
+
+    return tiles
+
+
+def merge_nodes_geometric(x: np.ndarray, y: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Buffer nodes by tolerance + dissolve overlaps, as OSMnx does. Returns the cluster number of each node.
+    """
+    points = gpd.GeoSeries(gpd.points_from_xy(x, y))
+    merged = points.buffer(tolerance).unary_union
+    clusters = gpd.GeoDataFrame(geometry=list(getattr(merged, 'geoms', [merged])))
+
+    joined = gpd.sjoin(gpd.GeoDataFrame(geometry=points), clusters, how='left', predicate='within')
+    return joined['index_right'].sort_index().to_numpy()
+
+
+def consolidate_tile(tile: tuple) -> tuple:
+    """
+    Worker for a single tile, returns the tile's node positions and their cluster within the tile
+    """
+    positions, x, y, tolerance = tile
+    return positions, merge_nodes_geometric(x, y, tolerance)
+
+
+def label_components(n_nodes: int, u: np.ndarray, v: np.ndarray) -> np.ndarray:
+    graph = coo_matrix((np.ones(len(u), dtype=np.int8), (u, v)), shape=(n_nodes, n_nodes))
+    return connected_components(graph, directed=False)[1]
+
+
+def get_node_arrays(G) -> tuple:
+    """
+    Node ids, x + y coordinates of a projected graph as arrays
+    """
+    osmids = np.array(list(G.nodes))
+    x = np.array([data['x'] for _, data in G.nodes(data=True)], dtype=float)
+    y = np.array([data['y'] for _, data in G.nodes(data=True)], dtype=float)
+    return osmids, x, y
+
+
+def get_edge_positions(G, osmids: np.ndarray) -> tuple:
+    """
+    Positions in osmids of the start + end node of every edge
+    """
+    node_position = pd.Series(np.arange(len(osmids)), index=osmids)
+    edges = np.array([(u, v) for u, v, _ in G.edges], dtype=osmids.dtype).reshape(-1, 2)
+    u = node_position.loc[edges[:, 0]].to_numpy()
+    v = node_position.loc[edges[:, 1]].to_numpy()
+    return u, v
+
+
+def split_unconnected_clusters(G, osmids: np.ndarray, clusters: np.ndarray) -> np.ndarray:
+    """
+    Split clusters into their weakly connected components in the graph, by only keeping edges within a cluster
+    """
+    u, v = get_edge_positions(G, osmids)
+    within_cluster = clusters[u] == clusters[v]
+    return label_components(len(osmids), u[within_cluster], v[within_cluster])
+
+
+def to_cluster_index(osmids: np.ndarray, clusters: np.ndarray) -> ClusterIndex:
+    """
+    Number clusters in order of their first node, as OSMnx does
+    """
+    return ClusterIndex.from_mapping(osmids, pd.factorize(clusters)[0])
+
+
+def tiled_consolidate_intersections(
+    G,
+    tolerance: float,
+    tile_size: float = 5000,
+    max_workers: int = None
+) -> ClusterIndex:
+    """
+    Consolidate the intersections of a projected graph in tiles, in parallel
+    """
+    osmids, x, y = get_node_arrays(G)
+
+    # overlapping buffers are up to 2 x tolerance apart, so the halo needs to be wider than that
+    halo = 2 * tolerance + 1
+    tiles = get_tiles(x, y, tile_size, halo)
+    print(f'Consolidating {len(osmids)} nodes in {len(tiles)} tiles')
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = list(
+            executor.map(
+                consolidate_tile,
+                [(positions, x[positions], y[positions], tolerance) for positions in tiles]
+            )
+        )
+
+    # merge tile clusters that share nodes, as a graph of nodes + tile clusters
+    n_nodes = len(osmids)
+    node_positions, tile_clusters = [], []
+    cluster_offset = n_nodes
+    for positions, labels in results:
+        node_positions.append(positions)
+        tile_clusters.append(labels + cluster_offset)
+        cluster_offset += labels.max() + 1
+    clusters = label_components(
+        cluster_offset, np.concatenate(node_positions), np.concatenate(tile_clusters)
+    )[:n_nodes]
+
+    return to_cluster_index(osmids, split_unconnected_clusters(G, osmids, clusters))
+
+
+def kdtree_consolidate_intersections(G, tolerance: float, connected_pairs_only: bool = False) -> ClusterIndex:
+    """
+    Consolidate the intersections of a projected graph by merging nodes within 2 x tolerance of each other.
+    If connected_pairs_only, only nodes joined by an edge are merged, otherwise clusters are split into their
+    connected components afterwards, as OSMnx does.
+    """
+    osmids, x, y = get_node_arrays(G)
+
+    pairs = cKDTree(np.column_stack([x, y])).query_pairs(r=2 * tolerance, output_type='ndarray')
+
+    if connected_pairs_only:
+        u, v = get_edge_positions(G, osmids)
+        n_nodes = len(osmids)
+        edge_keys = np.union1d(u * n_nodes + v, v * n_nodes + u)
+        pairs = pairs[np.isin(pairs[:, 0] * n_nodes + pairs[:, 1], edge_keys)]
+
+    clusters = label_components(len(osmids), pairs[:, 0], pairs[:, 1])
+
+    if not connected_pairs_only:
+        clusters = split_unconnected_clusters(G, osmids, clusters)
+
+    return to_cluster_index(osmids, clusters)
+
+
+def osmnx_consolidate_intersections(G, tolerance: float) -> ClusterIndex:
+    """
+    Clusters from ox.consolidate_intersections, as used by 03-build-junctions-graph.py
+    """
+    G2 = ox.consolidate_intersections(
+        G,
+        tolerance=tolerance,
+        rebuild_graph=True,
+        dead_ends=True,
+        reconnect_edges=True
+    )
+    return ClusterIndex.from_consolidated_graph(G2)
+
+
+def get_cluster_sets(index: ClusterIndex) -> set:
+    """
+    Each cluster as a frozenset of its original osmids
+    """
+    return {
+        frozenset(index.junction_ids[start:end].tolist())
+        for start, end in zip(index.offsets[:-1], index.offsets[1:])
+    }
+
+
+def compare_clusters(G, tolerance: float, method, **kwargs) -> dict:
+    """
+    Compare the clusters, runtime + peak memory of a consolidation method against ox.consolidate_intersections
+    """
+    report = {'tolerance': tolerance}
+    results = {}
+    for name, func, func_kwargs in [('osmnx', osmnx_consolidate_intersections, {}), ('method', method, kwargs)]:
+        tracemalloc.start()
+        start_time = time.perf_counter()
+        results[name] = func(G.copy(), tolerance, **func_kwargs)
+        report[f'{name}_seconds'] = time.perf_counter() - start_time
+        report[f'{name}_peak_memory_mb'] = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        tracemalloc.stop()
+
+    expected = get_cluster_sets(results['osmnx'])
+    result = get_cluster_sets(results['method'])
+    same = expected & result
+
+    report.update({
+        'osmnx_clusters': len(expected),
+        'method_clusters': len(result),
+        'identical_clusters': len(same),
+        'osmnx_only_clusters': len(expected - same),
+        'method_only_clusters': len(result - same),
+        'nodes_in_differing_clusters': sum(len(cluster) for cluster in expected - same),
+        'identical_node_ids': all(
+            np.array_equal(expected_array, result_array)
+            for expected_array, result_array in zip(
+                results['osmnx'].get_junction_clusters(), results['method'].get_junction_clusters()
+            )
+        ),
+    })
+    return report
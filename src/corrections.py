@@ -0,0 +1,70 @@
+"""
+Apply the manual data corrections in data_corrections.yaml to the collision data.
+"""
+import pandas as pd
+
+
+def corrections_to_frame(corrections: dict) -> pd.DataFrame:
+    """
+    Flatten the nested corrections dict to one row per (collision_id, column, value)
+    """
+    records = [
+        (collision_id, column, value)
+        for collision_id, columns in (corrections or {}).items()
+        for column, value in columns.items()
+    ]
+    return pd.DataFrame(records, columns=['collision_id', 'column', 'value'])
+
+
+def apply_corrections(df: pd.DataFrame, corrections: dict, audit_path: str = None) -> tuple:
+    """
+    Data is sometimes incorrect in stats19, this updates values for all corrections at once.
+    Collisions are indexed by id once and each corrected column is updated in a single assignment.
+
+    Returns the corrected data and an audit of before / after values, which is also written to
+    audit_path if given. Corrections for ids or columns not in the data are flagged in the audit.
+    """
+    df = df.copy()
+    corrections = corrections_to_frame(corrections)
+
+    row_positions = (
+        pd.DataFrame({'collision_id': df['collision_id'].to_numpy(), 'position': range(len(df))})
+        .merge(corrections, how='right', on='collision_id')
+    )
+
+    row_positions['status'] = 'corrected'
+    row_positions.loc[~row_positions['column'].isin(df.columns), 'status'] = 'unknown_column'
+    row_positions.loc[row_positions['position'].isnull(), 'status'] = 'missing_collision_id'
+
+    to_apply = row_positions[row_positions['status'] == 'corrected']
+    row_positions['before'] = None
+
+    for column, updates in to_apply.groupby('column'):
+        positions = updates['position'].astype(int).to_numpy()
+        col_position = df.columns.get_loc(column)
+
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            new_categories = set(updates['value']) - set(df[column].cat.categories)
+            df[column] = df[column].cat.add_categories(sorted(new_categories))
+
+        row_positions.loc[updates.index, 'before'] = df.iloc[positions, col_position].to_numpy()
+        # corrections of every column are in one object column, so get the values' own type back first,
+        # otherwise e.g. an int column would become object
+        df.iloc[positions, col_position] = updates['value'].infer_objects().to_numpy()
+
+    audit = (
+        row_positions
+        .rename(columns={'value': 'after'})
+        [['collision_id', 'column', 'before', 'after', 'status']]
+    )
+
+    n_flagged = (audit['status'] != 'corrected').sum()
+    print(f'Applied {len(to_apply)} corrections to {to_apply["collision_id"].nunique()} collisions')
+    if n_flagged > 0:
+        print(f'{n_flagged} corrections could not be applied:')
+        print(audit[audit['status'] != 'corrected'])
+
+    if audit_path is not None:
+        audit.to_csv(audit_path, index=False)
+
+    return df, audit
@@ -0,0 +1,185 @@
+"""
+Rank junction clusters by danger from the collisions at them.
+
+The app ranks from a DangerCube, built for each casualty type by 05-build-serving-tables.py, which holds
+the sums for each (cluster, borough, year) with collisions. A ranking for any boroughs sums the cells
+of those boroughs with np.bincount on integer cluster positions, rather than grouping every collision
+on the cluster's id, name, coordinates + notes. Only the clusters that could be in the top n are sorted,
+picked with np.argpartition. Clusters are ranked by recency danger metric, then fatal casualties, then
+cluster id.
+
+Imports nothing from streamlit, so it can be used by the app, pipeline stages and benchmarks.
+"""
+import numpy as np
+import pandas as pd
+
+from dataclasses import dataclass
+
+
+# summing the same metrics in a different order can differ in the last bits, so sums are rounded
+# to this many decimal places before ranking, to keep ties as ties for the fatal casualties tie-break
+METRIC_DECIMALS = 9
+
+CLUSTER_ATTRIBUTES = ['junction_cluster_id', 'junction_cluster_name', 'latitude_cluster', 'longitude_cluster', 'notes']
+
+
+def get_sum_columns(casualty_type: str) -> list:
+    return [
+        'recency_danger_metric',
+        f'fatal_{casualty_type}_casualties',
+        f'serious_{casualty_type}_casualties',
+        f'slight_{casualty_type}_casualties',
+    ]
+
+
+def top_n(cluster_ids: np.ndarray, metric: np.ndarray, fatal: np.ndarray, n: int) -> np.ndarray:
+    """
+    Positions of the n clusters with the highest metric, then most fatal casualties, then lowest cluster id.
+    Only clusters that could be in the top n are sorted.
+    """
+    if n < len(metric):
+        # everything tied with the nth highest metric could be in the top n
+        nth_highest = metric[np.argpartition(-metric, n - 1)[n - 1]]
+        candidates = np.flatnonzero(metric >= nth_highest)
+    else:
+        candidates = np.arange(len(metric))
+
+    order = np.lexsort((cluster_ids[candidates], -fatal[candidates], -metric[candidates]))
+    return candidates[order[:n]]
+
+
+@dataclass
+class DangerCube:
+    """
+    Sums of a casualty type's collisions by (cluster, borough, year), one cell for each that has collisions.
+    Cells are stored CSR style by borough, the cells of boroughs[i] are cells[offsets[i]:offsets[i + 1]],
+    with the cluster + year of each cell as positions in cluster_ids + years.
+    Collisions with no borough are in a '' borough, so are only counted for ALL.
+    """
+    cluster_ids: np.ndarray
+    cluster_names: np.ndarray
+    latitudes: np.ndarray
+    longitudes: np.ndarray
+    boroughs: np.ndarray
+    years: np.ndarray
+    offsets: np.ndarray
+    cell_clusters: np.ndarray
+    cell_years: np.ndarray
+    cell_sums: np.ndarray  # n cells x danger metric + get_sum_columns
+
+    @classmethod
+    def from_junction_collisions(cls, junction_collisions: pd.DataFrame, casualty_type: str) -> 'DangerCube':
+        """
+        Build from the collisions of a casualty type joined to their junctions, as in the serving table
+        """
+        sum_columns = ['danger_metric'] + get_sum_columns(casualty_type)
+        cells = (
+            junction_collisions
+            .assign(borough=junction_collisions['borough'].astype(object).fillna(''))
+            .groupby(['borough', 'junction_cluster_id', 'year'])[sum_columns]
+            .sum()
+            .reset_index()
+        )
+        clusters = (
+            junction_collisions[CLUSTER_ATTRIBUTES[:-1]]  # notes are added by the app
+            .drop_duplicates('junction_cluster_id')
+            .sort_values('junction_cluster_id')
+        )
+
+        cluster_ids = clusters['junction_cluster_id'].to_numpy(dtype=np.int64)
+        boroughs, borough_codes = np.unique(cells['borough'].to_numpy(dtype=str), return_inverse=True)
+        years = np.unique(cells['year'].to_numpy(dtype=np.int64))
+
+        return cls(
+            cluster_ids=cluster_ids,
+            cluster_names=clusters['junction_cluster_name'].to_numpy(dtype=str),
+            latitudes=clusters['latitude_cluster'].to_numpy(dtype=float),
+            longitudes=clusters['longitude_cluster'].to_numpy(dtype=float),
+            boroughs=boroughs,
+            years=years,
+            offsets=np.searchsorted(borough_codes, np.arange(len(boroughs) + 1)).astype(np.int64),
+            cell_clusters=np.searchsorted(cluster_ids, cells['junction_cluster_id'].to_numpy()).astype(np.int32),
+            cell_years=np.searchsorted(years, cells['year'].to_numpy()).astype(np.int8),
+            cell_sums=np.asfortranarray(cells[sum_columns].to_numpy(dtype=float)),  # summed a column at a time
+        )
+
+    def __len__(self) -> int:
+        return len(self.cell_clusters)
+
+    def get_cells(self, boroughs: list):
+        """
+        Positions of the cells in boroughs, or a slice of every cell for ALL so nothing is copied
+        """
+        if 'ALL' in boroughs:
+            return slice(None)
+
+        borough_codes = np.searchsorted(self.boroughs, sorted(set(boroughs)))
+        return np.concatenate([np.arange(0)] + [
+            np.arange(self.offsets[i], self.offsets[i + 1])
+            for i, borough in zip(borough_codes, sorted(set(boroughs)))
+            if i < len(self.boroughs) and self.boroughs[i] == borough
+        ])
+
+    def get_yearly_danger_metrics(self, cells, cluster_codes: np.ndarray) -> list:
+        """
+        Danger metric of each cluster by year, over the years any of the clusters have collisions in
+        """
+        rows = np.full(len(self.cluster_ids), -1)
+        rows[cluster_codes] = np.arange(len(cluster_codes))
+        cell_rows = rows[self.cell_clusters[cells]]
+        is_ranked = cell_rows >= 0
+        cell_rows = cell_rows[is_ranked]
+        cell_years = self.cell_years[cells][is_ranked]
+
+        n_years = len(self.years)
+        yearly = np.bincount(
+            cell_rows * n_years + cell_years,
+            weights=self.cell_sums[cells, 0][is_ranked],
+            minlength=len(cluster_codes) * n_years
+        ).reshape(len(cluster_codes), n_years)
+
+        return yearly[:, np.bincount(cell_years, minlength=n_years) > 0].tolist()
+
+    def rank(self, boroughs: list, n_junctions: int, casualty_type: str) -> pd.DataFrame:
+        """
+        The n most dangerous junction clusters in boroughs, with their summed metrics, casualties, rank + yearly
+        danger metrics. Only the cells of the boroughs are summed, no collisions are read.
+        """
+        sum_columns = get_sum_columns(casualty_type)
+        cells = self.get_cells(boroughs)
+        cell_clusters = self.cell_clusters[cells]
+        cell_sums = self.cell_sums[cells]
+
+        cluster_codes = np.flatnonzero(np.bincount(cell_clusters, minlength=len(self.cluster_ids)))
+        sums = np.column_stack([
+            np.bincount(cell_clusters, weights=cell_sums[:, i], minlength=len(self.cluster_ids))[cluster_codes]
+            for i in range(1, cell_sums.shape[1])
+        ])
+
+        sums[:, 0] = np.round(sums[:, 0], METRIC_DECIMALS)
+        positions = top_n(self.cluster_ids[cluster_codes], sums[:, 0], sums[:, 1], n_junctions)
+        cluster_codes = cluster_codes[positions]
+
+        dangerous_junctions = pd.DataFrame({
+            'junction_cluster_id': self.cluster_ids[cluster_codes],
+            'junction_cluster_name': self.cluster_names[cluster_codes].astype(object),
+            'latitude_cluster': self.latitudes[cluster_codes],
+            'longitude_cluster': self.longitudes[cluster_codes],
+        })
+        dangerous_junctions[sum_columns] = sums[positions]
+        dangerous_junctions[sum_columns[1:]] = dangerous_junctions[sum_columns[1:]].round().astype(np.int64)
+        dangerous_junctions['junction_rank'] = np.arange(1, len(dangerous_junctions) + 1)
+        dangerous_junctions['yearly_danger_metrics'] = self.get_yearly_danger_metrics(cells, cluster_codes)
+
+        return dangerous_junctions
+
+    def save(self, path):
+        np.savez_compressed(path, **{name: getattr(self, name) for name in self.__dataclass_fields__})
+
+    @classmethod
+    def load(cls, path) -> 'DangerCube':
+        """
+        Load from a path or an open file
+        """
+        with np.load(path) as arrays:
+            return cls(**{name: arrays[name] for name in cls.__dataclass_fields__})
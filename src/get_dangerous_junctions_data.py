@@ -10,8 +10,6 @@ from app_functions import *
 ENVIRONMENT = os.environ.get("ENVIRONMENT", "prod")
 DATA_PARAMETERS = yaml.load(open("params.yaml", 'r'), Loader=Loader)
 
-junctions, collisions, notes = read_in_data(DATA_PARAMETERS)
-
 
 for casualty_type in ['pedestrian', 'cyclist']:
     print(casualty_type)
@@ -32,18 +30,10 @@ for casualty_type in ['pedestrian', 'cyclist']:
     ]
 
     dangerous_junctions_list = []
-    for borough in collisions['borough'].unique():
+    for borough in read_app_manifest()['boroughs']:
         print(borough)
 
-        junction_collisions = combine_junctions_and_collisions(
-            junctions,
-            collisions,
-            notes,
-            casualty_type,
-        )
-
         dangerous_junctions = calculate_dangerous_junctions(
-            junction_collisions,
             n_junctions=10,
             casualty_type=casualty_type,
             boroughs=[borough]
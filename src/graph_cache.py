@@ -0,0 +1,193 @@
+"""
+On-disk cache of the OSM road graph used to build junctions.
+
+Downloading + simplifying the Greater London road network from Overpass is the slowest and least
+reliable step in the pipeline, so the raw graph (G1) and its projection are saved as GraphML,
+keyed by where the graph came from. Reruns, e.g. with a different tolerance, load the cached graphs.
+The graph can also be built from a local OSM extract (.osm / .osm.pbf) with no network access.
+"""
+import os
+import re
+import ast
+import json
+import hashlib
+import osmnx as ox
+
+from hashing import hash_file
+
+
+# bump when the way graphs are built changes, so old caches aren't used
+GRAPH_CACHE_VERSION = 2
+
+# conditions of an overpass filter, e.g. ["highway"] or ["highway"!~"footway|path"]
+OSM_FILTER_REGEX = re.compile(r'\["([^"]+)"(?:(!?~)"([^"]*)")?\]')
+
+
+def get_graph_source(config: dict) -> dict:
+    """
+    Everything that determines the graph, used as the cache key
+    """
+    source = {
+        'version': GRAPH_CACHE_VERSION,
+        'osmnx_version': ox.__version__,
+        'network_type': config['network_type'],
+    }
+    if config.get('osm_file'):
+        source['osm_file'] = os.path.basename(config['osm_file'])
+        source['osm_file_hash'] = hash_file(config['osm_file'])
+    else:
+        source['place'] = config['place']
+    return source
+
+
+def get_cache_dir(config: dict, source: dict) -> str:
+    key = hashlib.sha256(json.dumps(source, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(config['cache_dir'], key)
+
+
+def graph_from_osm_file(path: str, network_type: str):
+    """
+    Build a simplified graph from a local OSM extract, .pbf files need the optional pyrosm package
+    """
+    if path.endswith('.pbf'):
+        try:
+            import pyrosm
+        except ImportError as e:
+            raise ImportError('Building the graph from a .osm.pbf file needs pyrosm: pip install pyrosm') from e
+
+        # pyrosm network types are named differently to osmnx
+        pyrosm_network_types = {'drive': 'driving', 'walk': 'walking', 'bike': 'cycling', 'all': 'all'}
+
+        osm = pyrosm.OSM(path)
+        nodes, edges = osm.get_network(network_type=pyrosm_network_types[network_type], nodes=True)
+        G = osm.to_graph(nodes, edges, graph_type='networkx', osmnx_compatible=True)
+        return ox.simplify_graph(G)
+
+    return graph_from_xml(path, network_type)
+
+
+def get_network_filter(network_type: str) -> list:
+    """
+    (tag, operator, regex) conditions of the filter OSMnx downloads a network type with
+    """
+    return OSM_FILTER_REGEX.findall(ox._overpass._get_osm_filter(network_type))
+
+
+def matches_network_filter(tags: dict, conditions: list) -> bool:
+    """
+    Whether a way's tags pass the filter, as overpass applies it: a missing tag doesn't match a regex
+    """
+    for tag, operator, pattern in conditions:
+        value = tags.get(tag)
+        if operator == '' and value is None:
+            return False
+        if operator == '~' and (value is None or not re.search(pattern, str(value))):
+            return False
+        if operator == '!~' and value is not None and re.search(pattern, str(value)):
+            return False
+    return True
+
+
+def graph_from_xml(path: str, network_type: str):
+    """
+    Build a simplified graph from a .osm file with only the ways OSMnx would download for the network type,
+    graph_from_xml loads every way in the file
+    """
+    conditions = get_network_filter(network_type)
+    filter_tags = {tag for tag, _, _ in conditions} - set(ox.settings.useful_tags_way)
+
+    # load the tags the filter needs too, then drop them so the graph matches a downloaded one
+    useful_tags_way = ox.settings.useful_tags_way
+    ox.settings.useful_tags_way = list(useful_tags_way) + sorted(filter_tags)
+    try:
+        G = ox.graph_from_xml(
+            path,
+            simplify=False,
+            retain_all=True,
+            bidirectional=network_type in ox.settings.bidirectional_network_types
+        )
+    finally:
+        ox.settings.useful_tags_way = useful_tags_way
+
+    G.remove_edges_from([
+        (u, v, k) for u, v, k, data in G.edges(keys=True, data=True) if not matches_network_filter(data, conditions)
+    ])
+    for _, _, data in G.edges(data=True):
+        for tag in filter_tags:
+            data.pop(tag, None)
+
+    G = ox.utils_graph.get_largest_component(G)
+    return ox.simplify_graph(G)
+
+
+def restore_list_attributes(G):
+    """
+    GraphML stores list attributes (e.g. edges with several road names) as strings, convert them back
+    """
+    attribute_dicts = [data for _, data in G.nodes(data=True)] + [data for _, _, data in G.edges(data=True)]
+    for data in attribute_dicts:
+        for key, val in data.items():
+            if isinstance(val, str) and val.startswith('[') and val.endswith(']'):
+                try:
+                    data[key] = ast.literal_eval(val)
+                except (ValueError, SyntaxError):
+                    pass
+    return G
+
+
+def load_graphml(path: str):
+    return restore_list_attributes(ox.load_graphml(path))
+
+
+def download_graph(config: dict):
+    return ox.graph_from_place(
+        config['place'],  # critical to use greater london, the city of London is not included otherwsie!!
+        network_type=config['network_type'],
+        simplify=True,
+        clean_periphery=True
+    )
+
+
+def load_cached_graph(config: dict):
+    """
+    Load the (unprojected) road graph from the cache, for stages after it's been built
+    """
+    graph_path = os.path.join(get_cache_dir(config, get_graph_source(config)), 'G1.graphml')
+    if not os.path.exists(graph_path):
+        raise FileNotFoundError(f'No cached road graph at {graph_path}, run 03-build-junctions-graph.py first')
+    print(f'Loading cached graph: {graph_path}')
+    return load_graphml(graph_path)
+
+
+def load_graphs(config: dict, refresh: bool = False) -> tuple:
+    """
+    Load the road graph + its projection from the cache, building and caching them if needed.
+    Returns (G1, G1 projected).
+    """
+    source = get_graph_source(config)
+    cache_dir = get_cache_dir(config, source)
+    graph_path = os.path.join(cache_dir, 'G1.graphml')
+    projected_path = os.path.join(cache_dir, 'G1-projected.graphml')
+
+    if not refresh and os.path.exists(graph_path) and os.path.exists(projected_path):
+        print(f'Loading cached graph: {cache_dir}')
+        return load_graphml(graph_path), load_graphml(projected_path)
+
+    if config.get('osm_file'):
+        print(f'Building graph from: {config["osm_file"]}')
+        G1 = graph_from_osm_file(config['osm_file'], config['network_type'])
+    else:
+        print(f'Downloading graph for: {config["place"]}')
+        G1 = download_graph(config)
+
+    print('Projecting graph')
+    G1_projected = ox.project_graph(G1)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    ox.save_graphml(G1, graph_path)
+    ox.save_graphml(G1_projected, projected_path)
+    with open(os.path.join(cache_dir, 'metadata.json'), 'w') as f:
+        json.dump({**source, 'nodes': len(G1.nodes), 'edges': len(G1.edges)}, f, indent=2)
+
+    print(f'Cached graph: {cache_dir}')
+    return G1, G1_projected
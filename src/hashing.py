@@ -0,0 +1,15 @@
+"""
+File hashing shared by the stage runner, the ingest store, the mapping store + the graph cache.
+"""
+import hashlib
+
+
+def hash_file(path: str) -> str:
+    """
+    sha256 of a file's contents, read in blocks so large files aren't loaded into memory
+    """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(block)
+    return sha.hexdigest()
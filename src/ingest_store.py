@@ -0,0 +1,167 @@
+"""
+Year-partitioned store of the formatted collision + casualty data.
+
+Each year of TfL data is stored as its own parquet partition, e.g. data/collisions/year=2024/,
+alongside a manifest of the source links, content hashes and row counts used to build it.
+A run only re-ingests the years whose source files (or ingest settings) have changed.
+"""
+import os
+import re
+import json
+import shutil
+import hashlib
+import pandas as pd
+
+from pandas.api.types import union_categoricals
+from schema import read_table, write_table
+from hashing import hash_file
+
+
+MANIFEST_FILE = 'ingest-manifest.json'
+TABLES = ['collisions', 'casualties']
+
+
+def get_link_year(link: str) -> int:
+    """
+    Get the year of data a TfL link is for, from the link itself
+    """
+    match = re.search(r'(20\d{2})', link)
+    if match is None:
+        raise ValueError(f'Could not find year in link: {link}')
+    return int(match.group(1))
+
+
+def get_link_table(link: str) -> str:
+    """
+    TfL links are either collision (attendant) or casualty extracts
+    """
+    if 'attendant' in link:
+        return 'collisions'
+    if ('casualty' in link) or ('casualties' in link):
+        return 'casualties'
+    raise ValueError(f'Unknown TfL extract type: {link}')
+
+
+def group_links_by_year(links: list) -> dict:
+    """
+    Returns dict of year -> {'collisions': link, 'casualties': link}
+    """
+    years = {}
+    for link in links:
+        years.setdefault(get_link_year(link), {})[get_link_table(link)] = link
+
+    for year, year_links in years.items():
+        missing = set(TABLES) - set(year_links)
+        if len(missing) > 0:
+            raise ValueError(f'No {", ".join(missing)} link for {year}')
+
+    return dict(sorted(years.items()))
+
+
+def settings_hash(*settings) -> str:
+    """
+    Hash of anything, other than the source data, that changes the ingested output
+    """
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def read_manifest(store_dir: str) -> dict:
+    """
+    Manifest is keyed by year (as a string, since it's json)
+    """
+    path = os.path.join(store_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def write_manifest(manifest: dict, store_dir: str):
+    path = os.path.join(store_dir, MANIFEST_FILE)
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def get_partition_path(store_dir: str, table: str, year: int) -> str:
+    return os.path.join(store_dir, table, f'year={year}', 'part-0.parquet')
+
+
+def source_entry(year_links: dict, year_paths: dict, ingest_settings: str) -> dict:
+    """
+    Manifest entry for the sources of a year, row counts are added once ingested
+    """
+    entry = {'settings_hash': ingest_settings}
+    for table in TABLES:
+        entry[table] = {
+            'url': year_links[table],
+            'content_hash': hash_file(year_paths[table]),
+        }
+    return entry
+
+
+def needs_ingest(year: int, entry: dict, manifest: dict, store_dir: str) -> bool:
+    """
+    A year needs ingesting if its sources or settings have changed, or its partitions are missing
+    """
+    previous = manifest.get(str(year))
+    if previous is None:
+        return True
+
+    if previous.get('settings_hash') != entry['settings_hash']:
+        return True
+
+    for table in TABLES:
+        if not os.path.exists(get_partition_path(store_dir, table, year)):
+            return True
+        for key in ['url', 'content_hash']:
+            if previous[table].get(key) != entry[table][key]:
+                return True
+
+    return False
+
+
+def write_partition(df: pd.DataFrame, store_dir: str, table: str, year: int) -> int:
+    """
+    Replace a year's partition, returns the number of rows written
+    """
+    path = get_partition_path(store_dir, table, year)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_table(df, table, f'{path}.tmp')
+    os.replace(f'{path}.tmp', path)
+    return len(df)
+
+
+def remove_stale_partitions(store_dir: str, years: list) -> list:
+    """
+    Remove partitions for years no longer in params.yaml, returns the removed years
+    """
+    removed = set()
+    for table in TABLES:
+        table_dir = os.path.join(store_dir, table)
+        if not os.path.exists(table_dir):
+            continue
+        for partition in os.listdir(table_dir):
+            match = re.fullmatch(r'year=(\d{4})', partition)
+            if match and int(match.group(1)) not in years:
+                shutil.rmtree(os.path.join(table_dir, partition))
+                removed.add(int(match.group(1)))
+    return sorted(removed)
+
+
+def read_partitions(store_dir: str, table: str, years: list) -> pd.DataFrame:
+    """
+    Read and combine the partitions for a list of years.
+    Categories are unioned first, otherwise concat falls back to object columns.
+    """
+    if not years:
+        raise ValueError(f'No years to read {table} for, check there are TfL links in params.yaml')
+
+    dfs = [read_table(table, get_partition_path(store_dir, table, year)) for year in years]
+
+    for col in dfs[0].columns:
+        if all(isinstance(df[col].dtype, pd.CategoricalDtype) for df in dfs):
+            categories = union_categoricals([df[col] for df in dfs]).categories
+            for df in dfs:
+                df[col] = df[col].cat.set_categories(categories)
+
+    return pd.concat(dfs, ignore_index=True)
@@ -0,0 +1,95 @@
+"""
+Compact parent (cluster) -> child (junction) mapping of the junction hierarchy.
+
+The mapping is stored CSR style, as int64 arrays: the sorted cluster ids, the junction ids grouped by
+cluster and the offsets of each cluster's junctions, i.e. the junctions of cluster_ids[i] are
+junction_ids[offsets[i]:offsets[i + 1]]. Looking up a cluster's junctions is a binary search + a slice,
+and the arrays are saved next to the junctions table as .npz so the app can load them without pandas.
+"""
+import json
+import numpy as np
+
+from itertools import chain
+from dataclasses import dataclass
+
+
+def get_osmid_list(osmid) -> list:
+    """
+    Original osmids of a consolidated node as a list. OSMnx < 2 stores merged osmids as str() of the list,
+    which for ints is valid JSON.
+    """
+    if isinstance(osmid, str):
+        return json.loads(osmid)
+    if isinstance(osmid, (list, tuple, np.ndarray)):
+        return list(osmid)
+    return [osmid]
+
+
+@dataclass
+class ClusterIndex:
+    cluster_ids: np.ndarray
+    offsets: np.ndarray
+    junction_ids: np.ndarray
+
+    @classmethod
+    def from_mapping(cls, junction_ids: np.ndarray, cluster_ids: np.ndarray) -> 'ClusterIndex':
+        """
+        Build from the cluster of each junction, junctions keep their order within each cluster
+        """
+        junction_ids = np.asarray(junction_ids, dtype=np.int64)
+        cluster_ids = np.asarray(cluster_ids, dtype=np.int64)
+
+        order = np.argsort(cluster_ids, kind='stable')
+        unique_cluster_ids, counts = np.unique(cluster_ids[order], return_counts=True)
+        offsets = np.zeros(len(unique_cluster_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        return cls(cluster_ids=unique_cluster_ids, offsets=offsets, junction_ids=junction_ids[order])
+
+    @classmethod
+    def from_consolidated_graph(cls, G2) -> 'ClusterIndex':
+        """
+        Build from the graph returned by ox.consolidate_intersections, where each node's osmid_original is
+        the osmid of a single junction, or a list of the osmids of merged junctions.
+        """
+        cluster_ids, osmids = zip(*G2.nodes(data='osmid_original'))
+        osmids = [get_osmid_list(osmid) for osmid in osmids]
+
+        junction_ids = np.fromiter(chain.from_iterable(osmids), dtype=np.int64)
+        counts = np.fromiter((len(osmid) for osmid in osmids), dtype=np.int64, count=len(osmids))
+
+        return cls.from_mapping(junction_ids, np.repeat(np.array(cluster_ids, dtype=np.int64), counts))
+
+    def __len__(self) -> int:
+        return len(self.cluster_ids)
+
+    @property
+    def cluster_sizes(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def get_junctions(self, cluster_id: int) -> np.ndarray:
+        """
+        Junction ids in a cluster, empty if the cluster doesn't exist
+        """
+        i = np.searchsorted(self.cluster_ids, cluster_id)
+        if i == len(self.cluster_ids) or self.cluster_ids[i] != cluster_id:
+            return self.junction_ids[:0]
+        return self.junction_ids[self.offsets[i]:self.offsets[i + 1]]
+
+    def get_junction_clusters(self) -> tuple:
+        """
+        Flat (junction ids, cluster ids) arrays, one element per junction
+        """
+        return self.junction_ids, np.repeat(self.cluster_ids, self.cluster_sizes)
+
+    def save(self, path: str):
+        np.savez(path, cluster_ids=self.cluster_ids, offsets=self.offsets, junction_ids=self.junction_ids)
+
+    @classmethod
+    def load(cls, path: str) -> 'ClusterIndex':
+        with np.load(path) as arrays:
+            return cls(
+                cluster_ids=arrays['cluster_ids'],
+                offsets=arrays['offsets'],
+                junction_ids=arrays['junction_ids']
+            )
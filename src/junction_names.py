@@ -0,0 +1,114 @@
+"""
+Name junction clusters from the names of the roads that meet at them.
+
+Names are built with explode / dedupe / group operations over all edges at once. Cluster
+names come out in the order of list(set(names)), as the original row-wise version did, so the names
+(and their -N suffixes for clusters with the same name) are unchanged.
+"""
+import re
+import numpy as np
+import pandas as pd
+
+
+ABBREVIATIONS = {
+    'Avenue': 'Ave',
+    'Bridge': 'Brg',
+    'Gardens': 'Gdns',
+    'Place': 'Pl',
+    'Road': 'Rd',
+    'Street': 'St',
+    'Square': 'Sq',
+}
+ABBREVIATIONS_REGEX = re.compile('|'.join(ABBREVIATIONS))
+
+
+def get_edge_names(lower_level_graph) -> pd.DataFrame:
+    """
+    One row per edge start node (u) + road name, missing names are ''.
+    Edges with several names keep the list(set()) order of the row-wise version.
+    """
+    # read straight from the graph rather than graph_to_gdfs, which builds geometries for every edge
+    edge_names = pd.DataFrame(
+        [(u, data.get('name', np.nan)) for u, _, data in lower_level_graph.edges(data=True)],
+        columns=['u', 'name']
+    ).fillna('')
+
+    is_list = edge_names['name'].map(type) == list
+    edge_names.loc[is_list, 'name'] = pd.Series(
+        [list(set(names)) for names in edge_names.loc[is_list, 'name']],
+        index=edge_names.index[is_list],
+        dtype=object
+    )
+
+    return edge_names.explode('name')
+
+
+def set_ordered_names(cluster_names: pd.DataFrame) -> pd.DataFrame:
+    """
+    Unique names for each cluster in list(set()) order. Set order only depends on the first time
+    each name is seen, so each set is built from the deduplicated names.
+    """
+    cluster_names = cluster_names.drop_duplicates(['junction_cluster_id', 'name'])
+    cluster_ids = cluster_names['junction_cluster_id'].to_numpy()
+    names = cluster_names['name'].to_numpy(dtype=object)
+
+    order = np.argsort(cluster_ids, kind='stable')
+    cluster_ids, names = cluster_ids[order], names[order]
+    starts = np.flatnonzero(np.r_[True, cluster_ids[1:] != cluster_ids[:-1]])
+    ends = np.r_[starts[1:], len(cluster_ids)]
+
+    return pd.DataFrame({
+        'junction_cluster_id': cluster_ids[starts],
+        'name': [list(set(names[start:end])) for start, end in zip(starts, ends)],
+    })
+
+
+def shorten_road_names(names: pd.Series) -> pd.Series:
+    '''
+    Shortern elements of road names to save space
+    '''
+    return names.str.replace(ABBREVIATIONS_REGEX, lambda match: ABBREVIATIONS[match.group(0)], regex=True)
+
+
+def name_junctions(lower_level_graph, nodes_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Create names for junctions using the edge names from graph
+    """
+    edge_names = get_edge_names(lower_level_graph)
+
+    # every name at every junction in each cluster, in junction + edge order
+    cluster_names = nodes_df[['junction_id', 'junction_cluster_id']].merge(
+        edge_names,
+        how='left',
+        left_on='junction_id',
+        right_on='u'
+    )
+    clusters = set_ordered_names(cluster_names)
+
+    # join the valid names for each cluster
+    clusters['junction_cluster_name'] = [
+        '-'.join([name for name in names if (name != '') & (name == name)]) or 'Unknown'
+        for names in clusters['name']
+    ]
+    clusters['junction_cluster_name'] = shorten_road_names(clusters['junction_cluster_name'])
+
+    # number clusters with the same name in cluster id order, e.g. High St-1, High St-2
+    clusters = clusters.sort_values('junction_cluster_id')
+    name_rank = clusters.groupby('junction_cluster_name').cumcount() + 1
+    name_count = clusters.groupby('junction_cluster_name')['junction_cluster_id'].transform('size')
+    clusters['junction_cluster_name'] = np.where(
+        name_count == 1,
+        clusters['junction_cluster_name'],
+        clusters['junction_cluster_name'] + '-' + name_rank.astype(str)
+    )
+
+    nodes_df = nodes_df.merge(
+        clusters[['junction_cluster_id', 'junction_cluster_name']],
+        how='left',
+        on='junction_cluster_id'
+    )
+
+    # finally, drop dups
+    nodes_df = nodes_df.drop_duplicates()
+
+    return nodes_df
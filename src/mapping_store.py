@@ -0,0 +1,161 @@
+"""
+Year-partitioned store of collision -> junction mappings, so stage 04 only maps what's changed.
+
+Each collision's mapping is stored with a hash of the columns it was mapped from (location + easting /
+northing), in partitions by year, e.g. data/mappings/tolerance=15/year=2024/. A run only queries the
+collisions that are new or whose hash has changed, e.g. after a data correction. The manifest records
+the hash of the junctions table + the snapping settings the mappings were made with, if either changes
+every collision is mapped again.
+
+The spatial index (the KD-tree of junctions, or the road segments) is saved next to the junctions
+table, keyed by the same hash, so it is only rebuilt when the junctions are.
+"""
+import os
+import re
+import json
+import pickle
+import shutil
+import numpy as np
+import pandas as pd
+
+from schema import SCHEMAS, get_arrow_schema, read_table, write_table
+
+
+MANIFEST_FILE = 'mapping-manifest.json'
+
+# the columns a mapping depends on, a change to any re-maps the collision
+MAPPING_INPUT_COLUMNS = ['easting', 'northing', 'location']
+
+
+def hash_mapping_inputs(collisions: pd.DataFrame) -> np.ndarray:
+    return pd.util.hash_pandas_object(collisions[MAPPING_INPUT_COLUMNS], index=False).to_numpy()
+
+
+def get_partition_path(store_dir: str, year: int) -> str:
+    return os.path.join(store_dir, f'year={year}', 'part-0.parquet')
+
+
+def read_manifest(store_dir: str) -> dict:
+    path = os.path.join(store_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def write_manifest(manifest: dict, store_dir: str):
+    path = os.path.join(store_dir, MANIFEST_FILE)
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def get_partition_years(store_dir: str) -> list:
+    if not os.path.exists(store_dir):
+        return []
+    matches = [re.fullmatch(r'year=(\d{4})', partition) for partition in os.listdir(store_dir)]
+    return sorted(int(match.group(1)) for match in matches if match)
+
+
+def read_mappings(store_dir: str, manifest: dict) -> pd.DataFrame:
+    """
+    All stored mappings, None if there are none or they were made with a different junctions table or settings
+    """
+    previous = read_manifest(store_dir)
+    years = get_partition_years(store_dir)
+    if (previous != manifest) or (len(years) == 0):
+        if len(previous) > 0:
+            print('Junctions or snapping settings have changed, mapping all collisions')
+        return None
+
+    return pd.concat(
+        [read_table('collision_mappings', get_partition_path(store_dir, year)) for year in years],
+        ignore_index=True
+    )
+
+
+def empty_mappings() -> pd.DataFrame:
+    """
+    Mappings table with no rows, for when nothing is stored + there's nothing to map
+    """
+    columns = [name for name, _ in SCHEMAS['collision_mappings']]
+    return get_arrow_schema('collision_mappings', columns).empty_table().to_pandas()
+
+
+def get_collisions_to_map(collisions: pd.DataFrame, mappings: pd.DataFrame) -> np.ndarray:
+    """
+    Mask of collisions that are new, or have changed since they were mapped
+    """
+    if mappings is None:
+        return np.ones(len(collisions), dtype=bool)
+
+    mapped = pd.MultiIndex.from_arrays([
+        mappings['collision_index'].to_numpy(dtype=np.int64),
+        mappings['input_hash'].to_numpy(dtype=np.uint64)
+    ])
+    current = pd.MultiIndex.from_arrays([
+        collisions['collision_index'].to_numpy(dtype=np.int64),
+        collisions['input_hash'].to_numpy(dtype=np.uint64)
+    ])
+    return ~current.isin(mapped)
+
+
+def update_mappings(
+    store_dir: str,
+    manifest: dict,
+    mappings: pd.DataFrame,
+    new_mappings: pd.DataFrame,
+    collision_indexes: np.ndarray
+) -> pd.DataFrame:
+    """
+    Merge new mappings into the store, dropping those of collisions that no longer exist.
+    Only partitions with changes are rewritten. Returns all current mappings.
+    """
+    if mappings is None:
+        # start from scratch, any mappings from before are no longer valid
+        shutil.rmtree(store_dir, ignore_errors=True)
+        updated = new_mappings
+        changed_years = set(updated['year'])
+    else:
+        is_kept = (
+            mappings['collision_index'].isin(collision_indexes) &
+            ~mappings['collision_index'].isin(new_mappings['collision_index'])
+        )
+        changed_years = set(new_mappings['year']) | set(mappings.loc[~is_kept, 'year'])
+        updated = pd.concat([mappings[is_kept], new_mappings], ignore_index=True)
+
+    os.makedirs(store_dir, exist_ok=True)
+    for year in sorted(changed_years):
+        path = get_partition_path(store_dir, year)
+        year_mappings = updated[updated['year'] == year]
+        if len(year_mappings) == 0:
+            shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_table(year_mappings.sort_values('collision_index'), 'collision_mappings', f'{path}.tmp')
+        os.replace(f'{path}.tmp', path)
+
+    write_manifest(manifest, store_dir)
+    print(f'Updated mapping partitions for years: {sorted(changed_years)}')
+
+    return updated
+
+
+def load_spatial_index(path: str, junctions_hash: str):
+    """
+    Saved spatial index, None if there isn't one for this junctions table
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        saved = pickle.load(f)
+    if saved.get('junctions_hash') != junctions_hash:
+        return None
+    print(f'Loaded spatial index: {path}')
+    return saved['index']
+
+
+def save_spatial_index(index, path: str, junctions_hash: str):
+    with open(f'{path}.tmp', 'wb') as f:
+        pickle.dump({'junctions_hash': junctions_hash, 'index': index}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f'{path}.tmp', path)
+    print(f'Saved spatial index: {path}')
@@ -0,0 +1,119 @@
+"""
+Column-wise normalisation of the TfL collision records.
+
+These replace per-row Python calls with integer operations and pandas string / categorical
+operations run over the unique values of each column.
+"""
+import numpy as np
+import pandas as pd
+
+
+def map_unique(values: pd.Series, func) -> pd.Series:
+    """
+    Apply a column-wise function to the unique values only, then broadcast back.
+    Text columns like times and boroughs repeat a lot so this avoids most of the work.
+    """
+    codes, uniques = pd.factorize(values)
+    mapped = func(pd.Series(uniques, dtype=values.dtype)).to_numpy(dtype=object)
+    mapped = np.append(mapped, np.nan)  # missing values have code -1
+    return pd.Series(mapped[codes], index=values.index, name=values.name)
+
+
+def upper_case(values: pd.Series) -> pd.Series:
+    """
+    Upper case a text column
+    """
+    return map_unique(values, lambda x: x.str.upper())
+
+
+def count_digits(values: np.ndarray) -> np.ndarray:
+    """
+    Number of decimal digits in non-negative integers, i.e. len(str(x))
+    """
+    powers = 10 ** np.arange(1, 19, dtype='int64')
+    return np.searchsorted(powers, values, side='right') + 1
+
+
+def clean_collision_ids(raw_collision_ids: pd.Series, years: pd.Series) -> pd.Series:
+    """
+    Make TfL collision ids match the stats19 ones.
+    The id is str(year) + first 2 digits + last 7 digits of the raw id, built here
+    with integer arithmetic on the digit counts rather than string concatenation.
+    """
+    raw = raw_collision_ids.to_numpy(dtype='int64')
+    year = years.to_numpy(dtype='int64')
+
+    n_digits = count_digits(raw)
+    prefix_digits = np.minimum(n_digits, 2)
+    suffix_digits = np.minimum(n_digits, 7)
+
+    prefix = raw // 10 ** (n_digits - prefix_digits)
+    suffix = raw % 10 ** suffix_digits
+
+    # before 2017 the prefix is kept, after it's '01' apart from the city of london ('48')
+    keep_prefix = (year < 2017) | (prefix == 48)
+    prefix = np.where(keep_prefix, prefix, 1)
+    prefix_digits = np.where(keep_prefix, prefix_digits, 2)
+
+    collision_ids = (
+        year * 10 ** (prefix_digits + suffix_digits)
+        + prefix * 10 ** suffix_digits
+        + suffix
+    )
+    return pd.Series(collision_ids, index=raw_collision_ids.index, dtype='int64')
+
+
+def format_unique_times(times: pd.Series) -> pd.Series:
+    """
+    Times in format '0731 as 07:31, with seconds added to any without
+    """
+    is_quoted = times.str[0] == "'"
+    times = times.where(~is_quoted, times.str[1:3] + ':' + times.str[3:])
+
+    # for when time in format '00:00' rather than '00:00:00'
+    is_short = times.str.count(':') == 1
+    times = times.where(~is_short, times + ':00')
+
+    return times
+
+
+def format_times(times: pd.Series) -> pd.Series:
+    """
+    Format times in format '0731 (rather than 07:31) + add seconds
+    """
+    return map_unique(times, format_unique_times)
+
+
+def to_aliased_categorical(values: pd.Series, aliases: dict) -> pd.Series:
+    """
+    Convert a column to categorical and map aliases to their consistent names.
+    Aliases are applied to the categories, then the codes are remapped, so each value is only looked up once.
+    """
+    values = values.astype('category')
+    categories = values.cat.categories
+
+    mapped = pd.Index([aliases.get(category, category) for category in categories])
+    consistent_names = mapped.unique()
+
+    code_map = np.append(consistent_names.get_indexer(mapped), -1)  # missing values have code -1
+    codes = code_map[values.cat.codes.to_numpy()]
+
+    return pd.Series(
+        pd.Categorical.from_codes(codes, categories=consistent_names),
+        index=values.index,
+        name=values.name
+    )
+
+
+def apply_value_aliases(df: pd.DataFrame, value_aliases: dict, categorical_columns: list) -> pd.DataFrame:
+    """
+    Map values to consistent names, only in the columns each alias is for.
+    Columns in categorical_columns are returned as categoricals, other aliased columns as text.
+    """
+    for col in df.columns:
+        if col in categorical_columns:
+            df[col] = to_aliased_categorical(df[col], value_aliases.get(col, {}))
+        elif col in value_aliases:
+            df[col] = to_aliased_categorical(df[col], value_aliases[col]).astype(object)
+
+    return df
@@ -0,0 +1,315 @@
+"""
+Runs the data processing stages, skipping any whose outputs are still valid.
+
+Each stage is keyed by a hash of its code (the script + any src/ modules it imports), its input
+files and the params.yaml keys it uses. If the key matches the last successful run and the outputs
+are unchanged the stage is skipped. Stages run in parallel once the stages they depend on are done,
+e.g. building the junctions graph runs alongside downloading + filtering the collision data.
+
+Usage: python src/pipeline.py [--force STAGE ...] [--offline] [--dry-run]
+"""
+import os
+import re
+import ast
+import sys
+import json
+import time
+import yaml
+import hashlib
+import argparse
+import subprocess
+
+from yaml import Loader
+from dataclasses import dataclass, field
+from hashing import hash_file
+from severity import get_casualty_type
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_PATH = 'data/.pipeline-state.json'
+LOG_DIR = 'data/logs'
+
+
+# stage inputs + outputs are formatted with params.yaml, e.g. {tolerance} or {road_graph[cache_dir]}, paths
+# of optional params that are null are left out, and {casualty_type} paths are repeated for each casualty type
+@dataclass
+class Stage:
+    name: str
+    script: str
+    inputs: list = field(default_factory=list)
+    outputs: list = field(default_factory=list)
+    depends_on: list = field(default_factory=list)
+    remote: bool = False  # reads remote data, so always runs unless offline
+
+
+STAGES = [
+    Stage(
+        name='01-download-tfl-data',
+        script='src/01-download-tfl-data.py',
+        inputs=['data/tfl-aliases.csv', 'data_corrections.yaml'],
+        outputs=['data/collisions.parquet', 'data/casualties.parquet'],
+        remote=True,
+    ),
+    Stage(
+        name='02-filter-data',
+        script='src/02-filter-data.py',
+        inputs=['data/collisions.parquet', 'data/casualties.parquet'],
+        outputs=['data/pedestrian-and-cyclist-collisions.parquet'],
+        depends_on=['01-download-tfl-data'],
+    ),
+    Stage(
+        name='03-build-junctions-graph',
+        script='src/03-build-junctions-graph.py',
+        inputs=['{road_graph[osm_file]}', '{road_graph[cache_dir]}'],
+        outputs=['data/junctions-tolerance={tolerance}.parquet', 'data/junction-hierarchy-tolerance={tolerance}.npz'],
+    ),
+    Stage(
+        name='04-map-collisions-to-graph',
+        script='src/04-map-collisions-to-graph.py',
+        inputs=['data/pedestrian-and-cyclist-collisions.parquet', 'data/junctions-tolerance={tolerance}.parquet'],
+        outputs=['data/collisions-tolerance={tolerance}.parquet'],
+        depends_on=['02-filter-data', '03-build-junctions-graph'],
+    ),
+    Stage(
+        name='05-build-serving-tables',
+        script='src/05-build-serving-tables.py',
+        inputs=['data/collisions-tolerance={tolerance}.parquet', 'data/junctions-tolerance={tolerance}.parquet'],
+        outputs=[
+            'data/app-data-tolerance={tolerance}/_manifest.json',
+            'data/app-data-tolerance={tolerance}/danger_cube/{casualty_type}.npz',
+        ],
+        depends_on=['04-map-collisions-to-graph'],
+    ),
+]
+
+
+def hash_path(path: str) -> str:
+    """
+    Hash of a file, or of every file in a directory (e.g. the graph cache), None if it doesn't exist
+    """
+    if os.path.isfile(path):
+        return hash_file(path)
+    if not os.path.isdir(path):
+        return None
+
+    sha = hashlib.sha256()
+    for root, _, files in sorted(os.walk(path)):
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            sha.update(f'{os.path.relpath(file_path, path)}:{hash_file(file_path)}'.encode('utf-8'))
+    return sha.hexdigest()
+
+
+def get_code_files(script: str) -> list:
+    """
+    The script plus any src/ modules it imports, recursively
+    """
+    code_files = []
+    to_check = [script]
+    while len(to_check) > 0:
+        path = to_check.pop()
+        if path in code_files:
+            continue
+        code_files.append(path)
+
+        with open(path, 'r') as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                modules = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module:
+                modules = [node.module]
+            else:
+                continue
+            for module in modules:
+                module_path = os.path.join(SRC_DIR, f'{module.split(".")[0]}.py')
+                if os.path.exists(module_path):
+                    to_check.append(os.path.relpath(module_path))
+
+    return sorted(code_files)
+
+
+def get_param_keys(code_files: list) -> list:
+    """
+    params.yaml keys used in a stage's code, i.e. params['key'] or params.get('key')
+    """
+    keys = set()
+    for path in code_files:
+        with open(path, 'r') as f:
+            code = f.read()
+        keys.update(re.findall(r'params(?:\[|\.get\()[\'"](\w+)[\'"]', code))
+    return sorted(keys)
+
+
+def get_casualty_types(params: dict) -> list:
+    return [get_casualty_type(mode, params.get('casualty_type_names')) for mode in params['valid_casualty_types']]
+
+
+def format_paths(paths: list, params: dict) -> list:
+    formatted = []
+    for path in paths:
+        casualty_types = get_casualty_types(params) if '{casualty_type}' in path else [None]
+        formatted += [path.format(**params, casualty_type=casualty_type) for casualty_type in casualty_types]
+    return [path for path in formatted if path != 'None']
+
+
+def get_missing_paths(stage: Stage, params: dict) -> list:
+    return [path for path in format_paths(stage.inputs + stage.outputs, params) if not os.path.exists(path)]
+
+
+def get_stage_key(stage: Stage, params: dict) -> str:
+    """
+    Hash of everything that determines a stage's outputs
+    """
+    code_files = get_code_files(stage.script)
+    param_keys = get_param_keys(code_files)
+
+    key = {
+        'code': {path: hash_file(path) for path in code_files},
+        'inputs': {path: hash_path(path) for path in format_paths(stage.inputs, params)},
+        'params': {key: params.get(key) for key in param_keys},
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def read_state(path: str = STATE_PATH) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def write_state(state: dict, path: str = STATE_PATH):
+    with open(path, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+
+
+def is_up_to_date(stage: Stage, key: str, state: dict, params: dict) -> bool:
+    """
+    A stage is up to date if its key matches the last run and its outputs haven't changed since
+    """
+    previous = state.get(stage.name)
+    if previous is None or previous['key'] != key:
+        return False
+
+    for path in format_paths(stage.outputs, params):
+        if not os.path.exists(path) or previous['outputs'].get(path) != hash_file(path):
+            return False
+
+    return True
+
+
+def is_forced(stage: Stage, force: list, offline: bool) -> bool:
+    """
+    Forced stages run even if up to date, as do remote stages unless offline
+    """
+    return ('all' in force) or (stage.name in force) or (stage.remote and not offline)
+
+
+def run_stage(stage: Stage, extra_args: list) -> tuple:
+    """
+    Run a stage script, logging its output to data/logs/. Returns whether it succeeded + the log path.
+    """
+    os.makedirs(LOG_DIR, exist_ok=True)
+    log_path = os.path.join(LOG_DIR, f'{stage.name}.log')
+    with open(log_path, 'w') as log:
+        result = subprocess.run(
+            [sys.executable, stage.script] + extra_args,
+            stdout=log,
+            stderr=subprocess.STDOUT
+        )
+    return result.returncode == 0, log_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the data processing stages, skipping any that are up to date')
+    parser.add_argument('--force', nargs='+', default=[], help='stages to run even if up to date, or "all"')
+    parser.add_argument('--offline', action='store_true', help='only use cached TfL data')
+    parser.add_argument('--dry-run', action='store_true', help='show which stages would run')
+    parser.add_argument('--max-parallel', type=int, default=2, help='max stages to run at once')
+    args = parser.parse_args()
+
+    params = yaml.load(open("params.yaml", 'r'), Loader=Loader)
+    state = read_state()
+
+    stages = {stage.name: stage for stage in STAGES}
+    unknown = set(args.force) - set(stages) - {'all'}
+    if len(unknown) > 0:
+        parser.error(f'Unknown stages: {sorted(unknown)}, options are: {list(stages)}')
+
+    pending = list(stages)
+    running = {}
+    results = {}
+
+    def start_stage(stage: Stage, executor: ThreadPoolExecutor):
+        if args.dry_run:
+            # inputs may not exist yet, e.g. on a fresh checkout, so don't hash them
+            missing = get_missing_paths(stage, params)
+            upstream = [name for name in stage.depends_on if results[name][0] == 'would run']
+            if len(missing) > 0 or len(upstream) > 0:
+                results[stage.name] = ('would run', 0)
+                reason = f'missing {missing}' if len(missing) > 0 else f'after {upstream}'
+                print(f'{stage.name}: would run, {reason}')
+                return
+
+        key = get_stage_key(stage, params)
+        if not is_forced(stage, args.force, args.offline) and is_up_to_date(stage, key, state, params):
+            results[stage.name] = ('skipped', 0)
+            print(f'{stage.name}: up to date, skipping')
+            return
+
+        if args.dry_run:
+            results[stage.name] = ('would run', 0)
+            print(f'{stage.name}: would run')
+            return
+
+        print(f'{stage.name}: running')
+        extra_args = ['--offline'] if (stage.remote and args.offline) else []
+        running[executor.submit(run_stage, stage, extra_args)] = (stage, time.perf_counter())
+
+    with ThreadPoolExecutor(max_workers=args.max_parallel) as executor:
+        while len(pending) > 0 or len(running) > 0:
+            # start any stages whose dependencies have finished
+            for name in list(pending):
+                dependency_results = [results.get(dependency, (None,))[0] for dependency in stages[name].depends_on]
+                if any(result in ['failed', 'not run'] for result in dependency_results):
+                    pending.remove(name)
+                    results[name] = ('not run', 0)
+                    print(f'{name}: not run, a stage it depends on failed')
+                elif all(result is not None for result in dependency_results):
+                    pending.remove(name)
+                    start_stage(stages[name], executor)
+
+            if len(running) == 0:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, start_time = running.pop(future)
+                success, log_path = future.result()
+                duration = time.perf_counter() - start_time
+
+                if success:
+                    state[stage.name] = {
+                        'key': get_stage_key(stage, params),  # after running, stage 03 writes its graph cache input
+                        'outputs': {path: hash_file(path) for path in format_paths(stage.outputs, params)},
+                    }
+                    write_state(state)
+                    results[stage.name] = ('ran', duration)
+                    print(f'{stage.name}: done in {duration:.1f}s, log: {log_path}')
+                else:
+                    results[stage.name] = ('failed', duration)
+                    print(f'{stage.name}: FAILED after {duration:.1f}s, see log: {log_path}')
+
+    print('\nStage timings:')
+    for name in stages:
+        status, duration = results[name]
+        print(f'  {name:<30} {status:<10} {duration:>8.1f}s')
+
+    if any(status in ['failed', 'not run'] for status, _ in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
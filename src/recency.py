@@ -0,0 +1,90 @@
+"""
+Recency weighting schemes, set in params.yaml under recency_weighting.
+
+Weights are calculated once per period (year, or month for the monthly scheme) as a lookup table,
+then broadcast to collisions in a single step. New schemes can be added to SCHEMES.
+"""
+import numpy as np
+import pandas as pd
+
+
+def log_weights(periods: np.ndarray, min_period: int, max_period: int, offset: float = 6) -> np.ndarray:
+    '''
+    Original log curve, log10(year - min_year + offset)
+    '''
+    return np.log10(periods - min_period + offset)
+
+
+def exponential_weights(periods: np.ndarray, min_period: int, max_period: int, half_life: float = 3) -> np.ndarray:
+    '''
+    Weight halves every half_life periods back from the latest period
+    '''
+    return 0.5 ** ((max_period - periods) / half_life)
+
+
+def linear_weights(periods: np.ndarray, min_period: int, max_period: int, min_weight: float = .5) -> np.ndarray:
+    '''
+    Linear from min_weight for the earliest period up to 1 for the latest
+    '''
+    if max_period == min_period:
+        return np.ones(len(periods))
+    return min_weight + (1 - min_weight) * (periods - min_period) / (max_period - min_period)
+
+
+SCHEMES = {
+    'log': (log_weights, 'year'),
+    'exponential': (exponential_weights, 'year'),
+    'linear': (linear_weights, 'year'),
+    'monthly': (exponential_weights, 'month'),
+}
+
+
+def get_periods(collisions: pd.DataFrame, period: str) -> pd.Series:
+    '''
+    Integer period of each collision, months are counted as year * 12 + month
+    '''
+    if period == 'year':
+        return collisions['year'].astype(int)
+
+    dates = pd.to_datetime(collisions['date'])
+    return dates.dt.year * 12 + dates.dt.month - 1
+
+
+def get_scheme(config: dict) -> tuple:
+    '''
+    Weight function + period for the scheme in the config
+    '''
+    scheme = config['scheme']
+    if scheme not in SCHEMES:
+        raise ValueError(f'Unknown recency weighting scheme: {scheme}, options are: {list(SCHEMES)}')
+    return SCHEMES[scheme]
+
+
+def get_recency_weight_table(periods: pd.Series, config: dict) -> pd.Series:
+    '''
+    Lookup table of recency weight for each unique period
+    '''
+    scheme = config['scheme']
+    weight_function, _ = get_scheme(config)
+    unique_periods = np.sort(periods.unique())
+
+    weights = weight_function(
+        unique_periods,
+        unique_periods.min(),
+        unique_periods.max(),
+        **(config.get(scheme) or {})
+    )
+    return pd.Series(weights, index=unique_periods, name='recency_weight')
+
+
+def get_recency_weights(collisions: pd.DataFrame, config: dict) -> pd.Series:
+    '''
+    Recency weight for each collision, looked up from the per period table
+    '''
+    _, period = get_scheme(config)
+    periods = get_periods(collisions, period)
+
+    weight_table = get_recency_weight_table(periods, config)
+    positions = weight_table.index.get_indexer(periods)
+
+    return pd.Series(weight_table.to_numpy()[positions], index=collisions.index, name='recency_weight')
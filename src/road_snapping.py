@@ -0,0 +1,221 @@
+"""
+Snap collisions to the road they happened on, rather than straight to the nearest junction.
+
+Every collision is projected onto its nearest road segment (graph edge) using an STRtree over the
+edge geometries, in British National Grid metres. It is then assigned to one of that segment's end
+nodes: whichever end of the road the collision's location text says it was at, e.g. the junction of
+OLD STREET J/W CITY ROAD is the end also on City Road, otherwise the end nearest along the segment.
+Segments equally near a collision (e.g. both directions of a two-way road) are split using the
+location text too, preferring segments of the road named in it.
+Names are matched as whole words, after abbreviating road types on both sides, so OLD STREET matches
+OLD ST J/W CITY RD, but the A1 doesn't match the A10.
+"""
+import numpy as np
+import pandas as pd
+import shapely
+
+from convertbng.util import convert_bng
+from junction_names import ABBREVIATIONS
+
+
+# road types as TfL location text abbreviates them, e.g. OLD ST J/W CITY RD
+ROAD_ABBREVIATIONS = {name.upper(): abbreviation.upper() for name, abbreviation in ABBREVIATIONS.items()}
+ROAD_ABBREVIATIONS_REGEX = r'\b(?:' + '|'.join(ROAD_ABBREVIATIONS) + r')\b'
+
+
+def to_bng(geometries: np.ndarray) -> np.ndarray:
+    """
+    Convert geometries in longitude / latitude to British National Grid easting / northing
+    """
+    coordinates = shapely.get_coordinates(geometries)
+    eastings, northings = convert_bng(coordinates[:, 0], coordinates[:, 1])
+    return shapely.set_coordinates(geometries.copy(), np.column_stack([eastings, northings]))
+
+
+def get_road_names(data: dict) -> list:
+    """
+    Upper case road names + refs (e.g. A501) of an edge, to match against TfL location text
+    """
+    names = []
+    for key in ['name', 'ref']:
+        values = data.get(key)
+        if isinstance(values, str):
+            values = [values]
+        if isinstance(values, list):
+            names += [value.upper() for value in values if isinstance(value, str)]
+    return names
+
+
+def get_edges(G) -> pd.DataFrame:
+    """
+    Edges of an (unprojected) graph with their geometries in BNG. Edges without a geometry are straight lines.
+    """
+    u, v, geometries, names = [], [], [], []
+    for edge_u, edge_v, data in G.edges(data=True):
+        u.append(edge_u)
+        v.append(edge_v)
+        geometries.append(data.get('geometry'))
+        names.append(get_road_names(data))
+
+    u, v = np.array(u, dtype=np.int64), np.array(v, dtype=np.int64)
+    geometries = np.array(geometries, dtype=object)
+
+    missing = pd.isnull(geometries)
+    node_coordinates = {node: (data['x'], data['y']) for node, data in G.nodes(data=True)}
+    lines = np.array([[node_coordinates[a], node_coordinates[b]] for a, b in zip(u[missing], v[missing])])
+    if len(lines) > 0:
+        geometries[missing] = shapely.linestrings(lines)
+
+    return pd.DataFrame({'u': u, 'v': v, 'geometry': to_bng(geometries), 'names': names})
+
+
+def normalise_road_text(text: pd.Series) -> np.ndarray:
+    """
+    Upper case with road types abbreviated (e.g. STREET -> ST, as TfL location text often is) and padded
+    with spaces, so a name is in a location as whole words if its normalised text is in the location's
+    """
+    text = (
+        text
+        .fillna('')
+        .astype(str)
+        .str.upper()
+        .str.replace(r'[^A-Z0-9]+', ' ', regex=True)
+        .str.replace(ROAD_ABBREVIATIONS_REGEX, lambda match: ROAD_ABBREVIATIONS[match.group(0)], regex=True)
+        .str.strip()
+    )
+    return (' ' + text + ' ').to_numpy(dtype=str)
+
+
+def get_edge_names(edges: pd.DataFrame) -> pd.DataFrame:
+    """
+    One row per edge position + normalised road name
+    """
+    names = edges['names'].reset_index(drop=True).explode().dropna()
+    edge_names = pd.DataFrame({'edge': names.index.to_numpy(), 'name': normalise_road_text(names)})
+    return edge_names[edge_names['name'] != '  '].drop_duplicates().reset_index(drop=True)
+
+
+def mentions(locations: np.ndarray, names: np.ndarray) -> np.ndarray:
+    """
+    Whether each normalised location mentions the normalised name alongside it
+    """
+    if len(names) == 0:
+        return np.zeros(0, dtype=bool)
+    return np.char.find(locations, names) >= 0
+
+
+def get_names_road(
+    locations: np.ndarray,
+    point_positions: np.ndarray,
+    edge_positions: np.ndarray,
+    edge_names: pd.DataFrame
+) -> np.ndarray:
+    """
+    Whether each (point, edge) candidate's location names the edge's road
+    """
+    pairs = (
+        pd.DataFrame({'candidate': np.arange(len(edge_positions)), 'edge': edge_positions})
+        .merge(edge_names, on='edge')
+    )
+    candidates = pairs['candidate'].to_numpy()
+    is_named = mentions(locations[point_positions[candidates]], pairs['name'].to_numpy())
+
+    names_road = np.zeros(len(edge_positions), dtype=bool)
+    names_road[candidates[is_named]] = True
+    return names_road
+
+
+def choose_end_nodes(
+    locations: np.ndarray,
+    edge_positions: np.ndarray,
+    positions_on_road: np.ndarray,
+    edges: pd.DataFrame,
+    edge_names: pd.DataFrame
+) -> np.ndarray:
+    """
+    For each point on a segment, the end of the segment at another road named in its location text,
+    otherwise the nearest end
+    """
+    u, v = edges['u'].to_numpy()[edge_positions], edges['v'].to_numpy()[edge_positions]
+    n_points = len(edge_positions)
+
+    edge_u, edge_v = edges['u'].to_numpy(), edges['v'].to_numpy()
+    node_names = pd.concat([
+        pd.DataFrame({'node': edge_u[edge_names['edge']], 'name': edge_names['name']}),
+        pd.DataFrame({'node': edge_v[edge_names['edge']], 'name': edge_names['name']}),
+    ]).drop_duplicates()
+
+    # the names at each end of each point's segment, other than the segment's own road
+    ends = pd.DataFrame({
+        'point': np.tile(np.arange(n_points), 2),
+        'is_v': np.repeat([False, True], n_points),
+        'node': np.concatenate([u, v]),
+        'edge': np.tile(edge_positions, 2),
+    })
+    end_names = (
+        ends
+        .merge(node_names, on='node')
+        .merge(edge_names.assign(is_own_road=True), how='left', on=['edge', 'name'])
+    )
+    end_names = end_names[end_names['is_own_road'].isna()]
+
+    points = end_names['point'].to_numpy()
+    is_named = mentions(locations[points], end_names['name'].to_numpy())
+
+    end_named = np.zeros((2, n_points), dtype=bool)
+    end_named[end_names['is_v'].to_numpy()[is_named].astype(int), points[is_named]] = True
+    u_named, v_named = end_named
+
+    nearest = np.where(positions_on_road <= .5, u, v)
+    return np.where(u_named != v_named, np.where(u_named, u, v), nearest)
+
+
+def snap_to_roads(
+    coordinates: np.ndarray,
+    locations: pd.Series,
+    edges: pd.DataFrame,
+    max_distance: float
+) -> pd.DataFrame:
+    """
+    Snap BNG coordinates to the nearest road segment within max_distance metres.
+    Returns the position of each snapped coordinate, the junction (node) it is assigned to and its distance
+    to the road. Coordinates with no road within max_distance are left out.
+    """
+    points = shapely.points(coordinates)
+    geometries = edges['geometry'].to_numpy()
+    tree = shapely.STRtree(geometries)
+
+    # all segments tied for nearest are returned
+    (point_positions, edge_positions), distances = tree.query_nearest(
+        points, max_distance=max_distance, return_distance=True, all_matches=True
+    )
+
+    locations = normalise_road_text(locations)
+    edge_names = get_edge_names(edges)
+    candidates = pd.DataFrame({
+        'position': point_positions,
+        'edge': edge_positions,
+        'distance_to_road': distances,
+    })
+
+    # split ties by the road named in the location text
+    candidates['names_road'] = get_names_road(locations, point_positions, edge_positions, edge_names)
+    snapped = (
+        candidates
+        .sort_values(['position', 'names_road', 'edge'], ascending=[True, False, True])
+        .drop_duplicates('position')
+        .reset_index(drop=True)
+    )
+
+    # position along the segment, 0 at u and 1 at v
+    snapped_edges = snapped['edge'].to_numpy()
+    snapped_positions = snapped['position'].to_numpy()
+    positions_on_road = shapely.line_locate_point(
+        geometries[snapped_edges], points[snapped_positions], normalized=True
+    )
+
+    snapped['junction_id'] = choose_end_nodes(
+        locations[snapped_positions], snapped_edges, positions_on_road, edges, edge_names
+    )
+
+    return snapped[['position', 'junction_id', 'distance_to_road']]
@@ -0,0 +1,216 @@
+"""
+Explicit, versioned schemas for the parquet files passed between pipeline stages.
+
+Each table is written with its schema + SCHEMA_VERSION in the file metadata, and checked again
+when read by the next stage, so schema drift fails at the stage boundary rather than downstream.
+Column names can be regexes so that per-casualty-type columns (e.g. fatal_cyclist_casualties)
+don't all need listing.
+"""
+import re
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pandas as pd
+
+
+# bump when any schema below changes
+SCHEMA_VERSION = 1
+METADATA_KEY = b'lcc_schema'
+
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+
+COLLISION_FIELDS = [
+    ('raw_collision_id', pa.int64()),
+    ('collision_id', pa.int64()),
+    ('borough', CATEGORY),
+    ('easting', pa.float64()),
+    ('northing', pa.float64()),
+    ('longitude', pa.float64()),
+    ('latitude', pa.float64()),
+    ('location', pa.string()),
+    ('collision_severity', CATEGORY),
+    ('junction_detail', CATEGORY),
+    ('road_type', CATEGORY),
+    ('date', pa.date32()),
+    ('time', pa.time64('us')),
+    ('year', pa.int16()),
+]
+
+SEVERITY_FIELDS = [
+    (r'(fatal|serious|slight)_\w+_casualties', pa.int8()),
+    (r'max_\w+_severity', CATEGORY),
+    (r'is_\w+_collision', pa.bool_()),
+    ('recency_weight', pa.float64()),
+]
+
+SCHEMAS = {
+    'collisions': COLLISION_FIELDS,
+    'casualties': [
+        ('raw_collision_id', pa.int64()),
+        ('collision_id', pa.int64()),
+        ('casualty_id', pa.int64()),
+        ('casualty_class', pa.string()),
+        ('casualty_gender', pa.string()),
+        ('number_of_casualties', pa.int8()),
+        ('casualty_severity', CATEGORY),
+        ('mode_of_travel', CATEGORY),
+    ],
+    'filtered_collisions': COLLISION_FIELDS + SEVERITY_FIELDS,
+    'junctions': [
+        ('junction_index', pa.int64()),
+        ('junction_id', pa.int64()),
+        ('latitude_junction', pa.float64()),
+        ('longitude_junction', pa.float64()),
+        ('junction_cluster_id', pa.int64()),
+        ('junction_cluster_name', pa.string()),
+        ('latitude_cluster', pa.float64()),
+        ('longitude_cluster', pa.float64()),
+    ],
+    'mapped_collisions': [
+        (name if name != 'collision_id' else 'collision_index', dtype)
+        for name, dtype in COLLISION_FIELDS
+    ] + SEVERITY_FIELDS + [
+        ('distance_to_junction', pa.float64()),
+        ('junction_index', pa.int64()),
+        ('junction_id', pa.int64()),
+    ],
+    'junction_candidates': [
+        ('collision_index', pa.int64()),
+        ('candidate_rank', pa.int8()),
+        ('junction_index', pa.int64()),
+        ('junction_id', pa.int64()),
+        ('distance_to_junction', pa.float64()),
+    ],
+    'collision_mappings': [
+        ('collision_index', pa.int64()),
+        ('year', pa.int16()),
+        ('input_hash', pa.uint64()),
+        ('junction_index', pa.int64()),
+        ('junction_id', pa.int64()),
+        ('distance_to_junction', pa.float64()),
+        ('snapping_distance', pa.float64()),
+    ],
+}
+
+
+# the app data is partitioned by these, borough is a plain string to be a partition key
+APP_PARTITIONING = [('casualty_type', pa.string()), ('borough', pa.string())]
+
+# collisions joined to their junctions, with the columns the app derives from them, one table per casualty type
+SCHEMAS['junction_collisions'] = SCHEMAS['junctions'] + [
+    (name, dtype) for name, dtype in SCHEMAS['mapped_collisions'] if name != 'borough'
+] + [
+    ('danger_metric', pa.float64()),
+    ('recency_danger_metric', pa.float64()),
+    ('stats19_link', pa.string()),
+] + APP_PARTITIONING
+
+
+class SchemaError(Exception):
+    pass
+
+
+def get_field_type(table: str, column: str) -> pa.DataType:
+    """
+    Type of a column in a table's schema, None if the column isn't in it
+    """
+    for name, dtype in SCHEMAS[table]:
+        if re.fullmatch(name, column):
+            return dtype
+    return None
+
+
+def get_arrow_schema(table: str, columns: list) -> pa.Schema:
+    """
+    Arrow schema for the columns of a table, fails on any column not in the schema
+    """
+    fields = []
+    for column in columns:
+        dtype = get_field_type(table, column)
+        if dtype is None:
+            raise SchemaError(f'Column {column} is not in the {table} schema')
+        fields.append(pa.field(column, dtype))
+
+    schema = pa.schema(fields)
+    return schema.with_metadata({METADATA_KEY: f'{table}:{SCHEMA_VERSION}'.encode('utf-8')})
+
+
+def check_required_columns(table: str, columns: list):
+    """
+    All non-pattern columns in a schema must be present
+    """
+    required = [name for name, _ in SCHEMAS[table] if re.escape(name) == name]
+    missing = [name for name in required if name not in columns]
+    if len(missing) > 0:
+        raise SchemaError(f'Columns {missing} missing from {table}')
+
+
+def write_table(df: pd.DataFrame, table: str, path: str, csv_export: bool = False, drop_extra: bool = False):
+    """
+    Write a dataframe to parquet with the table's schema, optionally also exporting to csv.
+    Extra columns fail unless drop_extra, in which case they are dropped from the output.
+    """
+    check_required_columns(table, df.columns)
+
+    if drop_extra:
+        extra = [col for col in df.columns if get_field_type(table, col) is None]
+        if len(extra) > 0:
+            print(f'Dropping columns not in {table} schema: {extra}')
+            df = df.drop(columns=extra)
+
+    schema = get_arrow_schema(table, df.columns)
+    try:
+        arrow_table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+        raise SchemaError(f'Data does not match {table} schema: {e}') from e
+
+    pq.write_table(arrow_table, path)
+
+    if csv_export:
+        df.to_csv(re.sub(r'\.parquet$', '.csv', path), index=False)
+
+
+def write_dataset(df: pd.DataFrame, table: str, base_dir: str, partitioning: list):
+    """
+    Write a dataframe as a hive partitioned parquet dataset (e.g. casualty_type=cyclist/borough=CAMDEN/)
+    with the table's schema. Datasets can hold a subset of the table's columns, e.g. only those used by the app.
+    """
+    schema = get_arrow_schema(table, df.columns)
+    try:
+        arrow_table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+        raise SchemaError(f'Data does not match {table} schema: {e}') from e
+
+    ds.write_dataset(
+        arrow_table,
+        base_dir,
+        format='parquet',
+        partitioning=partitioning,
+        partitioning_flavor='hive',
+        basename_template='part-{i}.parquet'
+    )
+
+
+def read_table(table: str, path: str, columns: list = None) -> pd.DataFrame:
+    """
+    Read only the requested columns of a parquet file, checking its schema version + column types
+    """
+    file_schema = pq.read_schema(path)
+
+    version = (file_schema.metadata or {}).get(METADATA_KEY, b'').decode('utf-8')
+    if version != f'{table}:{SCHEMA_VERSION}':
+        raise SchemaError(
+            f'{path} has schema "{version}", expected "{table}:{SCHEMA_VERSION}", rerun the stage that creates it'
+        )
+
+    columns = columns or file_schema.names
+    for column in columns:
+        if column not in file_schema.names:
+            raise SchemaError(f'Column {column} not in {path}')
+        if file_schema.field(column).type != get_field_type(table, column):
+            raise SchemaError(
+                f'Column {column} in {path} is {file_schema.field(column).type}, '
+                f'expected {get_field_type(table, column)}'
+            )
+
+    return pq.read_table(path, columns=columns).to_pandas()
@@ -0,0 +1,63 @@
+"""
+Casualty severity counts per collision for each mode of travel, in one vectorised pass.
+"""
+import numpy as np
+import pandas as pd
+
+
+SEVERITIES = ['fatal', 'serious', 'slight']  # most to least severe
+
+
+def get_casualty_type(mode_of_travel: str, casualty_type_names: dict) -> str:
+    """
+    Name used for a mode of travel in column names, e.g. pedal_cycle -> cyclist
+    """
+    return (casualty_type_names or {}).get(mode_of_travel, mode_of_travel)
+
+
+def count_severities(casualties: pd.DataFrame, modes_of_travel: list) -> tuple:
+    """
+    Count casualties per collision x mode of travel x severity.
+    Returns the collision ids and an array of counts with shape (collisions, modes, severities).
+    """
+    mode_codes = pd.Categorical(casualties['mode_of_travel'], categories=modes_of_travel).codes
+    severity_codes = pd.Categorical(casualties['casualty_severity'], categories=SEVERITIES).codes
+
+    mask = (mode_codes >= 0) & (severity_codes >= 0)
+    collision_codes, collision_ids = pd.factorize(casualties['collision_id'].to_numpy()[mask], sort=True)
+
+    n_collisions, n_modes, n_severities = len(collision_ids), len(modes_of_travel), len(SEVERITIES)
+    flat_codes = (collision_codes * n_modes + mode_codes[mask]) * n_severities + severity_codes[mask]
+
+    counts = (
+        np.bincount(flat_codes, minlength=n_collisions * n_modes * n_severities)
+        .reshape(n_collisions, n_modes, n_severities)
+    )
+    return collision_ids, counts
+
+
+def recalculate_severities(casualties: pd.DataFrame, modes_of_travel: list, casualty_type_names: dict = None) -> pd.DataFrame:
+    '''
+    Recalculate severities for each mode of travel, e.g. based on cyclists or pedestrians only.
+    Returns one row per collision with, for each casualty type, the number of fatal / serious / slight
+    casualties and the max severity.
+    '''
+    collision_ids, counts = count_severities(casualties, modes_of_travel)
+
+    # max severity is the first severity with any casualties, -1 (i.e. null) if there are none
+    has_casualties = counts.sum(axis=2) > 0
+    max_severity_codes = np.where(has_casualties, np.argmax(counts > 0, axis=2), -1)
+
+    columns = {'collision_id': collision_ids}
+    for i, mode_of_travel in enumerate(modes_of_travel):
+        casualty_type = get_casualty_type(mode_of_travel, casualty_type_names)
+
+        for j, severity in enumerate(SEVERITIES):
+            columns[f'{severity}_{casualty_type}_casualties'] = counts[:, i, j].astype('int8')
+
+        columns[f'max_{casualty_type}_severity'] = pd.Categorical.from_codes(
+            max_severity_codes[:, i],
+            categories=SEVERITIES
+        )
+
+    return pd.DataFrame(columns)
@@ -0,0 +1,224 @@
+"""
+Download and parse the TfL yearly collision extracts.
+
+Downloads run concurrently through a bounded thread pool and are stored in a local
+raw-file cache keyed by URL. Cached files are revalidated with ETag / Last-Modified
+headers so unchanged extracts are not downloaded again, and in offline mode only the
+cache is used. Parsing of the individual extracts is spread across processes, each
+extract is parsed once after finding its header row from the first few KB.
+"""
+import os
+import csv
+import json
+import time
+import hashlib
+import threading
+import requests
+import pandas as pd
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+DEFAULT_CACHE_DIR = 'data/raw'
+
+_thread_local = threading.local()
+
+
+def get_session() -> requests.Session:
+    """
+    One requests session per download thread, sessions aren't safe to share across threads
+    """
+    if not hasattr(_thread_local, 'session'):
+        _thread_local.session = requests.Session()
+    return _thread_local.session
+
+
+def get_cache_paths(link: str, cache_dir: str) -> tuple:
+    """
+    Paths of the cached file and its metadata for a download link
+    """
+    key = hashlib.sha256(link.encode('utf-8')).hexdigest()[:16]
+    file_name = os.path.basename(link.split('?')[0]) or 'download'
+    data_path = os.path.join(cache_dir, f'{key}-{file_name}')
+    meta_path = os.path.join(cache_dir, f'{key}.json')
+    return data_path, meta_path
+
+
+def read_cache_metadata(meta_path: str) -> dict:
+    """
+    Read the cache metadata for a link, empty if nothing has been cached yet
+    """
+    if not os.path.exists(meta_path):
+        return {}
+    with open(meta_path, 'r') as f:
+        return json.load(f)
+
+
+def write_atomic(path: str, content: bytes):
+    """
+    Write to a temporary file first so a failed download never leaves a partial file in the cache
+    """
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def fetch_link(link: str, cache_dir: str = DEFAULT_CACHE_DIR, offline: bool = False, timeout: int = 120) -> str:
+    """
+    Fetch a single link into the cache and return the path of the cached file.
+    """
+    data_path, meta_path = get_cache_paths(link, cache_dir)
+    metadata = read_cache_metadata(meta_path)
+    is_cached = os.path.exists(data_path) and metadata.get('url') == link
+
+    if offline:
+        if not is_cached:
+            raise FileNotFoundError(f'Offline mode but no cached copy of: {link}')
+        print(f'Using cached: {link}')
+        return data_path
+
+    headers = {}
+    if is_cached:
+        if metadata.get('etag'):
+            headers['If-None-Match'] = metadata['etag']
+        if metadata.get('last_modified'):
+            headers['If-Modified-Since'] = metadata['last_modified']
+
+    response = get_session().get(link, headers=headers, timeout=timeout)
+
+    if response.status_code == 304 and is_cached:
+        print(f'Not modified, using cached: {link}')
+        return data_path
+
+    response.raise_for_status()
+
+    write_atomic(data_path, response.content)
+    metadata = {
+        'url': link,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'size': len(response.content),
+    }
+    write_atomic(meta_path, json.dumps(metadata, indent=2).encode('utf-8'))
+
+    print(f'Downloaded: {link}')
+    return data_path
+
+
+def fetch_links(links: list, cache_dir: str = DEFAULT_CACHE_DIR, offline: bool = False, max_workers: int = 4) -> dict:
+    """
+    Fetch links concurrently with a bounded pool of threads. Returns a dict of link -> cached file path.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        paths = executor.map(
+            lambda link: fetch_link(link, cache_dir=cache_dir, offline=offline),
+            links
+        )
+        return dict(zip(links, paths))
+
+
+def sniff_header(path: str, required_cols: list, aliases: dict, sniff_bytes: int = 16 * 1024) -> tuple:
+    """
+    Find the header row + column aliases using only the start of the file. Some extracts have a
+    preamble before the real header, which shows up as lines with empty column names.
+    Returns the number of lines to skip, the byte offset of the header and a dict of file column -> required column.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(sniff_bytes)
+        at_eof = len(head) < sniff_bytes
+        while True:
+            lines = head.split(b'\n')
+            if not at_eof:
+                lines = lines[:-1]  # last line may be cut off
+
+            offset_bytes = 0
+            for n, line in enumerate(lines):
+                # utf-8-sig drops the byte order mark some extracts start with
+                text = line.rstrip(b'\r').decode(encoding='utf-8-sig', errors='replace')
+                if text != '':
+                    cols = next(csv.reader([text]))
+                    if '' not in cols:
+                        break
+                offset_bytes += len(line) + 1
+            else:
+                if at_eof:
+                    raise ValueError(f'No header row found in: {path}')
+                more = f.read(sniff_bytes)
+                at_eof = len(more) < sniff_bytes
+                head += more
+                continue
+            break
+
+    # map file columns to the required columns
+    renames = {}
+    for col in cols:
+        col = col.strip()
+        name = aliases.get(col, col)
+        if name in required_cols:
+            renames[col] = name
+
+    missing = set(required_cols) - set(renames.values())
+    if len(missing) > 0:
+        raise KeyError(f'Columns {sorted(missing)} not found in: {path}')
+
+    return n, offset_bytes, renames
+
+
+def parse_extract(path: str, required_cols: list, aliases: dict, chunksize: int = 100_000) -> pd.DataFrame:
+    """
+    Parse a single cached extract in one pass, only reading the required columns.
+    """
+    start_time = time.perf_counter()
+
+    skiprows, offset_bytes, renames = sniff_header(path, required_cols, aliases)
+
+    chunks = pd.read_csv(
+        path,
+        encoding='utf-8-sig',
+        encoding_errors='replace',
+        skiprows=skiprows,
+        usecols=lambda col: col.strip() in renames,
+        chunksize=chunksize,
+        low_memory=False
+    )
+    df = pd.concat(chunks, ignore_index=True)
+
+    df.columns = [renames[col.strip()] for col in df.columns]
+    df = df[required_cols]
+
+    if len(df[df.isnull().any(axis=1)]) > 0:
+        print('Rows to be deleted...')
+        print(df[df.isnull().any(axis=1)])
+        df = df[~df.isnull().any(axis=1)]
+
+    df.loc[:, 'raw_collision_id'] = df.loc[:, 'raw_collision_id'].astype(int)
+
+    parsed_bytes = os.path.getsize(path) - offset_bytes
+    parse_time = time.perf_counter() - start_time
+    print(
+        f'Processed: {path}, header at line {skiprows}, '
+        f'parsed {parsed_bytes / 1024 ** 2:.2f} MB in {parse_time:.2f}s, added {len(df)} rows'
+    )
+
+    return df
+
+
+def parse_extracts(paths: list, required_cols: list, aliases: dict, max_workers: int = None) -> list:
+    """
+    Parse extracts in parallel across cores, results are in the same order as paths.
+    """
+    if len(paths) == 0:
+        return []
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(
+            executor.map(
+                parse_extract,
+                paths,
+                [required_cols] * len(paths),
+                [aliases] * len(paths)
+            )
+        )
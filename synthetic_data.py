@@ -0,0 +1,48 @@
+"""
+Synthetic data shared by the tests + benchmarks, at any scale.
+"""
+import numpy as np
+import pandas as pd
+
+
+BOROUGHS = [f'BOROUGH {i}' for i in range(33)]
+
+
+def make_junction_collisions(n_collisions: int, n_clusters: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Synthetic collisions joined to their junction clusters, with the app's metric weights + recency weights
+    """
+    rng = np.random.default_rng(seed)
+
+    # most clusters have one or two collisions, a few have lots
+    cluster_ids = np.where(
+        rng.uniform(size=n_collisions) < .8,
+        rng.integers(0, n_clusters, n_collisions),
+        rng.zipf(1.5, n_collisions) % n_clusters
+    ) * 3
+    cluster_boroughs = rng.choice(BOROUGHS, n_clusters * 3)[cluster_ids]
+    # some collisions at clusters on a borough boundary are in the borough next door
+    is_next_door = rng.uniform(size=n_collisions) < .05
+    cluster_boroughs[is_next_door] = rng.choice(BOROUGHS, is_next_door.sum())
+
+    severity = rng.choice(['fatal', 'serious', 'slight'], n_collisions, p=[.01, .14, .85])
+    weights = pd.Series(severity).map({'fatal': 5, 'serious': 1, 'slight': .1}).to_numpy()
+    years = rng.integers(2020, 2025, n_collisions)
+    recency_weights = np.array([.78, .85, .91, .96, 1])[years - 2020]
+
+    return pd.DataFrame({
+        'junction_cluster_id': cluster_ids,
+        'junction_cluster_name': [f'Junction {i}' for i in cluster_ids],
+        'latitude_cluster': 51.3 + (cluster_ids % 1000) / 2000,
+        'longitude_cluster': -.5 + (cluster_ids // 1000) / 300,
+        'notes': np.where(cluster_ids % 500 == 0, 'Scheme planned', ''),
+        'borough': cluster_boroughs,
+        'year': years.astype(np.int16),
+        'danger_metric': weights,
+        'recency_danger_metric': weights * recency_weights,
+        'fatal_cyclist_casualties': (severity == 'fatal').astype(np.int8),
+        'serious_cyclist_casualties': (severity == 'serious').astype(np.int8),
+        'slight_cyclist_casualties': (
+            (severity == 'slight').astype(np.int8) + rng.integers(0, 2, n_collisions, dtype=np.int8)
+        ),
+    }).sample(frac=1, random_state=seed).reset_index(drop=True)
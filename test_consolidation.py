@@ -0,0 +1,86 @@
+import numpy as np
+import networkx as nx
+import osmnx as ox
+
+from consolidation import (
+    osmnx_consolidate_intersections, tiled_consolidate_intersections, kdtree_consolidate_intersections,
+    compare_clusters, get_cluster_sets
+)
+
+
+def make_grid_graph(size: int = 12, spacing: float = 60, seed: int = 0) -> nx.MultiDiGraph:
+    """
+    Projected grid of streets, with extra nodes near some junctions so there are clusters to consolidate,
+    including chains of nodes crossing tile borders + nearby nodes that aren't connected to each other
+    """
+    rng = np.random.default_rng(seed)
+    G = nx.MultiDiGraph(crs='epsg:27700')
+
+    def add_edge(u, v):
+        length = np.hypot(G.nodes[u]['x'] - G.nodes[v]['x'], G.nodes[u]['y'] - G.nodes[v]['y'])
+        G.add_edge(u, v, length=length)
+        G.add_edge(v, u, length=length)
+
+    for i in range(size):
+        for j in range(size):
+            G.add_node(i * size + j, x=i * spacing + rng.uniform(-5, 5), y=j * spacing + rng.uniform(-5, 5))
+            if i > 0:
+                add_edge((i - 1) * size + j, i * size + j)
+            if j > 0:
+                add_edge(i * size + j - 1, i * size + j)
+
+    node_id = size * size
+    for junction in rng.choice(size * size, size * size // 2, replace=False):
+        parent = junction
+        for _ in range(rng.integers(1, 4)):
+            angle = rng.uniform(0, 2 * np.pi)
+            G.add_node(
+                node_id,
+                x=G.nodes[parent]['x'] + 18 * np.cos(angle),
+                y=G.nodes[parent]['y'] + 18 * np.sin(angle)
+            )
+            # some satellites are dead ends with no connection to the junction they're next to
+            if rng.uniform() < .8:
+                add_edge(parent, node_id)
+            parent = node_id
+            node_id += 1
+
+    for node, street_count in ox.stats.count_streets_per_node(G).items():
+        G.nodes[node]['street_count'] = street_count
+
+    return G
+
+
+def test_tiled_clusters_match_single_process():
+    G = make_grid_graph()
+    tolerance = 15
+
+    expected = osmnx_consolidate_intersections(G.copy(), tolerance)
+
+    # tiles much smaller than the graph, so lots of clusters cross tile borders
+    result = tiled_consolidate_intersections(G, tolerance, tile_size=100, max_workers=2)
+
+    assert len(expected) < len(G.nodes)  # make sure the graph has clusters to test
+    for expected_array, result_array in zip(expected.get_junction_clusters(), result.get_junction_clusters()):
+        np.testing.assert_array_equal(result_array, expected_array)
+
+
+def test_kdtree_clusters_match_osmnx():
+    G = make_grid_graph(seed=1)
+
+    report = compare_clusters(G, 15, kdtree_consolidate_intersections)
+
+    assert report['osmnx_clusters'] < len(G.nodes)
+    assert report['identical_node_ids']
+
+
+def test_kdtree_connected_pairs_only():
+    G = make_grid_graph(seed=1)
+
+    clusters = get_cluster_sets(kdtree_consolidate_intersections(G, 15, connected_pairs_only=True))
+
+    # every merged node is joined by an edge to another node in its cluster
+    for cluster in clusters:
+        if len(cluster) > 1:
+            for node in cluster:
+                assert len(set(G.successors(node)) & cluster) > 0
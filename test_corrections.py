@@ -0,0 +1,62 @@
+import pandas as pd
+import pytest
+
+from corrections import apply_corrections
+
+
+@pytest.fixture
+def collisions() -> pd.DataFrame:
+    return pd.DataFrame({
+        'collision_id': [2018010106912, 2018010115338, 2019010000001, 2020010000002],
+        'junction_detail': pd.Categorical(['roundabout', 'crossroads', 'crossroads', 'roundabout']),
+        'speed_limit': [30, 20, 30, 40],
+        'borough': ['CAMDEN', 'BRENT', 'SUTTON', 'EALING'],
+    }, index=[3, 0, 3, 1])  # corrections are applied by position, which a repeated index can't be used for
+
+
+CORRECTIONS = {
+    2018010115338: {'junction_detail': 'other_junction', 'speed_limit': 30},
+    2020010000002: {'junction_detail': 'crossroads', 'not_a_column': 'x'},
+    2021010000003: {'speed_limit': 20},
+}
+
+
+def test_apply_corrections(collisions, tmp_path):
+    original = collisions.copy()
+    audit_path = tmp_path / 'corrections-audit.csv'
+
+    corrected, audit = apply_corrections(collisions, CORRECTIONS, audit_path=str(audit_path))
+
+    # only the corrected values change, at the right rows
+    expected = collisions.copy()
+    expected['junction_detail'] = expected['junction_detail'].cat.add_categories(['other_junction'])
+    expected.iloc[1, 1] = 'other_junction'
+    expected.iloc[1, 2] = 30
+    expected.iloc[3, 1] = 'crossroads'
+    pd.testing.assert_frame_equal(corrected, expected)
+    pd.testing.assert_frame_equal(collisions, original)  # input not changed
+
+    audit = audit.set_index(['collision_id', 'column'])
+    assert audit['status'].to_dict() == {
+        (2018010115338, 'junction_detail'): 'corrected',
+        (2018010115338, 'speed_limit'): 'corrected',
+        (2020010000002, 'junction_detail'): 'corrected',
+        (2020010000002, 'not_a_column'): 'unknown_column',
+        (2021010000003, 'speed_limit'): 'missing_collision_id',
+    }
+    assert audit.loc[(2018010115338, 'junction_detail'), 'before'] == 'crossroads'
+    assert audit.loc[(2018010115338, 'speed_limit'), 'before'] == 20
+    assert audit.loc[(2020010000002, 'junction_detail'), 'before'] == 'roundabout'
+    assert audit.loc[audit['status'] != 'corrected', 'before'].isnull().all()
+    assert audit['after'].tolist() == ['other_junction', 30, 'crossroads', 'x', 20]
+
+    written = pd.read_csv(audit_path)
+    assert written.columns.tolist() == ['collision_id', 'column', 'before', 'after', 'status']
+    assert len(written) == 5
+
+
+def test_no_corrections(collisions):
+    corrected, audit = apply_corrections(collisions, None)
+
+    pd.testing.assert_frame_equal(corrected, collisions)
+    assert len(audit) == 0
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+from danger_ranking import DangerCube, top_n
+from reference import rank_dangerous_junctions_groupby
+from synthetic_data import BOROUGHS, make_junction_collisions
+
+
+def test_cube_same_ranking_as_groupby(tmp_path):
+    junction_collisions = make_junction_collisions(5000, 800)
+    junction_collisions.loc[::50, 'borough'] = None  # only counted for ALL
+
+    # metrics exact in binary, so sums are the same in any order + there are lots of exact ties
+    rng = np.random.default_rng(0)
+    junction_collisions['danger_metric'] = junction_collisions['danger_metric'].map({5: 4, 1: 1, .1: .125})
+    junction_collisions['recency_danger_metric'] = (
+        junction_collisions['danger_metric'] * rng.choice([.5, 1], len(junction_collisions))
+    )
+
+    DangerCube.from_junction_collisions(junction_collisions, 'cyclist').save(tmp_path / 'cube.npz')
+    cube = DangerCube.load(tmp_path / 'cube.npz')
+
+    for boroughs in [['ALL'], BOROUGHS[:1], BOROUGHS[3:5], [BOROUGHS[0], 'NOT A BOROUGH']]:
+        if 'ALL' in boroughs:
+            borough_collisions = junction_collisions
+        else:
+            borough_collisions = junction_collisions[junction_collisions['borough'].isin(boroughs)]
+
+        for n_junctions in [1, 20, 1000]:
+            result = cube.rank(boroughs, n_junctions, 'cyclist')
+            expected = rank_dangerous_junctions_groupby(borough_collisions, n_junctions, 'cyclist')
+
+            # casualty sums are int64 rather than the int8 groupby keeps, which could overflow
+            pd.testing.assert_frame_equal(
+                result.drop(columns='yearly_danger_metrics'),
+                expected.drop(columns=['index', 'notes']),
+                check_dtype=False
+            )
+
+            # danger metric by year, over the years the ranked clusters have collisions in
+            yearly = (
+                borough_collisions[borough_collisions['junction_cluster_id'].isin(result['junction_cluster_id'])]
+                .pivot_table(index='junction_cluster_id', columns='year', values='danger_metric', aggfunc='sum')
+                .fillna(0)
+                .loc[result['junction_cluster_id']]
+            )
+            assert result['yearly_danger_metrics'].tolist() == yearly.to_numpy().tolist()
+
+
+def test_cube_borough_with_no_collisions():
+    cube = DangerCube.from_junction_collisions(make_junction_collisions(100, 10), 'cyclist')
+    assert len(cube.rank(['NOT A BOROUGH'], 10, 'cyclist')) == 0
+
+
+def test_top_n_tie_breaks():
+    cluster_ids = np.array([10, 11, 12, 13, 14])
+    metric = np.array([1., 3., 3., 3., 2.])
+    fatal = np.array([0, 0, 1, 0, 5])
+
+    # highest metric, then most fatal, then lowest cluster id
+    assert cluster_ids[top_n(cluster_ids, metric, fatal, 3)].tolist() == [12, 11, 13]
+    assert cluster_ids[top_n(cluster_ids, metric, fatal, 10)].tolist() == [12, 11, 13, 14, 10]
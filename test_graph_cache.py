@@ -0,0 +1,42 @@
+from graph_cache import graph_from_osm_file
+
+
+OSM_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+  <node id="1" lat="51.5200" lon="-0.1000"/>
+  <node id="2" lat="51.5200" lon="-0.0990"/>
+  <node id="3" lat="51.5200" lon="-0.0980"/>
+  <node id="4" lat="51.5210" lon="-0.0990"/>
+  <node id="5" lat="51.5190" lon="-0.0990"/>
+  <node id="6" lat="51.5220" lon="-0.0990"/>
+  <way id="10">
+    <nd ref="1"/><nd ref="2"/><nd ref="3"/>
+    <tag k="highway" v="residential"/><tag k="name" v="Old Street"/>
+  </way>
+  <way id="11">
+    <nd ref="2"/><nd ref="5"/>
+    <tag k="highway" v="residential"/><tag k="name" v="City Road"/>
+  </way>
+  <way id="12">
+    <nd ref="2"/><nd ref="4"/>
+    <tag k="highway" v="footway"/>
+  </way>
+  <way id="13">
+    <nd ref="4"/><nd ref="6"/>
+    <tag k="highway" v="residential"/><tag k="motor_vehicle" v="no"/>
+  </way>
+</osm>
+"""
+
+
+def test_osm_file_filtered_to_network_type(tmp_path):
+    path = tmp_path / 'extract.osm'
+    path.write_text(OSM_XML)
+
+    drive = graph_from_osm_file(str(path), 'drive')
+    assert sorted(drive.nodes) == [1, 2, 3, 5]
+    assert all('motor_vehicle' not in data for _, _, data in drive.edges(data=True))
+
+    # the end of the no motor vehicles road is only reachable on foot
+    walk = graph_from_osm_file(str(path), 'walk')
+    assert 6 in walk.nodes
@@ -0,0 +1,95 @@
+import os
+import pandas as pd
+import pytest
+
+from ingest_store import (
+    TABLES, settings_hash, get_partition_path, source_entry, needs_ingest, write_partition,
+    remove_stale_partitions, read_partitions
+)
+
+
+@pytest.fixture
+def casualties() -> pd.DataFrame:
+    return pd.DataFrame({
+        'raw_collision_id': [1, 2, 3],
+        'collision_id': [2022000000001, 2022000000002, 2023000000003],
+        'casualty_id': [1, 1, 1],
+        'casualty_class': ['driver', 'pedestrian', 'driver'],
+        'casualty_gender': ['female', 'male', 'female'],
+        'number_of_casualties': pd.Series([1, 1, 1], dtype='int8'),
+        'casualty_severity': pd.Categorical(['slight', 'fatal', 'serious']),
+        'mode_of_travel': pd.Categorical(['pedal_cycle', 'pedestrian', 'car']),
+    })
+
+
+def test_read_partitions_unions_categories(casualties, tmp_path):
+    # each year's partition only has the categories in that year
+    for year, year_casualties in [(2022, casualties.iloc[:2]), (2023, casualties.iloc[2:])]:
+        year_casualties = year_casualties.assign(
+            casualty_severity=year_casualties['casualty_severity'].cat.remove_unused_categories(),
+            mode_of_travel=year_casualties['mode_of_travel'].cat.remove_unused_categories()
+        )
+        write_partition(year_casualties, str(tmp_path), 'casualties', year)
+
+    combined = read_partitions(str(tmp_path), 'casualties', [2022, 2023])
+
+    assert isinstance(combined['casualty_severity'].dtype, pd.CategoricalDtype)
+    for column in ['casualty_severity', 'mode_of_travel']:
+        assert combined[column].tolist() == casualties[column].tolist()
+
+
+def test_read_partitions_without_years(tmp_path):
+    with pytest.raises(ValueError, match='No years to read casualties for'):
+        read_partitions(str(tmp_path), 'casualties', [])
+
+
+LINKS = {table: f'https://tfl.gov.uk/jan-dec-2023-gla-data-extract-{table}.csv' for table in TABLES}
+
+
+@pytest.fixture
+def store(tmp_path) -> dict:
+    """
+    Store with 2022 + 2023 ingested, from sources downloaded to tmp_path
+    """
+    store_dir = tmp_path / 'store'
+    paths = {}
+    for table in TABLES:
+        paths[table] = str(tmp_path / f'{table}.csv')
+        with open(paths[table], 'w') as f:
+            f.write(f'{table}\n1\n')
+        for year in [2022, 2023]:
+            partition = get_partition_path(str(store_dir), table, year)
+            os.makedirs(os.path.dirname(partition))
+            open(partition, 'w').close()
+
+    entry = source_entry(LINKS, paths, settings_hash('settings'))
+    return {'dir': str(store_dir), 'paths': paths, 'manifest': {'2022': entry, '2023': entry}}
+
+
+def test_unchanged_year_skipped(store):
+    entry = source_entry(LINKS, store['paths'], settings_hash('settings'))
+
+    assert not needs_ingest(2023, entry, store['manifest'], store['dir'])
+    assert needs_ingest(2024, entry, store['manifest'], store['dir'])  # new year
+    assert needs_ingest(2023, {**entry, 'settings_hash': settings_hash('new settings')}, store['manifest'], store['dir'])
+
+    os.remove(get_partition_path(store['dir'], 'casualties', 2023))
+    assert needs_ingest(2023, entry, store['manifest'], store['dir'])
+
+
+def test_changed_source_reingested(store):
+    with open(store['paths']['casualties'], 'a') as f:
+        f.write('2\n')
+    entry = source_entry(LINKS, store['paths'], settings_hash('settings'))
+
+    assert entry['casualties']['content_hash'] != store['manifest']['2023']['casualties']['content_hash']
+    assert needs_ingest(2023, entry, store['manifest'], store['dir'])
+
+
+def test_dropped_year_removed(store):
+    removed = remove_stale_partitions(store['dir'], [2023])
+
+    assert removed == [2022]
+    for table in TABLES:
+        assert not os.path.exists(os.path.dirname(get_partition_path(store['dir'], table, 2022)))
+        assert os.path.exists(get_partition_path(store['dir'], table, 2023))
@@ -0,0 +1,75 @@
+import numpy as np
+import networkx as nx
+import osmnx as ox
+
+from junction_hierarchy import ClusterIndex
+
+
+def test_from_mapping_groups_junctions_by_cluster():
+    index = ClusterIndex.from_mapping(
+        junction_ids=[10, 11, 12, 13, 14],
+        cluster_ids=[2, 0, 2, 5, 0]
+    )
+
+    assert index.cluster_ids.tolist() == [0, 2, 5]
+    assert index.offsets.tolist() == [0, 2, 4, 5]
+    assert index.get_junctions(0).tolist() == [11, 14]
+    assert index.get_junctions(2).tolist() == [10, 12]
+    assert index.get_junctions(5).tolist() == [13]
+    assert index.get_junctions(3).tolist() == []
+    assert index.junction_ids.dtype == np.int64
+
+
+def test_from_consolidated_graph_parses_merged_osmids():
+    # nodes as OSMnx < 2 consolidate_intersections leaves them, merged osmids are a string of a list
+    G2 = nx.MultiDiGraph()
+    G2.add_node(0, osmid_original=101)
+    G2.add_node(1, osmid_original='[102, 103, 104]')
+    G2.add_node(2, osmid_original=105)
+    G2.add_node(3, osmid_original='[106, 107]')
+
+    index = ClusterIndex.from_consolidated_graph(G2)
+
+    junction_ids, cluster_ids = index.get_junction_clusters()
+    assert junction_ids.tolist() == [101, 102, 103, 104, 105, 106, 107]
+    assert cluster_ids.tolist() == [0, 1, 1, 1, 2, 3, 3]
+
+
+def test_from_consolidated_graph_with_integer_osmids():
+    # merged osmids as a list of ints, cluster 1 has a single original node so its osmid is a scalar
+    G2 = nx.MultiDiGraph()
+    G2.add_node(0, osmid_original=[102, 103])
+    G2.add_node(1, osmid_original=np.int64(101))
+    G2.add_node(2, osmid_original=[104])
+
+    index = ClusterIndex.from_consolidated_graph(G2)
+
+    assert index.cluster_ids.tolist() == [0, 1, 2]
+    assert index.get_junctions(0).tolist() == [102, 103]
+    assert index.get_junctions(1).tolist() == [101]
+    assert index.get_junctions(2).tolist() == [104]
+
+
+def test_from_consolidated_graph_matches_osmnx():
+    # two junctions 5m apart on a 100m road, consolidated with a 10m tolerance
+    G = nx.MultiDiGraph(crs='epsg:27700')
+    for osmid, x in [(1, 0), (2, 5), (3, 100)]:
+        G.add_node(osmid, x=x, y=0, street_count=3)
+    G.add_edge(1, 2, length=5)
+    G.add_edge(2, 3, length=95)
+
+    G2 = ox.consolidate_intersections(G, tolerance=10, rebuild_graph=True, dead_ends=True)
+
+    index = ClusterIndex.from_consolidated_graph(G2)
+
+    assert sorted(index.get_junctions(cluster_id).tolist() for cluster_id in index.cluster_ids) == [[1, 2], [3]]
+
+
+def test_save_and_load(tmp_path):
+    index = ClusterIndex.from_mapping([10, 11, 12], [1, 1, 0])
+    index.save(tmp_path / 'index.npz')
+
+    loaded = ClusterIndex.load(tmp_path / 'index.npz')
+
+    for name in ['cluster_ids', 'offsets', 'junction_ids']:
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(index, name))
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import networkx as nx
+
+from junction_names import name_junctions, shorten_road_names
+from reference import name_junctions_row_wise, shorten_road_name
+
+
+def test_name_junctions_matches_row_wise():
+    rng = np.random.default_rng(0)
+    road_names = ['High Street', 'Church Road', 'Station Avenue', 'Park Gardens', 'London Bridge', 'Kings Place']
+
+    G = nx.MultiDiGraph(crs='epsg:4326')
+    n = 500
+    for node in range(n):
+        G.add_node(node, x=rng.uniform(), y=rng.uniform())
+    for u, v in rng.integers(0, n, (2 * n, 2)):
+        kind = rng.uniform()
+        if kind < .1:
+            G.add_edge(u, v)
+        elif kind < .3:
+            G.add_edge(u, v, name=[str(name) for name in rng.choice(road_names, 2, replace=False)])
+        else:
+            G.add_edge(u, v, name=str(rng.choice(road_names)))
+
+    # clusters of 1-3 junctions, some without any edges so no names
+    nodes_df = pd.DataFrame({
+        'junction_index': np.arange(n + 10),
+        'junction_id': np.arange(n + 10),
+        'junction_cluster_id': np.repeat(np.arange(n + 10), rng.integers(1, 4, n + 10))[:n + 10],
+    })
+
+    expected = name_junctions_row_wise(G, nodes_df.copy()).drop(columns='name_max_rank')
+    result = name_junctions(G, nodes_df.copy())
+
+    assert expected['junction_cluster_name'].str.contains(r'-\d+$').any()  # some names need numbering
+    pd.testing.assert_frame_equal(result.reset_index(drop=True), expected.reset_index(drop=True))
+
+
+def test_shorten_road_names_matches_row_wise():
+    names = pd.Series(['Old Street-City Road', 'Avenue Road-Bridge Place', 'Sloane Square-Kensington Gardens', 'A40'])
+
+    assert shorten_road_names(names).tolist() == names.apply(shorten_road_name).tolist()
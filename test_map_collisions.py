@@ -0,0 +1,141 @@
+import sys
+import importlib.util
+import numpy as np
+import pandas as pd
+import pytest
+
+from pathlib import Path
+from sklearn.neighbors import KDTree
+from convertbng.util import convert_lonlat
+
+
+@pytest.fixture(scope='module')
+def stage():
+    """
+    Stage 04, which can't be imported by name as the file name has hyphens. It's registered in sys.modules,
+    as python does for a script run as __main__, otherwise the process pool can't pickle query_chunk.
+    """
+    path = Path(__file__).parent / 'src' / '04-map-collisions-to-graph.py'
+    spec = importlib.util.spec_from_file_location('map_collisions_to_graph', path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    yield module
+    del sys.modules[spec.name]
+
+
+@pytest.fixture
+def junction_tree() -> KDTree:
+    rng = np.random.default_rng(0)
+    return KDTree(rng.uniform(0, 1000, size=(40, 2)))
+
+
+@pytest.fixture
+def coordinates() -> np.ndarray:
+    rng = np.random.default_rng(1)
+    return rng.uniform(0, 1000, size=(50, 2))
+
+
+def test_nearest_junction_matches_per_row(stage, junction_tree, coordinates):
+    junctions = np.asarray(junction_tree.data)
+
+    distances, positions = stage.get_nearest_junctions(junction_tree, coordinates)
+
+    for i, (easting, northing) in enumerate(coordinates):
+        row_distances = np.hypot(junctions[:, 0] - easting, junctions[:, 1] - northing)
+        assert positions[i, 0] == np.argmin(row_distances)
+        assert distances[i, 0] == pytest.approx(row_distances.min())
+
+
+@pytest.mark.parametrize('chunk_size', [7, 25, 49])
+def test_chunked_query_matches_single_query(stage, junction_tree, coordinates, chunk_size):
+    expected_distances, expected_positions = junction_tree.query(coordinates, k=3)
+
+    distances, positions = stage.get_nearest_junctions(
+        junction_tree, coordinates, k=3, chunk_size=chunk_size, max_workers=2
+    )
+
+    np.testing.assert_array_equal(distances, expected_distances)
+    np.testing.assert_array_equal(positions, expected_positions)
+
+
+def test_snapping_distances_in_metres(stage):
+    junctions = pd.DataFrame()
+    junctions['longitude_junction'], junctions['latitude_junction'] = convert_lonlat(
+        [530000., 530100.], [180000., 180050.]
+    )
+    collisions = np.array([[530003., 180004.], [530100., 180038.], [530060., 180050.]])
+
+    junction_bng = stage.get_junction_bng(junctions)
+    distances, positions = stage.get_nearest_junctions(KDTree(junction_bng), collisions)
+
+    np.testing.assert_allclose(junction_bng, [[530000., 180000.], [530100., 180050.]], atol=.01)
+    np.testing.assert_allclose(distances[:, 0], [5, 12, 40], atol=.01)
+    assert positions[:, 0].tolist() == [0, 1, 1]
+
+
+def test_distance_histogram(stage, capsys):
+    stage.print_distance_histogram(np.array([5., 12., 40., 3., 11.]), threshold=12)
+
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[-1] == '1 of 5 collisions over the 12m threshold'
+    assert lines[2].split() == ['5-10m', '1', '#' * 25]
+    assert lines[3].split() == ['10-15m', '2', '#' * 50, '(partly', 'excluded)']
+    assert lines[5].split() == ['20-30m', '0', '(excluded)']
+
+
+def test_distance_histogram_without_distances(stage, capsys):
+    stage.print_distance_histogram(np.array([]), threshold=12)
+
+    assert capsys.readouterr().out == 'No collisions snapped, so no snapping distances to show\n'
+
+
+PARAMS = {
+    'tolerance': 15,
+    'snapping': 'junction',
+    'distance_to_junction_threshold': 20,
+    'nearest_junction_candidates': 1,
+    'mapping_chunk_size': 50_000,
+    'mapping_workers': None,
+    'export_csv': False,
+}
+
+
+@pytest.fixture
+def junctions() -> pd.DataFrame:
+    longitudes, latitudes = convert_lonlat([530000., 530100.], [180000., 180050.])
+    return pd.DataFrame({
+        'junction_index': [0, 1],
+        'junction_id': [101, 102],
+        'latitude_junction': latitudes,
+        'longitude_junction': longitudes,
+    })
+
+
+def test_rerun_with_nothing_changed(stage, junctions, collisions_to_map, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'data').mkdir()
+    store_dir = str(tmp_path / 'mappings')
+
+    mappings = stage.get_mappings(collisions_to_map, junctions, 'abc', store_dir, PARAMS)
+    assert mappings['junction_id'].tolist() == [101, 102, 102, 102]
+
+    def fail(*args):
+        raise AssertionError('nothing should be mapped again')
+
+    monkeypatch.setattr(stage, 'snap_to_junctions', fail)
+    rerun_mappings = stage.get_mappings(collisions_to_map, junctions, 'abc', store_dir, PARAMS)
+
+    pd.testing.assert_frame_equal(rerun_mappings, mappings, check_dtype=False)
+
+
+def test_nothing_stored_or_to_map(stage, junctions, collisions_to_map, tmp_path):
+    no_collisions = collisions_to_map.iloc[:0]
+
+    mappings = stage.get_mappings(no_collisions, junctions, 'abc', str(tmp_path / 'mappings'), PARAMS)
+
+    assert len(mappings) == 0
+    assert mappings.columns.tolist() == [
+        'collision_index', 'year', 'input_hash', 'junction_index', 'junction_id', 'distance_to_junction',
+        'snapping_distance'
+    ]
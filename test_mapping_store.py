@@ -0,0 +1,68 @@
+import pandas as pd
+
+from mapping_store import (
+    hash_mapping_inputs, read_mappings, get_collisions_to_map, update_mappings, get_partition_path
+)
+
+
+MANIFEST = {'junctions_hash': 'abc', 'snapping': 'junction', 'max_distance': None}
+
+
+def map_collisions(collisions: pd.DataFrame) -> pd.DataFrame:
+    return pd.DataFrame({
+        'collision_index': collisions['collision_index'].to_numpy(),
+        'year': collisions['year'].to_numpy(),
+        'input_hash': collisions['input_hash'].to_numpy(),
+        'junction_index': collisions['collision_index'].to_numpy() * 10,
+        'junction_id': collisions['collision_index'].to_numpy() * 100,
+        'distance_to_junction': collisions['easting'].to_numpy() - 530000,
+        'snapping_distance': collisions['easting'].to_numpy() - 530000,
+    })
+
+
+def test_only_new_or_changed_collisions_mapped(collisions_to_map, tmp_path):
+    store_dir = str(tmp_path)
+    collisions = collisions_to_map
+
+    mappings = read_mappings(store_dir, MANIFEST)
+    assert mappings is None
+    assert get_collisions_to_map(collisions, mappings).all()
+    update_mappings(store_dir, MANIFEST, mappings, map_collisions(collisions), collisions['collision_index'])
+
+    # collision 2 corrected, 4 removed + 5 added
+    collisions.loc[1, 'easting'] += 30
+    collisions = pd.concat([
+        collisions[collisions['collision_index'] != 4],
+        pd.DataFrame({
+            'collision_index': [5], 'year': [2024], 'easting': [530400.], 'northing': [180400.], 'location': ['']
+        })
+    ], ignore_index=True)
+    collisions['input_hash'] = hash_mapping_inputs(collisions)
+
+    mappings = read_mappings(store_dir, MANIFEST)
+    to_map = get_collisions_to_map(collisions, mappings)
+    assert collisions.loc[to_map, 'collision_index'].tolist() == [2, 5]
+
+    updated = update_mappings(
+        store_dir, MANIFEST, mappings, map_collisions(collisions[to_map]), collisions['collision_index']
+    )
+
+    stored = read_mappings(store_dir, MANIFEST).sort_values('collision_index').reset_index(drop=True)
+    expected = map_collisions(collisions).sort_values('collision_index').reset_index(drop=True)
+    pd.testing.assert_frame_equal(stored, expected, check_dtype=False)
+    assert sorted(updated['collision_index']) == [1, 2, 3, 5]
+    assert stored.loc[stored['collision_index'] == 2, 'distance_to_junction'].item() == 130
+
+    # the removed collision is gone from its year's partition
+    year_2023 = pd.read_parquet(get_partition_path(store_dir, 2023))
+    assert year_2023['collision_index'].tolist() == [3]
+
+
+def test_changed_junctions_map_everything(collisions_to_map, tmp_path):
+    store_dir = str(tmp_path)
+    update_mappings(
+        store_dir, MANIFEST, None, map_collisions(collisions_to_map), collisions_to_map['collision_index']
+    )
+
+    assert read_mappings(store_dir, MANIFEST) is not None
+    assert read_mappings(store_dir, {**MANIFEST, 'junctions_hash': 'def'}) is None
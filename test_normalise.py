@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+from normalise import (
+    upper_case, clean_collision_ids, format_times, to_aliased_categorical
+)
+from reference import clean_collision_id, format_time
+
+
+def test_clean_collision_ids_matches_row_wise():
+    df = pd.DataFrame({
+        'raw_collision_id': [123456789, 4812345678, 1234, 5, 110012345, 4800000001, 123456789],
+        'year': [2016, 2016, 2020, 2021, 2023, 2024, 2024],
+        'borough': ['CAMDEN', 'CITY OF LONDON', 'BRENT', 'EALING', 'SUTTON', 'CITY OF LONDON', 'BEXLEY'],
+    }, index=[0, 1, 2, 0, 1, 2, 3])  # repeated index values, the result must be positional rather than aligned on the index
+
+    expected = df.apply(
+        lambda row: clean_collision_id(row['raw_collision_id'], row['year'], row['borough']), axis=1
+    )
+
+    result = clean_collision_ids(df['raw_collision_id'], df['year'])
+
+    assert result.tolist() == expected.tolist()
+    assert result.dtype == 'int64'
+
+
+def test_format_times_matches_row_wise():
+    times = pd.Series(["'0731", '07:31', '07:31:00', "'2359", '00:00', '23:59:59'])
+
+    assert format_times(times).tolist() == times.apply(format_time).tolist()
+
+
+def test_upper_case_matches_row_wise():
+    values = pd.Series(['Camden', 'city of london', 'A40 WESTWAY j/w Wood Lane'])
+
+    assert upper_case(values).tolist() == values.apply(lambda x: x.upper()).tolist()
+
+
+def test_to_aliased_categorical_matches_replace():
+    aliases = {'1 Fatal': 'fatal', 'Fatal': 'fatal', '3 Slight': 'slight'}
+    values = pd.Series(['1 Fatal', 'Fatal', '3 Slight', np.nan, 'serious', '1 Fatal'])
+
+    result = to_aliased_categorical(values, aliases)
+
+    assert isinstance(result.dtype, pd.CategoricalDtype)
+    pd.testing.assert_series_equal(result.astype(object), values.replace(aliases))
+    assert sorted(result.cat.categories) == ['fatal', 'serious', 'slight']
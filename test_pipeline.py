@@ -0,0 +1,93 @@
+import sys
+import json
+import pytest
+
+import pipeline
+from pipeline import Stage, get_stage_key, is_up_to_date, is_forced
+from hashing import hash_file
+
+
+SCRIPT = '''
+import yaml
+
+params = yaml.load(open('params.yaml', 'r'), Loader=yaml.Loader)
+with open(f"out-{params['tolerance']}.csv", 'w') as f:
+    f.write(open('in.csv').read())
+with open('runs.txt', 'a') as f:
+    f.write('ran\\n')
+'''
+
+STAGE = Stage(name='copy', script='copy.py', inputs=['in.csv'], outputs=['out-{tolerance}.csv'])
+
+
+@pytest.fixture
+def stage_dir(tmp_path, monkeypatch):
+    """
+    Working directory with a stage script that copies in.csv to out-{tolerance}.csv
+    """
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'data').mkdir()
+    (tmp_path / 'copy.py').write_text(SCRIPT)
+    (tmp_path / 'in.csv').write_text('a,b\n1,2\n')
+    (tmp_path / 'params.yaml').write_text(json.dumps({'tolerance': 15, 'export_csv': False}))
+    return tmp_path
+
+
+def test_stage_key_changes_with_params_inputs_and_code(stage_dir):
+    params = {'tolerance': 15, 'export_csv': False}
+    key = get_stage_key(STAGE, params)
+
+    assert get_stage_key(STAGE, {**params, 'export_csv': True}) == key  # not used by the stage
+    assert get_stage_key(STAGE, {**params, 'tolerance': 20}) != key
+
+    (stage_dir / 'in.csv').write_text('a,b\n1,3\n')
+    input_key = get_stage_key(STAGE, params)
+    assert input_key != key
+
+    (stage_dir / 'copy.py').write_text(SCRIPT + '\nprint("done")\n')
+    assert get_stage_key(STAGE, params) not in [key, input_key]
+
+
+def test_is_up_to_date(stage_dir):
+    params = {'tolerance': 15}
+    (stage_dir / 'out-15.csv').write_text('a,b\n1,2\n')
+    key = get_stage_key(STAGE, params)
+    state = {'copy': {'key': key, 'outputs': {'out-15.csv': hash_file('out-15.csv')}}}
+
+    assert is_up_to_date(STAGE, key, state, params)
+    assert not is_up_to_date(STAGE, 'other key', state, params)
+    assert not is_up_to_date(STAGE, key, {}, params)
+
+    # outputs changed or removed since the last run
+    (stage_dir / 'out-15.csv').write_text('edited')
+    assert not is_up_to_date(STAGE, key, state, params)
+    (stage_dir / 'out-15.csv').unlink()
+    assert not is_up_to_date(STAGE, key, state, params)
+
+
+def test_is_forced():
+    remote = Stage(name='download', script='download.py', remote=True)
+
+    assert not is_forced(STAGE, [], offline=False)
+    assert is_forced(STAGE, ['copy'], offline=False)
+    assert is_forced(STAGE, ['all'], offline=True)
+    assert is_forced(remote, [], offline=False)
+    assert not is_forced(remote, [], offline=True)
+
+
+def test_unchanged_stage_skipped(stage_dir, monkeypatch, capsys):
+    monkeypatch.setattr(pipeline, 'STAGES', [STAGE])
+    monkeypatch.setattr(sys, 'argv', ['pipeline.py'])
+
+    pipeline.main()
+    assert 'copy: done' in capsys.readouterr().out
+
+    pipeline.main()
+    assert 'copy: up to date, skipping' in capsys.readouterr().out
+    assert (stage_dir / 'runs.txt').read_text() == 'ran\n'
+
+    # a changed input runs it again
+    (stage_dir / 'in.csv').write_text('a,b\n1,3\n')
+    pipeline.main()
+    assert 'copy: done' in capsys.readouterr().out
+    assert (stage_dir / 'out-15.csv').read_text() == 'a,b\n1,3\n'
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from recency import get_periods, get_recency_weight_table, get_recency_weights
+
+
+@pytest.fixture
+def collisions() -> pd.DataFrame:
+    return pd.DataFrame({
+        'year': [2020, 2018, 2022, 2020, 2019, 2021],
+        'date': ['2020-03-01', '2018-01-15', '2022-12-31', '2020-03-30', '2019-12-01', '2021-06-10'],
+    }, index=[3, 0, 3, 1, 2, 0])  # weights are assigned to the collisions by index, so keep theirs
+
+
+def test_log_matches_baseline(collisions):
+    years, min_year = collisions['year'], collisions['year'].min()
+
+    weights = get_recency_weights(collisions, {'scheme': 'log', 'log': {'offset': 5}})
+
+    np.testing.assert_allclose(weights, np.log10(years - min_year + 5))
+    assert weights.index.equals(collisions.index)
+
+    # offset in params.yaml, as in the previous row-wise weighting in 02-filter-data.py
+    weights = get_recency_weights(collisions, {'scheme': 'log', 'log': {'offset': 6}})
+    np.testing.assert_allclose(weights, np.log10(years - min_year + 6))
+
+
+def test_exponential_halves_every_half_life(collisions):
+    weights = get_recency_weights(collisions, {'scheme': 'exponential', 'exponential': {'half_life': 2}})
+
+    np.testing.assert_allclose(weights, 0.5 ** ((2022 - collisions['year']) / 2))
+    assert weights[collisions['year'] == 2022].tolist() == [1]
+    assert weights[collisions['year'] == 2020].tolist() == [.5, .5]
+
+
+def test_linear_from_min_weight_to_one(collisions):
+    weights = get_recency_weights(collisions, {'scheme': 'linear', 'linear': {'min_weight': .5}})
+
+    assert weights.tolist() == [.75, .5, 1, .75, .625, .875]
+
+    # a single year gets full weight rather than dividing by zero
+    weights = get_recency_weights(collisions[collisions['year'] == 2020], {'scheme': 'linear'})
+    assert weights.tolist() == [1, 1]
+
+
+def test_monthly_uses_collision_date(collisions):
+    weights = get_recency_weights(collisions, {'scheme': 'monthly', 'monthly': {'half_life': 12}})
+
+    months_back = np.array([33, 59, 0, 33, 36, 18])  # from 2022-12
+    np.testing.assert_allclose(weights, 0.5 ** (months_back / 12))
+    assert get_periods(collisions, 'month').tolist() == [2020 * 12 + 2, 2018 * 12, 2022 * 12 + 11, 2020 * 12 + 2, 2019 * 12 + 11, 2021 * 12 + 5]
+
+
+def test_recency_weight_table_has_one_weight_per_period(collisions):
+    periods = get_periods(collisions, 'year')
+
+    table = get_recency_weight_table(periods, {'scheme': 'log'})
+
+    assert table.index.tolist() == [2018, 2019, 2020, 2021, 2022]
+    np.testing.assert_allclose(table, np.log10(np.arange(5) + 6))
+
+    # each collision gets its period's weight from the table
+    weights = get_recency_weights(collisions, {'scheme': 'log'})
+    assert weights.tolist() == table.loc[periods].tolist()
+
+
+def test_unknown_scheme(collisions):
+    with pytest.raises(ValueError, match='Unknown recency weighting scheme'):
+        get_recency_weights(collisions, {'scheme': 'quadratic'})
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import shapely
+
+from road_snapping import snap_to_roads
+
+
+def make_edges() -> pd.DataFrame:
+    """
+    Old Street from junction 1 (with Goswell Road) to junction 2 (with City Road),
+    and Bath Street running parallel 10m north of it, in BNG metres
+    """
+    edges = [
+        (1, 2, [(0, 0), (100, 0)], ['OLD STREET']),
+        (1, 4, [(0, 0), (0, 100)], ['GOSWELL ROAD']),
+        (2, 3, [(100, 0), (100, 100)], ['CITY ROAD']),
+        (5, 6, [(0, 10), (100, 10)], ['BATH STREET']),
+    ]
+    return pd.DataFrame({
+        'u': [u for u, _, _, _ in edges],
+        'v': [v for _, v, _, _ in edges],
+        'geometry': shapely.linestrings([coordinates for _, _, coordinates, _ in edges]),
+        'names': [names for _, _, _, names in edges],
+    })
+
+
+def test_snaps_to_end_of_road_named_in_location():
+    snapped = snap_to_roads(
+        np.array([[20, -5], [20, -5], [20, -5]]),
+        pd.Series(['OLD STREET J/W CITY ROAD', 'Old Street j/w Goswell Road', None]),
+        make_edges(),
+        max_distance=50
+    )
+
+    # the City Road end, even though the collision is nearer the Goswell Road end
+    assert snapped['junction_id'].tolist() == [2, 1, 1]
+    assert np.allclose(snapped['distance_to_road'], 5)
+
+
+def test_ties_split_by_road_named_in_location():
+    snapped = snap_to_roads(
+        np.array([[80, 5], [80, 5]]),
+        pd.Series(['BATH STREET', 'OLD STREET']),
+        make_edges(),
+        max_distance=50
+    )
+
+    assert snapped['junction_id'].tolist() == [6, 2]
+
+
+def test_collisions_far_from_roads_dropped():
+    snapped = snap_to_roads(
+        np.array([[50, -5], [50, -500]]),
+        pd.Series(['OLD STREET', 'OLD STREET']),
+        make_edges(),
+        max_distance=50
+    )
+
+    assert snapped['position'].tolist() == [0]
+
+
+def test_abbreviated_location_text():
+    snapped = snap_to_roads(
+        np.array([[20, -5], [80, 5]]),
+        pd.Series(['OLD ST J/W CITY RD', 'Bath St']),
+        make_edges(),
+        max_distance=50
+    )
+
+    assert snapped['junction_id'].tolist() == [2, 6]
+
+
+def test_road_refs_match_whole_words():
+    edges = make_edges()
+    edges['names'] = [['OLD STREET'], ['A1'], ['A10'], ['BATH STREET']]
+
+    snapped = snap_to_roads(np.array([[20, -5]]), pd.Series(['OLD STREET J/W A10']), edges, max_distance=50)
+
+    # A1 is in A10 as text, but the location only names the A10 end
+    assert snapped['junction_id'].tolist() == [2]
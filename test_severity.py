@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from severity import SEVERITIES, recalculate_severities
+from reference import recalculate_severity
+
+
+@pytest.fixture
+def casualties() -> pd.DataFrame:
+    return pd.DataFrame({
+        'collision_id': [5, 5, 5, 1, 1, 3, 3, 3, 4, 2, 2, 7],
+        'mode_of_travel': [
+            'pedal_cycle', 'pedal_cycle', 'pedestrian', 'pedestrian', 'car', 'pedal_cycle',
+            'pedal_cycle', 'pedestrian', 'pedal_cycle', 'car', 'pedestrian', 'pedal_cycle'
+        ],
+        'casualty_severity': [
+            'slight', 'serious', 'fatal', 'slight', 'fatal', 'slight',
+            'slight', np.nan, 'serious', 'slight', 'serious', np.nan
+        ],  # collision 3's only pedestrian + collision 7's only casualty have unknown severities
+    })
+
+
+@pytest.fixture
+def severities(casualties) -> pd.DataFrame:
+    return recalculate_severities(casualties, ['pedal_cycle', 'pedestrian'], {'pedal_cycle': 'cyclist'})
+
+
+def join_severities(collisions: pd.DataFrame, severities: pd.DataFrame, casualty_type: str) -> pd.DataFrame:
+    """
+    Join severities back to the collisions as 02-filter-data.py does
+    """
+    collisions = collisions.merge(severities, how='left', on='collision_id')
+
+    casualty_count_cols = [f'{severity}_{casualty_type}_casualties' for severity in SEVERITIES]
+    collisions[casualty_count_cols] = collisions[casualty_count_cols].fillna(0).astype('int8')
+
+    # None from the row-wise version, NaN from the categorical
+    max_severity = f'max_{casualty_type}_severity'
+    collisions[max_severity] = collisions[max_severity].astype(object).where(collisions[max_severity].notnull())
+
+    return collisions
+
+
+def test_recalculate_severities_matches_per_mode(casualties, severities):
+    collisions = pd.DataFrame({'collision_id': [1, 2, 3, 4, 5, 6, 7]})
+
+    for mode, casualty_type in [('pedal_cycle', 'cyclist'), ('pedestrian', 'pedestrian')]:
+        columns = ['collision_id'] + [f'{severity}_{casualty_type}_casualties' for severity in SEVERITIES]
+        columns += [f'max_{casualty_type}_severity']
+
+        expected = join_severities(collisions, recalculate_severity(casualties, mode), casualty_type)
+        result = join_severities(collisions, severities[columns], casualty_type)
+
+        pd.testing.assert_frame_equal(result, expected)
+
+    # unknown severities are not counted, so collision 3 has no pedestrian severity + collision 7 no
+    # row at all, i.e. NaN counts until the fillna(0) in 02-filter-data.py
+    assert 7 not in severities['collision_id'].tolist()
+    max_pedestrian_severity = severities.set_index('collision_id')['max_pedestrian_severity']
+    assert max_pedestrian_severity.isnull().to_dict() == {1: False, 2: False, 3: True, 4: True, 5: False}
+
+
+def test_recalculate_severities_counts(severities):
+    severities = severities.set_index('collision_id')
+
+    assert severities.loc[5, ['fatal_cyclist_casualties', 'serious_cyclist_casualties', 'slight_cyclist_casualties']].tolist() == [0, 1, 1]
+    assert severities.loc[5, 'max_cyclist_severity'] == 'serious'
+    assert severities.loc[5, 'max_pedestrian_severity'] == 'fatal'
+    assert severities['fatal_cyclist_casualties'].dtype == 'int8'
+    assert severities['max_cyclist_severity'].cat.categories.tolist() == SEVERITIES
@@ -0,0 +1,132 @@
+import threading
+import pytest
+import pandas as pd
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from tfl_extracts import fetch_links, parse_extract, parse_extracts, sniff_header
+
+FIXTURES = {
+    '/2023-gla-data-extract-attendant.csv': (
+        'TfL collision extract 2023,,,\n'
+        ',,,\n'
+        'Accident Ref.,Borough,Easting,Northing\n'
+        '0123456789,CAMDEN,529000,182000\n'
+        '0123456790,WESTMINSTER,530000,180000\n'
+    ),
+    '/2024-gla-data-extract-attendant.csv': (
+        '_Collision Id,Borough,Easting,Northing\n'
+        '4812345678,CITY OF LONDON,532000,181000\n'
+    ),
+}
+ALIASES = {
+    'Accident Ref.': 'raw_collision_id',
+    '_Collision Id': 'raw_collision_id',
+    'Borough': 'borough',
+    'Easting': 'easting',
+    'Northing': 'northing',
+}
+REQUIRED_COLS = ['raw_collision_id', 'borough', 'easting', 'northing']
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """
+    Stand-in for the TfL content server, supports ETag revalidation
+    """
+    requests_seen = []
+
+    def do_GET(self):
+        body = FIXTURES.get(self.path)
+        if body is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        etag = f'"{hash(body)}"'
+        status = 304 if self.headers.get('If-None-Match') == etag else 200
+        self.requests_seen.append((self.path, status))
+
+        self.send_response(status)
+        self.send_header('ETag', etag)
+        self.end_headers()
+        if status == 200:
+            self.wfile.write(body.encode('utf-8'))
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    FixtureHandler.requests_seen = []
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_port}'
+    httpd.shutdown()
+
+
+def test_fetch_links_caches_and_revalidates(server, tmp_path):
+    links = [server + path for path in FIXTURES]
+
+    paths = fetch_links(links, cache_dir=tmp_path, max_workers=2)
+    assert sorted(status for _, status in FixtureHandler.requests_seen) == [200, 200]
+    for link, path in paths.items():
+        assert open(path).read() == FIXTURES[link[len(server):]]
+
+    # second run only revalidates
+    FixtureHandler.requests_seen = []
+    assert fetch_links(links, cache_dir=tmp_path, max_workers=2) == paths
+    assert sorted(status for _, status in FixtureHandler.requests_seen) == [304, 304]
+
+
+def test_fetch_links_offline(server, tmp_path):
+    links = [server + path for path in FIXTURES]
+    paths = fetch_links(links, cache_dir=tmp_path)
+
+    FixtureHandler.requests_seen = []
+    assert fetch_links(links, cache_dir=tmp_path, offline=True) == paths
+    assert FixtureHandler.requests_seen == []
+
+    with pytest.raises(FileNotFoundError):
+        fetch_links([server + '/not-cached.csv'], cache_dir=tmp_path, offline=True)
+
+
+def test_parse_extracts(server, tmp_path):
+    links = [server + path for path in FIXTURES]
+    paths = fetch_links(links, cache_dir=tmp_path)
+
+    dfs = parse_extracts([paths[link] for link in links], REQUIRED_COLS, ALIASES, max_workers=2)
+
+    assert [len(df) for df in dfs] == [2, 1]
+    df = pd.concat(dfs)
+    assert list(df.columns) == REQUIRED_COLS
+    assert df['raw_collision_id'].tolist() == [123456789, 123456790, 4812345678]
+
+
+def test_sniff_header(tmp_path):
+    path = tmp_path / 'extract.csv'
+    path.write_text(FIXTURES['/2023-gla-data-extract-attendant.csv'])
+
+    skiprows, offset_bytes, renames = sniff_header(path, REQUIRED_COLS, ALIASES, sniff_bytes=8)
+
+    assert skiprows == 2
+    assert offset_bytes == len('TfL collision extract 2023,,,\n,,,\n')
+    assert renames == {
+        'Accident Ref.': 'raw_collision_id',
+        'Borough': 'borough',
+        'Easting': 'easting',
+        'Northing': 'northing',
+    }
+
+
+def test_sniff_header_with_byte_order_mark(tmp_path):
+    path = tmp_path / 'extract.csv'
+    path.write_bytes(b'\xef\xbb\xbf' + FIXTURES['/2024-gla-data-extract-attendant.csv'].encode('utf-8'))
+
+    skiprows, offset_bytes, renames = sniff_header(path, REQUIRED_COLS, ALIASES)
+
+    assert skiprows == 0
+    assert renames['_Collision Id'] == 'raw_collision_id'
+
+    df = parse_extract(str(path), REQUIRED_COLS, ALIASES)
+    assert df['raw_collision_id'].tolist() == [4812345678]